@@ -1,7 +1,525 @@
-import pandas as pd
-import tkinter as tk
-from tkinter import filedialog, messagebox, ttk
 import os
+import re
+import sys
+import glob
+import json
+import time
+import argparse
+
+# pandas and tkinter are imported by the code paths that need them: --help
+# loads neither and batch runs never load tkinter
+
+
+def import_gui_modules():
+    """Import tkinter only when the GUI is started"""
+    global tk, filedialog, messagebox, ttk
+    import tkinter as tk
+    from tkinter import filedialog, messagebox, ttk
+
+
+LINEROUTES_COLUMNS = ['NAME', 'LINKRUNTIME', 'MAX:LINEROUTEITEMS\\VOL(AP)']
+
+HUB_PATTERNS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'hub_patterns.json')
+HUB_RULES = ('first_stop', 'any_stop')
+UNKNOWN_HUB = 'Unknown Hub'
+
+# Columns and severities of the data-quality report
+VALIDATION_COLUMNS = ['Check', 'Severity', 'LineName', 'LineRouteName', 'Stop', 'Value', 'Message']
+VALIDATION_SEVERITIES = ('error', 'warning', 'info')
+
+# Used when hub_patterns.json is missing
+DEFAULT_HUB_PATTERNS = {
+    'rule': 'first_stop',
+    'hubs': [
+        {'name': 'Ext. Hub01', 'pattern': r'Ext\. Hub01', 'priority': 1},
+        {'name': 'Ext. Hub02', 'pattern': r'Ext\. Hub02', 'priority': 2},
+        {'name': 'Gate3', 'pattern': r'Gate3', 'priority': 3},
+    ]
+}
+
+
+def detect_sheets(sheet_names):
+    """Return the (Line Route Item sheet, Lineroutes sheet) names found in a workbook"""
+    line_route_item_sheet = None
+    lineroutes_sheet = None
+
+    # Look for Line Route Item sheet
+    for sheet_name in sheet_names:
+        if "lineroute items" in sheet_name.lower():
+            line_route_item_sheet = sheet_name
+            break
+
+    # If not found, try alternative names
+    if not line_route_item_sheet:
+        for sheet_name in sheet_names:
+            if "lineroute item" in sheet_name.lower():
+                line_route_item_sheet = sheet_name
+                break
+
+    # Look for Lineroutes sheet
+    for sheet_name in sheet_names:
+        if sheet_name.lower() == "lineroutes":
+            lineroutes_sheet = sheet_name
+            break
+
+    # If not found, try alternative names
+    if not lineroutes_sheet:
+        for sheet_name in sheet_names:
+            if "lineroutes" in sheet_name.lower() and sheet_name != line_route_item_sheet:
+                lineroutes_sheet = sheet_name
+                break
+
+    return line_route_item_sheet, lineroutes_sheet
+
+
+def detect_stop_columns(columns):
+    """Return (stop point column, stop name column) of a Line Route Item sheet, raising ValueError if missing"""
+    # Check for required columns in Line Route Item sheet - handle different column names
+    required_columns_variations = [
+        ['$LINEROUTEITEM:LINENAME', 'LINEROUTENAME', 'STOPPOINTNO'],  # original
+        ['$LINEROUTEITEM:LINENAME', 'LINEROUTENAME', 'SSTOPPOINT:NO']  # new variation
+    ]
+
+    stop_name_columns = ['STOPPOINT\\NAME', 'STOPPOINT/NAME', 'STOPPOINT NAME']
+
+    # Find the correct set of columns
+    missing_columns = []
+    stop_point_col = None
+
+    for column_set in required_columns_variations:
+        missing_columns = [col for col in column_set if col not in columns]
+        if not missing_columns:
+            # Found matching column set
+            if 'STOPPOINTNO' in column_set:
+                stop_point_col = 'STOPPOINTNO'
+            else:
+                stop_point_col = 'SSTOPPOINT:NO'
+            break
+
+    if missing_columns:
+        raise ValueError(f"Missing columns in Line Route Item sheet: {', '.join(missing_columns)}")
+
+    # Find the correct stop name column
+    stop_name_col = None
+    for col in stop_name_columns:
+        if col in columns:
+            stop_name_col = col
+            break
+
+    if not stop_name_col:
+        raise ValueError(f"Could not find stop name column. Available columns: {list(columns)}")
+
+    return stop_point_col, stop_name_col
+
+
+class VisumWorkbook:
+    """An opened Visum export with its detected sheets and columns.
+
+    Opening the workbook and detecting sheets and stop columns only reads the
+    workbook metadata and the header rows; sheet bodies are read on first use
+    and kept, so processing and exporting reuse them.
+    """
+
+    def __init__(self, path):
+        import pandas as pd
+
+        self.path = path
+        self.excel_file = pd.ExcelFile(path)
+        self.sheet_names = self.excel_file.sheet_names
+        self.line_route_item_sheet, self.lineroutes_sheet = detect_sheets(self.sheet_names)
+        self._columns = {}
+        self._sheets = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self.excel_file.close()
+        self._sheets.clear()
+
+    def has_required_sheets(self):
+        return bool(self.line_route_item_sheet and self.lineroutes_sheet)
+
+    def columns(self, sheet_name):
+        """Header of a sheet, without reading its rows"""
+        import pandas as pd
+
+        if sheet_name not in self._columns:
+            if sheet_name in self._sheets:
+                self._columns[sheet_name] = list(self._sheets[sheet_name].columns)
+            else:
+                self._columns[sheet_name] = list(pd.read_excel(self.excel_file, sheet_name=sheet_name, nrows=0).columns)
+        return self._columns[sheet_name]
+
+    def stop_columns(self):
+        """(stop point column, stop name column) of the Line Route Item sheet, raising ValueError if missing"""
+        return detect_stop_columns(self.columns(self.line_route_item_sheet))
+
+    def missing_lineroutes_columns(self):
+        lineroutes_columns = self.columns(self.lineroutes_sheet)
+        return [col for col in LINEROUTES_COLUMNS if col not in lineroutes_columns]
+
+    def read(self, sheet_name):
+        import pandas as pd
+
+        if sheet_name not in self._sheets:
+            self._sheets[sheet_name] = pd.read_excel(self.excel_file, sheet_name=sheet_name)
+        return self._sheets[sheet_name]
+
+    def read_inputs(self):
+        """(Line Route Item data, Lineroutes data), raising ValueError if a sheet was not detected"""
+        if not self.has_required_sheets():
+            raise ValueError("Could not detect required sheets in the Excel file!")
+        return self.read(self.line_route_item_sheet), self.read(self.lineroutes_sheet)
+
+
+class HubMatcher:
+    """Recognise hubs in stop names from a configurable pattern table.
+
+    Every hub has a regular expression and a priority (lower wins when a stop
+    name matches several hubs). The table is compiled once into a single
+    pattern. With the 'first_stop' rule a line's hub comes from its first named
+    stop, with 'any_stop' from the best match over all of its stops.
+    """
+
+    def __init__(self, hubs, rule='first_stop'):
+        if rule not in HUB_RULES:
+            raise ValueError(f"Unknown hub rule '{rule}', expected one of: {', '.join(HUB_RULES)}")
+
+        # Stable sort keeps the table order between equal priorities
+        self.hubs = sorted(hubs, key=lambda hub: hub.get('priority', 0))
+        self.hub_names = [hub['name'] for hub in self.hubs]
+        self.rule = rule
+
+        # Anchored alternation of lookaheads: branches are tried in priority order and
+        # the first hub whose pattern occurs anywhere in the name wins. The empty
+        # marker group closing each branch tells which hub matched.
+        branches = []
+        for i, hub in enumerate(self.hubs):
+            try:
+                re.compile(hub['pattern'])
+            except re.error as e:
+                raise ValueError(f"Invalid pattern for hub '{hub['name']}': {e}")
+            branches.append(f"(?=.*?(?:{hub['pattern']}))(?P<hub{i}>)")
+        self.regex = re.compile('^(?:' + '|'.join(branches) + ')', re.DOTALL) if branches else None
+
+    def match(self, stop_name):
+        """Hub name for one stop name, or None"""
+        rank = self.match_rank(stop_name)
+        return self.hub_names[rank] if rank >= 0 else None
+
+    def match_rank(self, stop_name):
+        if self.regex is None:
+            return -1
+        m = self.regex.match(stop_name)
+        return int(m.lastgroup[len('hub'):]) if m else -1
+
+    def rank_names(self, stop_names):
+        """Hub rank (position in hub_names) of every stop name in a Series, -1 where no hub matches"""
+        import numpy as np
+        import pandas as pd
+
+        # Stop names repeat across lines, so each distinct name is matched only once
+        codes, uniques = pd.factorize(stop_names.astype(str))
+        unique_ranks = np.fromiter((self.match_rank(name) for name in uniques), dtype=np.int64, count=len(uniques))
+        return np.where(codes >= 0, unique_ranks[np.maximum(codes, 0)], -1)
+
+    def line_hubs(self, data, line_col, stop_name_col):
+        """Map every line of a Line Route Item table to its hub name"""
+        import numpy as np
+        import pandas as pd
+
+        names = data[stop_name_col]
+        valid = names.notna() & (names.astype(str).str.strip() != '')
+        valid_data = data.loc[valid, [line_col, stop_name_col]]
+
+        if self.rule == 'first_stop':
+            # First valid stop name of each line, in file order
+            line_names = valid_data.groupby(line_col, sort=False)[stop_name_col].first()
+            ranks = pd.Series(self.rank_names(line_names), index=line_names.index)
+        else:
+            row_ranks = self.rank_names(valid_data[stop_name_col])
+            # Unmatched stops must never beat a matched one
+            row_ranks = np.where(row_ranks >= 0, row_ranks, len(self.hub_names))
+            ranks = pd.Series(row_ranks, index=valid_data.index).groupby(valid_data[line_col], sort=False).min()
+            ranks[ranks == len(self.hub_names)] = -1
+
+        hub_names = np.array(self.hub_names + [UNKNOWN_HUB], dtype=object)
+        line_hubs = pd.Series(hub_names[ranks.to_numpy()], index=ranks.index)
+        # Lines without any named stop
+        return line_hubs.reindex(data[line_col].unique(), fill_value=UNKNOWN_HUB)
+
+
+def load_hub_matcher(path=None, rule=None):
+    """Build a HubMatcher from a hub pattern JSON file (hub_patterns.json next to this script by default)"""
+    if path is None and os.path.exists(HUB_PATTERNS_FILE):
+        path = HUB_PATTERNS_FILE
+
+    if path is None:
+        config = DEFAULT_HUB_PATTERNS
+    else:
+        with open(path, encoding='utf-8') as f:
+            config = json.load(f)
+
+    hubs = config.get('hubs', [])
+    for hub in hubs:
+        if 'name' not in hub or 'pattern' not in hub:
+            raise ValueError(f"Every hub needs a 'name' and a 'pattern': {hub}")
+    return HubMatcher(hubs, rule or config.get('rule', 'first_stop'))
+
+
+def format_stop_numbers(stop_numbers):
+    """Convert stop numbers to integers and remove .0 decimal points"""
+    import pandas as pd
+
+    formatted_stops = []
+    for stop in stop_numbers:
+        try:
+            # Convert to integer to remove decimal points
+            formatted_stop = str(int(float(stop))) if pd.notna(stop) else ''
+            formatted_stops.append(formatted_stop)
+        except (ValueError, TypeError):
+            # If conversion fails, use original value
+            formatted_stops.append(str(stop))
+    return formatted_stops
+
+
+def build_stops_table(data, lineroutes_data, hub_matcher=None):
+    """Clean, group and merge the two Visum sheets into the stage 1 output table.
+
+    Returns (output_df, null_removed, duplicates_removed).
+    """
+    import pandas as pd
+
+    stop_point_col, stop_name_col = detect_stop_columns(data.columns)
+
+    # Check for required columns in Lineroutes sheet
+    lineroutes_missing_columns = [col for col in LINEROUTES_COLUMNS if col not in lineroutes_data.columns]
+    if lineroutes_missing_columns:
+        raise ValueError(f"Missing columns in Lineroutes sheet: {', '.join(lineroutes_missing_columns)}")
+
+    # Remove rows with null values in StopPointNo
+    initial_count = len(data)
+    data_clean = data.dropna(subset=[stop_point_col])
+    null_removed = initial_count - len(data_clean)
+
+    # Remove duplicates
+    data_clean = data_clean.drop_duplicates(subset=['$LINEROUTEITEM:LINENAME', 'LINEROUTENAME', stop_point_col])
+    duplicates_removed = (initial_count - null_removed) - len(data_clean)
+
+    # First, get hub name for each LineName (same for all routes in the same line)
+    if hub_matcher is None:
+        hub_matcher = load_hub_matcher()
+    line_hubs = hub_matcher.line_hubs(data_clean, '$LINEROUTEITEM:LINENAME', stop_name_col)
+
+    # Group and aggregate data with hub name
+    grouped_data = data_clean.groupby(['$LINEROUTEITEM:LINENAME', 'LINEROUTENAME']).agg({
+        stop_point_col: list,
+        stop_name_col: list
+    }).reset_index()
+
+    grouped_data['HubName'] = grouped_data['$LINEROUTEITEM:LINENAME'].map(line_hubs)
+
+    # Merge with Lineroutes data based on LINEROUTENAME = NAME
+    merged_data = grouped_data.merge(
+        lineroutes_data[LINEROUTES_COLUMNS],
+        left_on='LINEROUTENAME',
+        right_on='NAME',
+        how='left'
+    )
+
+    output_data = []
+    for _, row in merged_data.iterrows():
+        # Format stop numbers to remove .0
+        formatted_stops = format_stop_numbers(row[stop_point_col])
+        output_data.append({
+            '$LINEROUTEITEM:LINENAME': row['$LINEROUTEITEM:LINENAME'],
+            'LINEROUTENAME': row['LINEROUTENAME'],
+            'StopsArray': ' → '.join(formatted_stops),
+            'HubName': row['HubName'],
+            'LINKRUNTIME': row['LINKRUNTIME'],
+            'MAX:LINEROUTEITEMS\\VOL(AP)': row['MAX:LINEROUTEITEMS\\VOL(AP)']
+        })
+
+    output_df = pd.DataFrame(output_data, columns=[
+        '$LINEROUTEITEM:LINENAME', 'LINEROUTENAME', 'StopsArray', 'HubName',
+        'LINKRUNTIME', 'MAX:LINEROUTEITEMS\\VOL(AP)'
+    ])
+    return output_df, null_removed, duplicates_removed
+
+
+def validate_inputs(data, lineroutes_data, hub_matcher=None):
+    """Data-quality checks over both Visum sheets, as one table of offending rows.
+
+    Every check is a column operation over the whole sheet; the result has one
+    row per issue with the VALIDATION_COLUMNS and is sorted by severity.
+    """
+    import pandas as pd
+
+    stop_point_col, stop_name_col = detect_stop_columns(data.columns)
+    lineroutes_missing_columns = [col for col in LINEROUTES_COLUMNS if col not in lineroutes_data.columns]
+    if lineroutes_missing_columns:
+        raise ValueError(f"Missing columns in Lineroutes sheet: {', '.join(lineroutes_missing_columns)}")
+
+    line_col = '$LINEROUTEITEM:LINENAME'
+    route_lines = data[[line_col, 'LINEROUTENAME']].drop_duplicates('LINEROUTENAME').set_index('LINEROUTENAME')[line_col]
+    issues = []
+
+    def add(check, severity, rows, message, line=None, route=None, stop=None, value=None):
+        if not len(rows):
+            return
+        columns = {'LineName': line, 'LineRouteName': route, 'Stop': stop, 'Value': value}
+        issue = pd.DataFrame({name: rows[col].to_numpy() for name, col in columns.items() if col},
+                             index=range(len(rows)))
+        if value:
+            issue['Value'] = issue['Value'].astype(str)
+        issues.append(issue.assign(Check=check, Severity=severity, Message=message))
+
+    # Runtimes and demands of the Lineroutes sheet, parsed like RouteAnalyzer does
+    lineroutes = lineroutes_data.assign(LineName=lineroutes_data['NAME'].map(route_lines))
+    runtime = pd.to_numeric(lineroutes['LINKRUNTIME'].astype(str).str.replace('s', '', regex=False).str.strip(),
+                            errors='coerce')
+    add('invalid_runtime', 'error', lineroutes[runtime.isna()], "LINKRUNTIME is missing or not a number",
+        'LineName', 'NAME', value='LINKRUNTIME')
+    add('negative_runtime', 'error', lineroutes[runtime < 0], "LINKRUNTIME is negative",
+        'LineName', 'NAME', value='LINKRUNTIME')
+    add('zero_runtime', 'warning', lineroutes[runtime == 0], "LINKRUNTIME is zero, the cycle time only counts dwell time",
+        'LineName', 'NAME', value='LINKRUNTIME')
+
+    demand_col = 'MAX:LINEROUTEITEMS\\VOL(AP)'
+    demand = pd.to_numeric(lineroutes[demand_col], errors='coerce')
+    add('invalid_demand', 'error', lineroutes[demand.isna()], "VOL(AP) is missing or not a number",
+        'LineName', 'NAME', value=demand_col)
+    add('negative_demand', 'error', lineroutes[demand < 0], "VOL(AP) is negative", 'LineName', 'NAME', value=demand_col)
+    add('zero_demand', 'warning', lineroutes[demand == 0], "VOL(AP) is zero, no buses are planned for this route",
+        'LineName', 'NAME', value=demand_col)
+
+    add('duplicate_lineroute', 'warning', lineroutes[lineroutes['NAME'].duplicated(keep='first')],
+        "NAME appears more than once in the Lineroutes sheet, the route is duplicated by the merge", 'LineName', 'NAME')
+    add('unused_lineroute', 'info', lineroutes[lineroutes['LineName'].isna()],
+        "NAME has no items in the Line Route Item sheet", route='NAME')
+
+    # Routes of the item sheet without a Lineroutes row get no runtime and no demand
+    routes = route_lines.reset_index()
+    add('missing_lineroute', 'error', routes[~routes['LINEROUTENAME'].isin(lineroutes_data['NAME'])],
+        "LINEROUTENAME has no matching NAME in the Lineroutes sheet", line_col, 'LINEROUTENAME')
+
+    route_counts = routes.groupby(line_col, sort=False)['LINEROUTENAME'].nunique().rename('Routes').reset_index()
+    add('single_route', 'warning', route_counts[route_counts['Routes'] == 1], "Line has only one route",
+        line_col, value='Routes')
+    add('many_routes', 'warning', route_counts[route_counts['Routes'] > 2], "Line has more than two routes, they are run in sequence",
+        line_col, value='Routes')
+
+    stops = data.dropna(subset=[stop_point_col])
+    add('duplicate_stop', 'warning', stops[stops.duplicated([line_col, 'LINEROUTENAME', stop_point_col], keep='first')],
+        "Stop appears more than once on the route, the repeat is dropped", line_col, 'LINEROUTENAME', stop_point_col)
+
+    if hub_matcher is None:
+        hub_matcher = load_hub_matcher()
+    line_hubs = hub_matcher.line_hubs(data, line_col, stop_name_col)
+    add('missing_hub', 'warning', pd.DataFrame({line_col: line_hubs.index[line_hubs == UNKNOWN_HUB]}),
+        "No stop name of the line matches a hub pattern", line_col)
+
+    if not issues:
+        return pd.DataFrame(columns=VALIDATION_COLUMNS)
+    report = pd.concat(issues, ignore_index=True).reindex(columns=VALIDATION_COLUMNS)
+    severity_order = report['Severity'].map({severity: i for i, severity in enumerate(VALIDATION_SEVERITIES)})
+    return report.iloc[severity_order.argsort(kind='stable')].reset_index(drop=True)
+
+
+def write_validation_report(issues, output_path):
+    """Summary (count per check) and Issues sheets"""
+    import pandas as pd
+
+    summary = issues.groupby(['Severity', 'Check'], sort=False).size().rename('Rows').reset_index()
+    with pd.ExcelWriter(output_path, engine='openpyxl') as writer:
+        summary.to_excel(writer, sheet_name='Summary', index=False)
+        issues.to_excel(writer, sheet_name='Issues', index=False)
+
+
+def process_workbook(input_path, output_path, hub_matcher=None, validate=False):
+    """Run sheet detection, cleaning, grouping and export for one workbook; returns a manifest entry"""
+    started = time.perf_counter()
+    entry = {'input': str(input_path), 'output': str(output_path)}
+    try:
+        with VisumWorkbook(input_path) as workbook:
+            data, lineroutes_data = workbook.read_inputs()
+        if validate:
+            issues = validate_inputs(data, lineroutes_data, hub_matcher)
+            report_path = os.path.splitext(output_path)[0] + '_Validation.xlsx'
+            write_validation_report(issues, report_path)
+            entry['validation'] = {
+                'report': str(report_path),
+                **{severity: int((issues['Severity'] == severity).sum()) for severity in VALIDATION_SEVERITIES},
+            }
+        output_df, null_removed, duplicates_removed = build_stops_table(data, lineroutes_data, hub_matcher)
+        output_df.to_excel(output_path, index=False)
+
+        entry.update({
+            'status': 'ok',
+            'line_route_item_sheet': workbook.line_route_item_sheet,
+            'lineroutes_sheet': workbook.lineroutes_sheet,
+            'lines': int(output_df['$LINEROUTEITEM:LINENAME'].nunique()),
+            'routes': len(output_df),
+            'null_removed': int(null_removed),
+            'duplicates_removed': int(duplicates_removed),
+        })
+    except Exception as e:
+        entry.update({'status': 'error', 'error': str(e)})
+    entry['seconds'] = round(time.perf_counter() - started, 3)
+    return entry
+
+
+def expand_inputs(source):
+    """Resolve a directory or glob pattern into the list of workbooks to process"""
+    if os.path.isdir(source):
+        paths = glob.glob(os.path.join(source, '*.xlsx')) + glob.glob(os.path.join(source, '*.xls'))
+    else:
+        paths = glob.glob(source)
+    # Skip Excel lock files left by open workbooks
+    return sorted(p for p in paths if not os.path.basename(p).startswith('~$'))
+
+
+def batch_process(input_paths, output_dir, workers=None, hub_matcher=None, validate=False):
+    """Process many workbooks in a process pool and write a run manifest next to the outputs"""
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+
+    os.makedirs(output_dir, exist_ok=True)
+    started = time.perf_counter()
+    if hub_matcher is None:
+        hub_matcher = load_hub_matcher()
+
+    jobs = {}
+    for input_path in input_paths:
+        stem = os.path.splitext(os.path.basename(input_path))[0]
+        jobs[input_path] = os.path.join(output_dir, f"{stem}_Stops_Of_Lines.xlsx")
+
+    entries = []
+    if jobs:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(process_workbook, src, dst, hub_matcher, validate) for src, dst in jobs.items()]
+            for future in as_completed(futures):
+                entry = future.result()
+                entries.append(entry)
+                print(f"[{entry['status']}] {os.path.basename(entry['input'])} ({entry['seconds']}s)")
+
+    entries.sort(key=lambda entry: entry['input'])
+    manifest = {
+        'created': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'output_dir': os.path.abspath(output_dir),
+        'workers': workers or os.cpu_count(),
+        'total_files': len(entries),
+        'succeeded': sum(1 for entry in entries if entry['status'] == 'ok'),
+        'failed': sum(1 for entry in entries if entry['status'] != 'ok'),
+        'seconds': round(time.perf_counter() - started, 3),
+        'files': entries,
+    }
+    with open(os.path.join(output_dir, 'manifest.json'), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2, ensure_ascii=False)
+    return manifest
 
 
 class DarkExcelStopProcessor:
@@ -13,9 +531,12 @@ class DarkExcelStopProcessor:
         self.root.configure(bg='#2b2b2b')
 
         self.file_path = None
+        # Kept open for the session; sheets are read once and reused by process and export
+        self.workbook = None
         self.data = None
         self.lineroutes_data = None
-        self.sheets = []
+        self.output_df = None
+        self.validation_issues = None
 
         self.configure_dark_theme() 
         self.create_widgets()
@@ -95,6 +616,12 @@ class DarkExcelStopProcessor:
         lr_label.grid(row=1, column=0, sticky=tk.W, padx=(0, 10))
         self.lr_sheet_label = ttk.Label(self.sheet_info_frame, text="Not detected", foreground="#4ec9b0")
         self.lr_sheet_label.grid(row=1, column=1, sticky=tk.W)
+
+        # Stop columns, detected from the header row only
+        stop_columns_label = ttk.Label(self.sheet_info_frame, text="Stop columns:")
+        stop_columns_label.grid(row=2, column=0, sticky=tk.W, padx=(0, 10))
+        self.stop_columns_label = ttk.Label(self.sheet_info_frame, text="Not detected", foreground="#4ec9b0")
+        self.stop_columns_label.grid(row=2, column=1, sticky=tk.W)
         
         # Process button
         self.process_btn = ttk.Button(main_frame, text="🚀 PROCESS DATA", 
@@ -167,89 +694,54 @@ class DarkExcelStopProcessor:
             for item in self.tree.get_children():
                 self.tree.delete(item)
             
-            # Get available sheets
+            # Open the workbook and detect sheets and columns from its metadata and header rows
+            if self.workbook is not None:
+                self.workbook.close()
+            self.workbook = None
+            self.data = None
+            self.lineroutes_data = None
+            self.output_df = None
+            self.validation_issues = None
+            self.export_btn.config(state="disabled")
             try:
-                self.sheets = pd.ExcelFile(file_path).sheet_names
-                self.status_var.set(f"Found {len(self.sheets)} sheets in file")
-                
-                # Detect which sheets to use
-                line_route_item_sheet = None
-                lineroutes_sheet = None
-                
-                # Look for Line Route Item sheet
-                for sheet_name in self.sheets:
-                    if "lineroute items" in sheet_name.lower():
-                        line_route_item_sheet = sheet_name
-                        break
-                
-                # If not found, try alternative names
-                if not line_route_item_sheet:
-                    for sheet_name in self.sheets:
-                        if "lineroute item" in sheet_name.lower():
-                            line_route_item_sheet = sheet_name
-                            break
-                
-                # Look for Lineroutes sheet
-                for sheet_name in self.sheets:
-                    if sheet_name.lower() == "lineroutes":
-                        lineroutes_sheet = sheet_name
-                        break
-                
-                # If not found, try alternative names
-                if not lineroutes_sheet:
-                    for sheet_name in self.sheets:
-                        if "lineroutes" in sheet_name.lower() and sheet_name != line_route_item_sheet:
-                            lineroutes_sheet = sheet_name
-                            break
-                
+                self.workbook = VisumWorkbook(file_path)
+                self.status_var.set(f"Found {len(self.workbook.sheet_names)} sheets in file")
+
+                line_route_item_sheet = self.workbook.line_route_item_sheet
+                lineroutes_sheet = self.workbook.lineroutes_sheet
+
                 # Update sheet info labels
                 self.lri_sheet_label.config(text=line_route_item_sheet or "Not found")
                 self.lr_sheet_label.config(text=lineroutes_sheet or "Not found")
-                
+                self.stop_columns_label.config(text="Not detected")
+
                 # Show sheet info frame
                 self.sheet_info_frame.grid()
-                
-                if line_route_item_sheet and lineroutes_sheet:
-                    self.status_var.set(f"Ready to process: {line_route_item_sheet} + {lineroutes_sheet}")
-                    self.process_btn.config(state="normal")
-                else:
+
+                if not self.workbook.has_required_sheets():
                     self.status_var.set("Could not detect required sheets")
                     self.process_btn.config(state="disabled")
-                    
+                    return
+
+                try:
+                    stop_point_col, stop_name_col = self.workbook.stop_columns()
+                    missing_columns = self.workbook.missing_lineroutes_columns()
+                    if missing_columns:
+                        raise ValueError(f"Missing columns in Lineroutes sheet: {', '.join(missing_columns)}")
+                except ValueError as e:
+                    self.status_var.set(f"Error: {str(e)}")
+                    self.process_btn.config(state="disabled")
+                    return
+
+                self.stop_columns_label.config(text=f"{stop_point_col}, {stop_name_col}")
+                self.status_var.set(f"Ready to process: {line_route_item_sheet} + {lineroutes_sheet}")
+                self.process_btn.config(state="normal")
+
             except Exception as e:
                 messagebox.showerror("Error", f"Could not read Excel file: {str(e)}")
                 self.status_var.set("Error reading Excel file")
                 self.process_btn.config(state="disabled")
     
-    def extract_hub_name(self, stop_names):
-        # Filter out empty/NaN values and take the first valid one
-        valid_stop_names = [name for name in stop_names if pd.notna(name) and str(name).strip() != '']
-        
-        if valid_stop_names:
-            first_stop_name = str(valid_stop_names[0])
-            
-            if 'Ext. Hub01' in first_stop_name:
-                return 'Ext. Hub01'
-            elif 'Ext. Hub02' in first_stop_name:
-                return 'Ext. Hub02'
-            elif 'Gate3' in first_stop_name:
-                return 'Gate3'
-        
-        return 'Unknown Hub'
-    
-    def format_stop_numbers(self, stop_numbers):
-        """Convert stop numbers to integers and remove .0 decimal points"""
-        formatted_stops = []
-        for stop in stop_numbers:
-            try:
-                # Convert to integer to remove decimal points
-                formatted_stop = str(int(float(stop))) if pd.notna(stop) else ''
-                formatted_stops.append(formatted_stop)
-            except (ValueError, TypeError):
-                # If conversion fails, use original value
-                formatted_stops.append(str(stop))
-        return formatted_stops
-    
     def process_data(self):
         if not self.file_path:
             messagebox.showerror("Error", "Please select an Excel file first!")
@@ -259,91 +751,11 @@ class DarkExcelStopProcessor:
             self.status_var.set("Processing data...")
             self.root.update()
             
-            # Detect sheets again to ensure we have the right ones
-            line_route_item_sheet = None
-            lineroutes_sheet = None
-            
-            # Look for Line Route Item sheet
-            for sheet_name in self.sheets:
-                if "lineroute items" in sheet_name.lower():
-                    line_route_item_sheet = sheet_name
-                    break
-            
-            # If not found, try alternative names
-            if not line_route_item_sheet:
-                for sheet_name in self.sheets:
-                    if "lineroute item" in sheet_name.lower():
-                        line_route_item_sheet = sheet_name
-                        break
-            
-            # Look for Lineroutes sheet
-            for sheet_name in self.sheets:
-                if sheet_name.lower() == "lineroutes":
-                    lineroutes_sheet = sheet_name
-                    break
-            
-            # If not found, try alternative names
-            if not lineroutes_sheet:
-                for sheet_name in self.sheets:
-                    if "lineroutes" in sheet_name.lower() and sheet_name != line_route_item_sheet:
-                        lineroutes_sheet = sheet_name
-                        break
-            
-            if not line_route_item_sheet or not lineroutes_sheet:
+            # Sheets detected when the file was picked; bodies are read once per workbook
+            if self.workbook is None or not self.workbook.has_required_sheets():
                 messagebox.showerror("Error", "Could not detect required sheets in the Excel file!")
                 return
-            
-            # Read both sheets
-            self.data = pd.read_excel(self.file_path, sheet_name=line_route_item_sheet)
-            self.lineroutes_data = pd.read_excel(self.file_path, sheet_name=lineroutes_sheet)
-            
-            # Check for required columns in Line Route Item sheet - handle different column names
-            required_columns_variations = [
-                ['$LINEROUTEITEM:LINENAME', 'LINEROUTENAME', 'STOPPOINTNO'],  # original
-                ['$LINEROUTEITEM:LINENAME', 'LINEROUTENAME', 'SSTOPPOINT:NO']  # new variation
-            ]
-
-            stop_name_columns = ['STOPPOINT\\NAME', 'STOPPOINT/NAME', 'STOPPOINT NAME',]
-
-            # Find the correct set of columns
-            missing_columns = []
-            stop_point_col = None
-
-            for column_set in required_columns_variations:
-                missing_columns = [col for col in column_set if col not in self.data.columns]
-                if not missing_columns:
-                    # Found matching column set
-                    if 'STOPPOINTNO' in column_set:
-                        stop_point_col = 'STOPPOINTNO'
-                    else:
-                        stop_point_col = 'SSTOPPOINT:NO'
-                    break
-
-            if missing_columns:
-                messagebox.showerror("Error", f"Missing columns in Line Route Item sheet: {', '.join(missing_columns)}")
-                self.status_var.set("Error: Missing columns in Excel file")
-                return
-
-            # Find the correct stop name column
-            stop_name_col = None
-            for col in stop_name_columns:
-                if col in self.data.columns:
-                    stop_name_col = col
-                    break
-
-            if not stop_name_col:
-                messagebox.showerror("Error", f"Could not find stop name column. Available columns: {list(self.data.columns)}")
-                self.status_var.set("Error: Missing stop name column")
-                return
-            
-            # Check for required columns in Lineroutes sheet
-            lineroutes_required_columns = ['NAME', 'LINKRUNTIME', 'MAX:LINEROUTEITEMS\\VOL(AP)']
-            lineroutes_missing_columns = [col for col in lineroutes_required_columns if col not in self.lineroutes_data.columns]
-            
-            if lineroutes_missing_columns:
-                messagebox.showerror("Error", f"Missing columns in Lineroutes sheet: {', '.join(lineroutes_missing_columns)}")
-                self.status_var.set("Error: Missing columns in Lineroutes sheet")
-                return
+            self.data, self.lineroutes_data = self.workbook.read_inputs()
 
             for item in self.tree.get_children():
                 self.tree.delete(item)
@@ -351,64 +763,25 @@ class DarkExcelStopProcessor:
             self.status_var.set("Removing null values and duplicates...")
             self.root.update()
             
-            initial_count = len(self.data)
-            data_clean = self.data.dropna(subset=[stop_point_col])
-            null_removed = initial_count - len(data_clean)
-            
-            # Remove duplicates
-            data_clean = data_clean.drop_duplicates(subset=['$LINEROUTEITEM:LINENAME', 'LINEROUTENAME', stop_point_col])
-            duplicates_removed = (initial_count - null_removed) - len(data_clean)
-            
-            if null_removed > 0:
-                self.status_var.set(f"Removed {null_removed} null entries and {duplicates_removed} duplicates")
-                self.root.update()
-            elif duplicates_removed > 0:
-                self.status_var.set(f"Removed {duplicates_removed} duplicate entries")
-                self.root.update()
-            
-            # First, get hub name for each LineName (same for all routes in the same line)
-            line_hubs = {}
-            for line_name in data_clean['$LINEROUTEITEM:LINENAME'].unique():
-                line_data = data_clean[data_clean['$LINEROUTEITEM:LINENAME'] == line_name]
-                # Get all stop names for this line and extract hub from first valid one
-                all_stop_names = line_data[stop_name_col].dropna().tolist()
-                hub_name = self.extract_hub_name(all_stop_names)
-                line_hubs[line_name] = hub_name
-            
-            grouped_data = data_clean.groupby(['$LINEROUTEITEM:LINENAME', 'LINEROUTENAME']).agg({
-                stop_point_col: list,
-                stop_name_col: list
-            }).reset_index()
-            
-            # Add HubName column using the line-level hub mapping
-            grouped_data['HubName'] = grouped_data['$LINEROUTEITEM:LINENAME'].map(line_hubs)
-            
-            # Merge with Lineroutes data based on LINEROUTENAME = NAME
-            merged_data = grouped_data.merge(
-                self.lineroutes_data[['NAME', 'LINKRUNTIME', 'MAX:LINEROUTEITEMS\\VOL(AP)']],
-                left_on='LINEROUTENAME',
-                right_on='NAME',
-                how='left'
-            )
+            try:
+                output_df, null_removed, duplicates_removed = build_stops_table(self.data, self.lineroutes_data)
+                self.validation_issues = validate_inputs(self.data, self.lineroutes_data)
+                self.output_df = output_df
+            except ValueError as e:
+                messagebox.showerror("Error", str(e))
+                self.status_var.set("Error: Missing columns in Excel file")
+                return
             
             # Add data to treeview
-            for _, row in merged_data.iterrows():
-                # Format stop numbers to remove .0
-                formatted_stops = self.format_stop_numbers(row[stop_point_col])
-                stops_array = ' → '.join(formatted_stops)
-                self.tree.insert("", "end", values=(
-                    row['$LINEROUTEITEM:LINENAME'], 
-                    row['LINEROUTENAME'], 
-                    stops_array, 
-                    row['HubName'],
-                    row['LINKRUNTIME'],
-                    row['MAX:LINEROUTEITEMS\\VOL(AP)']
-                ))
+            for row in output_df.itertuples(index=False):
+                self.tree.insert("", "end", values=tuple(row))
+            
+            severity_counts = self.validation_issues['Severity'].value_counts()
+            validation_text = ", ".join(f"{severity_counts.get(severity, 0)} {severity}s" for severity in VALIDATION_SEVERITIES)
             
-            total_removed = null_removed + duplicates_removed
-            self.status_var.set(f"Successfully processed {len(merged_data)} unique LineRouteNames (removed {null_removed} null + {duplicates_removed} duplicates)")
+            self.status_var.set(f"Successfully processed {len(output_df)} unique LineRouteNames (removed {null_removed} null + {duplicates_removed} duplicates; validation: {validation_text})")
             self.export_btn.config(state="normal")  # Enable export button
-            messagebox.showinfo("Success", f"Processed {len(merged_data)} unique LineRouteNames!\nRemoved {null_removed} null entries and {duplicates_removed} duplicate entries.")
+            messagebox.showinfo("Success", f"Processed {len(output_df)} unique LineRouteNames!\nRemoved {null_removed} null entries and {duplicates_removed} duplicate entries.\n\nValidation: {validation_text}\n(the report is saved next to the exported results)")
             
         except Exception as e:
             error_msg = f"Error processing file: {str(e)}"
@@ -416,97 +789,13 @@ class DarkExcelStopProcessor:
             messagebox.showerror("Error", error_msg)
     
     def export_results(self):
-        if self.data is None or self.data.empty:
+        if self.output_df is None or self.output_df.empty:
             messagebox.showerror("Error", "No data to export! Please process files first.")
             return
         
         try:
-            self.status_var.set("Exporting results...")
-            self.root.update()
-            
-            # Check for required columns in Line Route Item sheet - handle different column names
-            required_columns_variations = [
-                ['$LINEROUTEITEM:LINENAME', 'LINEROUTENAME', 'STOPPOINTNO'],  # original
-                ['$LINEROUTEITEM:LINENAME', 'LINEROUTENAME', 'SSTOPPOINT:NO']  # new variation
-            ]
-
-            stop_name_columns = ['STOPPOINT\\NAME', 'STOPPOINT/NAME', 'STOPPOINT NAME']
-
-            # Find the correct set of columns
-            missing_columns = []
-            stop_point_col = None
-
-            for column_set in required_columns_variations:
-                missing_columns = [col for col in column_set if col not in self.data.columns]
-                if not missing_columns:
-                    # Found matching column set
-                    if 'STOPPOINTNO' in column_set:
-                        stop_point_col = 'STOPPOINTNO'
-                    else:
-                        stop_point_col = 'SSTOPPOINT:NO'
-                    break
-
-            if missing_columns:
-                messagebox.showerror("Error", f"Missing columns in Line Route Item sheet: {', '.join(missing_columns)}")
-                return
+            output_df = self.output_df
 
-            # Find the correct stop name column
-            stop_name_col = None
-            for col in stop_name_columns:
-                if col in self.data.columns:
-                    stop_name_col = col
-                    break
-
-            if not stop_name_col:
-                messagebox.showerror("Error", "Could not find stop name column in data")
-                return
-            
-            # Remove rows with null values in StopPointNo
-            data_clean = self.data.dropna(subset=[stop_point_col])
-            # Remove duplicates
-            data_clean = data_clean.drop_duplicates(subset=['$LINEROUTEITEM:LINENAME', 'LINEROUTENAME', stop_point_col])
-            
-            # First, get hub name for each LineName (same for all routes in the same line)
-            line_hubs = {}
-            for line_name in data_clean['$LINEROUTEITEM:LINENAME'].unique():
-                line_data = data_clean[data_clean['$LINEROUTEITEM:LINENAME'] == line_name]
-                # Get all stop names for this line and extract hub from first valid one
-                all_stop_names = line_data[stop_name_col].dropna().tolist()
-                hub_name = self.extract_hub_name(all_stop_names)
-                line_hubs[line_name] = hub_name
-            
-            # Group and aggregate data with hub name
-            grouped_data = data_clean.groupby(['$LINEROUTEITEM:LINENAME', 'LINEROUTENAME']).agg({
-                stop_point_col: list,
-                stop_name_col: list
-            }).reset_index()
-            
-            grouped_data['HubName'] = grouped_data['$LINEROUTEITEM:LINENAME'].map(line_hubs)
-            
-            # Merge with Lineroutes data
-            merged_data = grouped_data.merge(
-                self.lineroutes_data[['NAME', 'LINKRUNTIME', 'MAX:LINEROUTEITEMS\\VOL(AP)']],
-                left_on='LINEROUTENAME',
-                right_on='NAME',
-                how='left'
-            )
-            
-            output_data = []
-            for _, row in merged_data.iterrows():
-                # Format stop numbers to remove .0
-                formatted_stops = self.format_stop_numbers(row[stop_point_col])
-                stops_string = ' → '.join(formatted_stops)
-                output_data.append({
-                    '$LINEROUTEITEM:LINENAME': row['$LINEROUTEITEM:LINENAME'],
-                    'LINEROUTENAME': row['LINEROUTENAME'],
-                    'StopsArray': stops_string,
-                    'HubName': row['HubName'],
-                    'LINKRUNTIME': row['LINKRUNTIME'],
-                    'MAX:LINEROUTEITEMS\\VOL(AP)': row['MAX:LINEROUTEITEMS\\VOL(AP)']
-                })
-            
-            output_df = pd.DataFrame(output_data)
-            
             # Save to Excel
             output_file = filedialog.asksaveasfilename(
                 title="Save Results As",
@@ -516,6 +805,8 @@ class DarkExcelStopProcessor:
             
             if output_file:
                 output_df.to_excel(output_file, index=False)
+                if self.validation_issues is not None and not self.validation_issues.empty:
+                    write_validation_report(self.validation_issues, os.path.splitext(output_file)[0] + '_Validation.xlsx')
                 self.status_var.set(f"Results exported to {os.path.basename(output_file)}")
                 messagebox.showinfo("Success", f"Results exported to {output_file}")
                 
@@ -524,7 +815,42 @@ class DarkExcelStopProcessor:
             self.status_var.set(f"Export error: {str(e)}")
             messagebox.showerror("Error", error_msg)
 
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Build the stops-of-lines table from Visum exports. Without arguments the GUI is opened."
+    )
+    parser.add_argument('--batch', metavar='INPUT',
+                        help="Folder or glob pattern of Visum workbooks to process without the GUI")
+    parser.add_argument('--output-dir', default='Stops_Of_Lines',
+                        help="Folder for batch outputs and manifest.json (default: Stops_Of_Lines)")
+    parser.add_argument('--workers', type=int, default=None,
+                        help="Number of worker processes (default: number of CPU cores)")
+    parser.add_argument('--hub-patterns', metavar='JSON',
+                        help="Hub pattern table (default: hub_patterns.json next to this script)")
+    parser.add_argument('--hub-rule', choices=HUB_RULES,
+                        help="Match hubs on the first named stop of a line or on any of its stops")
+    parser.add_argument('--validate', action='store_true',
+                        help="Also write a <output>_Validation.xlsx data-quality report per workbook")
+    return parser.parse_args(argv)
+
 def main():
+    args = parse_args()
+
+    if args.batch:
+        input_paths = expand_inputs(args.batch)
+        if not input_paths:
+            print(f"No Excel files found for '{args.batch}'")
+            sys.exit(1)
+        try:
+            hub_matcher = load_hub_matcher(args.hub_patterns, args.hub_rule)
+        except (OSError, ValueError) as e:
+            print(f"Could not load hub patterns: {str(e)}")
+            sys.exit(1)
+        manifest = batch_process(input_paths, args.output_dir, args.workers, hub_matcher, args.validate)
+        print(f"Processed {manifest['succeeded']}/{manifest['total_files']} workbooks in {manifest['seconds']}s")
+        sys.exit(1 if manifest['failed'] else 0)
+
+    import_gui_modules()
     root = tk.Tk()
     
     try:
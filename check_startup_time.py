@@ -0,0 +1,106 @@
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+
+# Measures the startup time of the command line entry points and checks that
+# importing a script or printing its help does not load the heavy modules.
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+HEAVY_MODULES = ('pandas', 'openpyxl', 'tkinter')
+
+# Budget for a CLI invocation that does no work (--help), in seconds
+DEFAULT_BUDGET_SECONDS = 0.15
+
+CLI_ENTRY_POINTS = [
+    'Make_Stops_Of_Lines_South_Med_1.py',
+    'watch_south_med.py',
+    'whatif_service.py',
+    'timetable_generator.py',
+    'day_plan.py',
+    'hub_occupancy_sim.py',
+    'sensitivity_analysis.py',
+    'interlining.py',
+    'result_store.py',
+    'scenario_diff.py',
+    'corridor_analysis.py',
+]
+
+IMPORTED_SCRIPTS = CLI_ENTRY_POINTS + [
+    'plan_engine.py',
+    'operational plan designed 70 percent demand_2.py',
+    'operational plan_desired only_max_demand_2.py',
+    'makee summary hub_3.py',
+]
+
+HEAVY_MODULES_PROBE = """
+import runpy, sys
+script, run_name = sys.argv[1], sys.argv[2]
+sys.argv = [script] + sys.argv[3:]
+sys.path.insert(0, {script_dir!r})
+try:
+    runpy.run_path(script, run_name=run_name)
+except SystemExit:
+    pass
+sys.stderr.write('HEAVY:' + ','.join(m for m in {heavy!r} if m in sys.modules) + '\\n')
+"""
+
+
+def loaded_heavy_modules(script, run_name, args):
+    """Run or import a script in a fresh interpreter and return the heavy modules it loaded"""
+    code = HEAVY_MODULES_PROBE.format(script_dir=SCRIPT_DIR, heavy=HEAVY_MODULES)
+    result = subprocess.run(
+        [sys.executable, '-c', code, os.path.join(SCRIPT_DIR, script), run_name] + args,
+        capture_output=True, text=True, cwd=SCRIPT_DIR
+    )
+    for line in result.stderr.splitlines():
+        if line.startswith('HEAVY:'):
+            return [name for name in line[len('HEAVY:'):].split(',') if name]
+    raise RuntimeError(f"Could not probe {script}: {result.stderr.strip()}")
+
+
+def measure_startup(script, args, repeat):
+    """Best wall-clock time of `python <script> <args>` over several runs"""
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        subprocess.run([sys.executable, os.path.join(SCRIPT_DIR, script)] + args,
+                       capture_output=True, cwd=SCRIPT_DIR)
+        timings.append(time.perf_counter() - started)
+    return min(timings)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Check the startup-time budget of the South Med command line tools.")
+    parser.add_argument('--budget', type=float, default=DEFAULT_BUDGET_SECONDS,
+                        help=f"Maximum seconds for a '--help' run (default: {DEFAULT_BUDGET_SECONDS})")
+    parser.add_argument('--repeat', type=int, default=5, help="Runs per entry point, the best one counts (default: 5)")
+    return parser.parse_args(argv)
+
+
+def main():
+    args = parse_args()
+    failures = 0
+
+    for script in IMPORTED_SCRIPTS:
+        heavy = loaded_heavy_modules(script, 'startup_check', [])
+        status = 'ok' if not heavy else 'FAIL'
+        failures += bool(heavy)
+        print(f"[{status}] import {script}: {', '.join(heavy) or 'no heavy modules'}")
+
+    for script in CLI_ENTRY_POINTS:
+        heavy = loaded_heavy_modules(script, '__main__', ['--help'])
+        seconds = measure_startup(script, ['--help'], args.repeat)
+        over_budget = seconds > args.budget
+        status = 'ok' if not heavy and not over_budget else 'FAIL'
+        failures += bool(heavy) or over_budget
+        print(f"[{status}] {script} --help: {seconds * 1000:.0f} ms (budget {args.budget * 1000:.0f} ms), "
+              f"{', '.join(heavy) or 'no heavy modules'}")
+
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,189 @@
+import argparse
+import http.client
+import json
+import sys
+import threading
+import urllib.error
+import urllib.request
+
+from plan_engine import PLAN_VARIANTS, get_line_summary, load_processed_lines
+from whatif_service import WhatIfPlanner, make_server
+
+
+# Smoke check of the what-if service: starts it on a free localhost port, sends
+# /line, /hub and /batch queries and compares the answers with the plan engine.
+# Runs on a small built-in network unless a stage 1 output is given.
+SAMPLE_LINES = {
+    'L1': [
+        {'LINEROUTENAME': 'L1_R1', 'StopsArray': 'A → B → C → D', 'HubName': 'Gate3', 'LINKRUNTIME': 900, 'VOL_AP_MAX': 420},
+        {'LINEROUTENAME': 'L1_R2', 'StopsArray': 'D → C → B → A', 'HubName': 'Gate3', 'LINKRUNTIME': 840, 'VOL_AP_MAX': 380},
+    ],
+    'L2': [
+        {'LINEROUTENAME': 'L2_R1', 'StopsArray': 'A → E → F', 'HubName': 'Gate3', 'LINKRUNTIME': '1260s', 'VOL_AP_MAX': 150},
+    ],
+    'L3': [
+        {'LINEROUTENAME': 'L3_R1', 'StopsArray': 'G → H → I → J → K', 'HubName': 'Ext. Hub01', 'LINKRUNTIME': 1500, 'VOL_AP_MAX': 975},
+        {'LINEROUTENAME': 'L3_R2', 'StopsArray': 'K → J → I → H → G', 'HubName': 'Ext. Hub01', 'LINKRUNTIME': 1440, 'VOL_AP_MAX': 610},
+    ],
+}
+
+# (bus capacity, headway) pairs queried for every line
+CHECK_OPTIONS = [(50, 15), (25, 7.5), (80, 30)]
+
+# Service field -> key of RouteAnalyzer.analyze_system_with_headway, with the rounding the service applies
+PLAN_FIELDS = {
+    'buses_per_group': ('buses_per_group', None),
+    'total_trips': ('total_trips', None),
+    'groups_per_hour': ('groups_per_hour', None),
+    'unique_groups': ('unique_groups', None),
+    'fleet_size': ('fleet_size_performing_Headway_for_1_Hour', None),
+    'hub_area': ('hub_area_for_1_hour', None),
+    'capacity_per_hour': ('total_capacity_per_hour', 1),
+    'empty_seats_per_hour': ('empty_seats', 1),
+}
+
+
+def post(base_url, path, body):
+    """POST a JSON body and return (status, decoded answer), also for error statuses; status None if the connection dropped"""
+    request = urllib.request.Request(base_url + path, data=json.dumps(body).encode('utf-8'),
+                                     headers={'Content-Type': 'application/json'}, method='POST')
+    try:
+        with urllib.request.urlopen(request, timeout=10) as response:
+            return response.status, json.loads(response.read())
+    except urllib.error.HTTPError as e:
+        return e.code, json.loads(e.read())
+    except (urllib.error.URLError, http.client.HTTPException, ConnectionError):
+        return None, {}
+
+
+def expected_plan(processed_lines, line_summaries, line_name, bus_capacity, headway, dwell_time, variant):
+    """The plan fields of one line as stage 2 computes them"""
+    summary = get_line_summary(line_summaries, processed_lines, line_name, dwell_time, **variant)
+    system_analysis = summary['analyzer'].analyze_system_with_headway(
+        summary['plan_demand'], summary['cycle_time'], headway, bus_capacity
+    )
+    return {field: system_analysis[key] if digits is None else round(system_analysis[key], digits)
+            for field, (key, digits) in PLAN_FIELDS.items()}
+
+
+def plan_mismatches(result, expected):
+    return [f"{field}: {result.get(field)} != {value}" for field, value in expected.items() if result.get(field) != value]
+
+
+def run_checks(base_url, processed_lines, planner, variant, dwell_time=3):
+    """Yield (name, problems) for every check; no problems means the check passed"""
+    line_summaries = {}
+    line_names = {str(line_name): line_name for line_name in processed_lines}
+
+    def expected(line, bus_capacity, headway):
+        return expected_plan(processed_lines, line_summaries, line_names[line], bus_capacity, headway, dwell_time, variant)
+
+    first_line = next(iter(planner.lines))
+    bus_capacity, headway = CHECK_OPTIONS[0]
+    status, answer = post(base_url, '/line', {'line': first_line, 'bus_capacity': bus_capacity, 'headway': headway})
+    problems = [f"status {status}"] if status != 200 else plan_mismatches(answer, expected(first_line, bus_capacity, headway))
+    yield f"/line {first_line} at {bus_capacity} seats every {headway} min", problems
+
+    queries = [{'line': line, 'bus_capacity': bus_capacity, 'headway': headway}
+               for line in planner.lines for bus_capacity, headway in CHECK_OPTIONS]
+    status, answer = post(base_url, '/batch', {'queries': queries})
+    problems = [f"status {status}"] if status != 200 else []
+    for query, result in zip(queries, answer.get('results', []) if not problems else []):
+        problems.extend(f"{query['line']} {query['bus_capacity']}/{query['headway']}: {problem}"
+                        for problem in plan_mismatches(result, expected(**query)))
+    yield f"/batch of {len(queries)} line queries", problems
+
+    for hub, hub_lines in planner.hubs.items():
+        status, answer = post(base_url, '/hub', {'hub': hub, 'bus_capacity': bus_capacity, 'headway': headway})
+        if status != 200:
+            yield f"/hub {hub}", [f"status {status}"]
+            continue
+        problems = []
+        if [result['line'] for result in answer['lines']] != hub_lines:
+            problems.append(f"lines {[result['line'] for result in answer['lines']]} != {hub_lines}")
+        for result in answer['lines']:
+            problems.extend(f"{result['line']}: {problem}"
+                            for problem in plan_mismatches(result, expected(result['line'], bus_capacity, headway)))
+        fleet = sum(expected(line, bus_capacity, headway)['fleet_size'] for line in hub_lines)
+        if answer['totals']['fleet_size'] != fleet:
+            problems.append(f"total fleet {answer['totals']['fleet_size']} != {fleet}")
+        yield f"/hub {hub}", problems
+
+    error_cases = [
+        ('unknown line', '/line', {'line': '__no_such_line__', 'bus_capacity': 50, 'headway': 15}, 404),
+        ('unknown hub', '/hub', {'hub': '__no_such_hub__', 'bus_capacity': 50, 'headway': 15}, 404),
+        ('missing headway', '/line', {'line': first_line, 'bus_capacity': 50}, 400),
+        ('zero headway', '/line', {'line': first_line, 'bus_capacity': 50, 'headway': 0}, 400),
+        ('unknown setting', '/line', {'line': first_line, 'bus_capacity': 50, 'headway': 15, 'speed': 1}, 400),
+        ('unknown path', '/plan', {}, 404),
+        ('array body', '/batch', [], 400),
+        ('string body', '/line', 'x', 400),
+        ('queries not a list', '/batch', {'queries': 'x'}, 400),
+        ('line overrides not an object', '/hub', {'hub': next(iter(planner.hubs)), 'bus_capacity': 50, 'headway': 15,
+                                                  'line_overrides': [first_line]}, 400),
+    ]
+    for name, path, body, expected_status in error_cases:
+        status, answer = post(base_url, path, body)
+        problems = []
+        if status != expected_status:
+            problems.append(f"status {status} != {expected_status}")
+        if 'error' not in answer:
+            problems.append("no 'error' in the answer")
+        yield f"{name} -> {expected_status}", problems
+
+    # Bad queries in a batch are answered with an error, the others still run
+    status, answer = post(base_url, '/batch', {'queries': [
+        {'line': first_line, 'bus_capacity': bus_capacity, 'headway': headway},
+        {'line': first_line, 'bus_capacity': bus_capacity},
+        'x',
+        [first_line],
+    ]})
+    results = answer.get('results', [])
+    problems = []
+    if status != 200 or len(results) != 4:
+        problems.append(f"status {status}, {len(results)} results")
+    elif 'error' in results[0] or not all('error' in result for result in results[1:]):
+        problems.append(f"results {results}")
+    yield "/batch with a bad query", problems
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Smoke check of the what-if service against localhost.")
+    parser.add_argument('input_file', nargs='?', help="Stage 1 output workbook (default: a small built-in network)")
+    parser.add_argument('--variant', choices=sorted(PLAN_VARIANTS), default='designed')
+    return parser.parse_args(argv)
+
+
+def main():
+    args = parse_args()
+    if args.input_file:
+        try:
+            _, processed_lines = load_processed_lines(args.input_file)
+        except (OSError, ValueError) as e:
+            print(f"Error loading file: {str(e)}")
+            sys.exit(1)
+    else:
+        processed_lines = SAMPLE_LINES
+
+    planner = WhatIfPlanner(processed_lines, args.variant)
+    # Port 0 lets the system pick a free port
+    server = make_server(planner, port=0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_address[1]}"
+
+    failures = 0
+    try:
+        for name, problems in run_checks(base_url, processed_lines, planner, PLAN_VARIANTS[args.variant]):
+            failures += bool(problems)
+            print(f"[{'ok' if not problems else 'FAIL'}] {name}")
+            for problem in problems[:10]:
+                print(f"       {problem}")
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,403 @@
+import argparse
+import os
+import sys
+import time
+import warnings
+
+from Make_Stops_Of_Lines_South_Med_1 import VisumWorkbook, build_stops_table, format_stop_numbers
+from plan_engine import PLAN_VARIANTS, LineStore, analyze_plan_grid, load_processed_lines, get_line_summary
+from timetable_generator import read_selections
+
+
+# Stop-to-stop graph of the network: every pair of consecutive stops on a route
+# is a directed segment, and each segment knows the lines running over it.
+# Consecutive segments served by the same set of two or more lines form a
+# shared corridor. With the chosen capacity/headway per line the combined
+# departures, buses and capacity per segment follow from one weighted count.
+# From a Visum export the VOL(AP) of every route item is the load on the segment
+# leaving that stop, so offered capacity can be checked against the load per segment.
+STOP_SEPARATOR = '→'
+ITEM_VOLUME_COLUMN = 'VOL(AP)'
+LOAD_STATUSES = ('under-served', 'over-served', 'ok')
+
+
+class StopGraph:
+    """Directed segments between consecutive stops, with the lines using each segment.
+
+    Built from route items (one stop of one route, in route order) in a single
+    pass. The segment -> line incidence and the stop -> segment adjacency are
+    kept as sparse CSR arrays, so segment queries never rescan the routes.
+    """
+
+    def __init__(self, item_routes, item_stops, route_lines, line_names):
+        import numpy as np
+        import pandas as pd
+
+        self.line_names = list(line_names)
+        item_routes = np.asarray(item_routes, dtype=np.int64)
+        self.route_lines = np.asarray(route_lines, dtype=np.int64)
+        item_codes, stop_names = pd.factorize(pd.Series(item_stops, dtype=object))
+        self.stop_names = list(stop_names)
+        self._stop_index = {stop: i for i, stop in enumerate(self.stop_names)}
+
+        # Consecutive items of the same route are a segment; repeated stops are not
+        same_route = item_routes[1:] == item_routes[:-1]
+        moves = same_route & (item_codes[1:] != item_codes[:-1])
+        self.pair_items = np.flatnonzero(moves)
+        self.pair_routes = item_routes[1:][moves]
+        from_codes = item_codes[:-1][moves].astype(np.int64)
+        to_codes = item_codes[1:][moves].astype(np.int64)
+
+        # One segment per distinct (from, to) pair
+        self.pair_segments, keys = pd.factorize(from_codes * max(1, len(self.stop_names)) + to_codes)
+        self.segment_from, self.segment_to = np.divmod(np.asarray(keys, dtype=np.int64), max(1, len(self.stop_names)))
+        self._segment_index = {key: i for i, key in enumerate(keys.tolist())}
+
+        # Segment -> line incidence with the number of route traversals of each pair
+        pair_lines = self.route_lines[self.pair_routes] if len(self.pair_routes) else np.array([], dtype=np.int64)
+        incidence, traversals = np.unique(self.pair_segments * max(1, len(self.line_names)) + pair_lines,
+                                          return_counts=True)
+        self.incidence_segments, self.incidence_lines = np.divmod(incidence, max(1, len(self.line_names)))
+        self.incidence_traversals = traversals
+        self.line_indptr = np.concatenate(([0], np.cumsum(np.bincount(self.incidence_segments,
+                                                                      minlength=self.segment_count))))
+
+        # Stop -> outgoing segments
+        self.out_segments = np.argsort(self.segment_from, kind='stable')
+        self.out_indptr = np.concatenate(([0], np.cumsum(np.bincount(self.segment_from,
+                                                                     minlength=len(self.stop_names)))))
+
+    @classmethod
+    def from_store(cls, store):
+        """Graph of the StopsArray sequences of a LineStore"""
+        import pandas as pd
+
+        line_index, _ = store.route_positions()
+        stops = pd.Series(store.stops, dtype=object).fillna('').astype(str).str.split(STOP_SEPARATOR).explode()
+        stops = stops.str.strip()
+        stops = stops[stops != '']
+        return cls(stops.index.to_numpy(), stops.to_numpy(), line_index, store.line_names)
+
+    @classmethod
+    def from_items(cls, items, stop_col, store):
+        """Graph of the cleaned rows of a Line Route Item sheet, in sheet order within each route.
+
+        Returns (graph, item positions): position i of the graph's items is row
+        item_positions[i] of items, to align per-item values such as VOL(AP).
+        """
+        import numpy as np
+        import pandas as pd
+
+        route_codes, routes = pd.factorize(pd.MultiIndex.from_frame(items[['$LINEROUTEITEM:LINENAME', 'LINEROUTENAME']]))
+        order = np.argsort(route_codes, kind='stable')
+        line_index = {line_name: i for i, line_name in enumerate(store.line_names)}
+        route_lines = [line_index[line_name] for line_name, _ in routes]
+        stops = np.asarray(format_stop_numbers(items[stop_col].to_numpy()[order]), dtype=object)
+        return cls(route_codes[order], stops, route_lines, store.line_names), order
+
+    @property
+    def segment_count(self):
+        return len(self.segment_from)
+
+    def segment_id(self, from_stop, to_stop):
+        """Index of the segment from_stop -> to_stop, raising KeyError if no route runs it"""
+        stop_count = max(1, len(self.stop_names))
+        key = self._stop_index[str(from_stop)] * stop_count + self._stop_index[str(to_stop)]
+        return self._segment_index[key]
+
+    def segment_lines(self, segment):
+        """Line indices using a segment"""
+        return self.incidence_lines[self.line_indptr[segment]:self.line_indptr[segment + 1]]
+
+    def lines_on(self, from_stop, to_stop):
+        """Names of the lines running from from_stop straight to to_stop"""
+        return [self.line_names[i] for i in self.segment_lines(self.segment_id(from_stop, to_stop)).tolist()]
+
+    def next_stops(self, stop):
+        """Stops reached directly from stop by any route"""
+        segments = self.out_segments[self.out_indptr[self._stop_index[str(stop)]]:
+                                     self.out_indptr[self._stop_index[str(stop)] + 1]]
+        return [self.stop_names[i] for i in self.segment_to[segments].tolist()]
+
+    def line_counts(self):
+        """Number of lines on each segment"""
+        import numpy as np
+        return np.diff(self.line_indptr)
+
+    def segment_totals(self, line_values):
+        """Sum per segment of a per-line value, counted once for every route traversal of the segment"""
+        import numpy as np
+
+        line_values = np.asarray(line_values, dtype=float)
+        return np.bincount(self.incidence_segments, minlength=self.segment_count,
+                           weights=self.incidence_traversals * line_values[self.incidence_lines])
+
+    def segment_loads(self, item_values):
+        """Sum per segment of a per-item value taken at the first stop of each traversal"""
+        import numpy as np
+
+        item_values = np.asarray(item_values, dtype=float)
+        return np.bincount(self.pair_segments, minlength=self.segment_count, weights=item_values[self.pair_items])
+
+    def corridors(self, min_lines=2):
+        """Shared corridors as (segment indices, line indices) in route order.
+
+        A corridor is a run of consecutive segments of a route that are all used
+        by the same set of at least min_lines lines. Every line of the set runs
+        the whole corridor; runs found on several routes are kept once.
+        """
+        import numpy as np
+        import pandas as pd
+
+        # Label each segment with its line set, -1 when it has fewer than min_lines lines
+        line_sets = [tuple(self.segment_lines(segment).tolist()) for segment in range(self.segment_count)]
+        set_codes, set_values = pd.factorize(pd.Series(line_sets, dtype=object))
+        set_codes = np.where(self.line_counts() >= min_lines, set_codes, -1)
+
+        pair_sets = set_codes[self.pair_segments]
+        # A run continues while the next pair is on the same route and has the same line set
+        continues = np.zeros(len(pair_sets), dtype=bool)
+        continues[1:] = (self.pair_routes[1:] == self.pair_routes[:-1]) & (pair_sets[1:] == pair_sets[:-1])
+        starts = np.flatnonzero(~continues & (pair_sets >= 0))
+        ends = np.flatnonzero(~np.append(continues[1:], False))
+        ends = ends[np.searchsorted(ends, starts)]
+
+        corridors = {}
+        for start, end in zip(starts.tolist(), ends.tolist()):
+            segments = tuple(self.pair_segments[start:end + 1].tolist())
+            corridors.setdefault(segments, set_values[pair_sets[start]])
+        return [(list(segments), list(lines)) for segments, lines in corridors.items()]
+
+
+def load_network(path):
+    """(LineStore, StopGraph, per-item VOL(AP) or None) of a Visum export or a stage 1 output.
+
+    Visum exports are run through stage 1 for the line plans; their graph is
+    built from the Line Route Item sheet so that each item keeps its volume.
+    """
+    import pandas as pd
+
+    # openpyxl warns about workbook styles it does not understand
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        with VisumWorkbook(path) as workbook:
+            if not workbook.has_required_sheets():
+                _, store = load_processed_lines(workbook.excel_file)
+                return store, StopGraph.from_store(store), None
+            data, lineroutes_data = workbook.read_inputs()
+            stop_col, _ = workbook.stop_columns()
+
+    output_df, _, _ = build_stops_table(data, lineroutes_data)
+    store = LineStore.from_frame(output_df)
+
+    # Same cleaning as stage 1, so the sequences match the StopsArray of the routes
+    items = data.dropna(subset=[stop_col]).drop_duplicates(subset=['$LINEROUTEITEM:LINENAME', 'LINEROUTENAME', stop_col])
+    items = items[items['$LINEROUTEITEM:LINENAME'].isin(store.line_names)]
+    graph, order = StopGraph.from_items(items, stop_col, store)
+    if ITEM_VOLUME_COLUMN not in items.columns:
+        return store, graph, None
+    volumes = pd.to_numeric(items[ITEM_VOLUME_COLUMN], errors='coerce').fillna(0).to_numpy()[order]
+    return store, graph, volumes
+
+
+def line_plan_rates(processed_lines, graph, selections, dwell_time=3, demand_factor=0.7, hub_area_per_bus=100):
+    """Departures, buses and capacity per hour of every graph line under the selected plans.
+
+    selections maps a line name to (bus_capacity, headway); other lines count as not running.
+    """
+    import numpy as np
+
+    rates = {key: np.zeros(len(graph.line_names)) for key in ('departures', 'buses', 'capacity')}
+    selected = [(i, line_name) for i, line_name in enumerate(graph.line_names) if line_name in selections]
+    if not selected:
+        return rates
+
+    line_summaries = {}
+    summaries = [get_line_summary(line_summaries, processed_lines, line_name, dwell_time, demand_factor,
+                                  hub_area_per_bus) for _, line_name in selected]
+    index = [i for i, _ in selected]
+    plan = analyze_plan_grid(
+        [summary['plan_demand'] for summary in summaries], [summary['cycle_time'] for summary in summaries],
+        [selections[line_name][1] for _, line_name in selected],
+        [selections[line_name][0] for _, line_name in selected], hub_area_per_bus
+    )
+    # Lines without demand run no buses and so no departures
+    rates['departures'][index] = np.where(plan['buses_per_group'] > 0, plan['groups_per_hour'], 0)
+    rates['buses'][index] = plan['groups_per_hour'] * plan['buses_per_group']
+    rates['capacity'][index] = plan['total_capacity_per_hour']
+    return rates
+
+
+def segment_rows(graph, rates, min_lines=1):
+    """One row per segment with at least min_lines lines, busiest first"""
+    import numpy as np
+
+    line_counts = graph.line_counts()
+    departures = graph.segment_totals(rates['departures'])
+    buses = graph.segment_totals(rates['buses'])
+    capacity = graph.segment_totals(rates['capacity'])
+
+    rows = []
+    for segment in np.flatnonzero(line_counts >= min_lines).tolist():
+        rows.append({
+            'From_Stop': graph.stop_names[graph.segment_from[segment]],
+            'To_Stop': graph.stop_names[graph.segment_to[segment]],
+            'Line_Count': int(line_counts[segment]),
+            'Lines': ', '.join(str(graph.line_names[i]) for i in graph.segment_lines(segment).tolist()),
+            'Departures_per_Hour': departures[segment],
+            # Combined headway of all departures over the segment
+            'Combined_Headway (min)': round(60 / departures[segment], 2) if departures[segment] else None,
+            'Buses_per_Hour': buses[segment],
+            'Capacity_per_Hour': capacity[segment],
+        })
+    rows.sort(key=lambda row: (-row['Line_Count'], -row['Capacity_per_Hour']))
+    return rows
+
+
+def check_segment_capacity(graph, rates, item_volumes, demand_factor=0.7, min_load_factor=0.3,
+                           max_load_factor=1.0):
+    """Offered capacity against the VOL(AP) load of every segment, as arrays over the segments.
+
+    The load is scaled by the demand factor the lines are planned for. Segments
+    above max_load_factor (or with load and no capacity) are under-served, those
+    below min_load_factor over-served.
+    """
+    import numpy as np
+
+    load = graph.segment_loads(item_volumes)
+    design_load = load * demand_factor if demand_factor is not None else load
+    capacity = graph.segment_totals(rates['capacity'])
+    load_factor = np.divide(design_load, capacity, out=np.full(len(capacity), np.nan), where=capacity > 0)
+
+    under_served = (design_load > 0) & ~(load_factor <= max_load_factor)
+    over_served = (capacity > 0) & (load_factor < min_load_factor)
+    return {
+        'load': load,
+        'design_load': design_load,
+        'capacity': capacity,
+        'load_factor': load_factor,
+        'spare_capacity': capacity - design_load,
+        'status': np.select([under_served, over_served], LOAD_STATUSES[:2], LOAD_STATUSES[2]),
+    }
+
+
+def capacity_rows(graph, check, flagged_only=True):
+    """One row per segment of the capacity check, the most overloaded first"""
+    import numpy as np
+
+    line_counts = graph.line_counts()
+    segments = np.arange(graph.segment_count)
+    if flagged_only:
+        segments = segments[check['status'] != 'ok']
+    # Load without capacity first, then by load factor
+    load_factor = check['load_factor'][segments]
+    sort_key = np.where(np.isnan(load_factor), np.where(check['design_load'][segments] > 0, np.inf, -1), load_factor)
+    segments = segments[np.argsort(-sort_key, kind='stable')]
+
+    rows = []
+    for segment in segments.tolist():
+        load_factor = check['load_factor'][segment]
+        rows.append({
+            'From_Stop': graph.stop_names[graph.segment_from[segment]],
+            'To_Stop': graph.stop_names[graph.segment_to[segment]],
+            'Line_Count': int(line_counts[segment]),
+            'Lines': ', '.join(str(graph.line_names[i]) for i in graph.segment_lines(segment).tolist()),
+            'Load_per_Hour': check['load'][segment],
+            'Design_Load': round(check['design_load'][segment], 1),
+            'Capacity_per_Hour': check['capacity'][segment],
+            'Load_Factor': None if np.isnan(load_factor) else round(load_factor, 3),
+            'Spare_Capacity': round(check['spare_capacity'][segment], 1),
+            'Status': check['status'][segment],
+        })
+    return rows
+
+
+def corridor_rows(graph, rates, min_lines=2):
+    """One row per shared corridor, with the combined service at its weakest segment"""
+    departures = graph.segment_totals(rates['departures'])
+    buses = graph.segment_totals(rates['buses'])
+    capacity = graph.segment_totals(rates['capacity'])
+
+    rows = []
+    for number, (segments, lines) in enumerate(graph.corridors(min_lines), 1):
+        stops = [graph.segment_from[segments[0]]] + graph.segment_to[segments].tolist()
+        rows.append({
+            'Corridor': f"C{number:04d}",
+            'Line_Count': len(lines),
+            'Lines': ', '.join(str(graph.line_names[i]) for i in lines),
+            'From_Stop': graph.stop_names[stops[0]],
+            'To_Stop': graph.stop_names[stops[-1]],
+            'Segments': len(segments),
+            'Stops': ' → '.join(graph.stop_names[stop] for stop in stops),
+            'Departures_per_Hour': departures[segments].min(),
+            'Buses_per_Hour': buses[segments].min(),
+            'Capacity_per_Hour': capacity[segments].min(),
+        })
+    return rows
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Find stop segments and corridors shared by several lines.")
+    parser.add_argument('input_file', help="Stage 1 output workbook, or a Visum export for the capacity check")
+    parser.add_argument('--output', default='Corridors.xlsx', help="Output workbook (default: Corridors.xlsx)")
+    parser.add_argument('--bus-capacity', type=int, default=50, help="Bus capacity for all lines (default: 50)")
+    parser.add_argument('--headway', type=float, default=15, help="Headway in minutes for all lines (default: 15)")
+    parser.add_argument('--selection', help="CSV/xlsx with per-line LineName, Bus_Capacity and Headway (min)")
+    parser.add_argument('--min-lines', type=int, default=2,
+                        help="Lines needed for a shared segment or corridor (default: 2)")
+    parser.add_argument('--all-segments', action='store_true',
+                        help="List every segment, not only shared or flagged ones")
+    parser.add_argument('--max-load-factor', type=float, default=1.0,
+                        help="Segments loaded above this are under-served (default: 1.0)")
+    parser.add_argument('--min-load-factor', type=float, default=0.3,
+                        help="Segments loaded below this are over-served (default: 0.3)")
+    parser.add_argument('--dwell-time', type=float, default=3)
+    parser.add_argument('--variant', choices=sorted(PLAN_VARIANTS), default='designed')
+    return parser.parse_args(argv)
+
+
+def main():
+    args = parse_args()
+    started = time.perf_counter()
+
+    try:
+        processed_lines, graph, item_volumes = load_network(args.input_file)
+        if args.selection:
+            selections = read_selections(args.selection, processed_lines)
+        else:
+            selections = {line_name: (args.bus_capacity, args.headway) for line_name in processed_lines}
+    except (OSError, ValueError) as e:
+        print(f"Error loading input: {str(e)}")
+        sys.exit(1)
+
+    plan_variant = PLAN_VARIANTS[args.variant]
+    rates = line_plan_rates(processed_lines, graph, selections, args.dwell_time, **plan_variant)
+    corridors = corridor_rows(graph, rates, args.min_lines)
+    segments = segment_rows(graph, rates, 1 if args.all_segments else args.min_lines)
+    sheets = [('Corridors', corridors), ('Segments', segments)]
+    if item_volumes is not None:
+        check = check_segment_capacity(graph, rates, item_volumes, plan_variant['demand_factor'],
+                                       args.min_load_factor, args.max_load_factor)
+        sheets.append(('Capacity_Check', capacity_rows(graph, check, flagged_only=not args.all_segments)))
+
+    import pandas as pd
+    from plan_engine import style_plan_sheet
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with pd.ExcelWriter(args.output, engine='openpyxl') as writer:
+        for sheet_name, rows in sheets:
+            pd.DataFrame(rows).to_excel(writer, sheet_name=sheet_name, index=False)
+            style_plan_sheet(writer.sheets[sheet_name])
+
+    shared = int((graph.line_counts() >= args.min_lines).sum())
+    print(f"{graph.segment_count} segments, {shared} shared by {args.min_lines}+ lines, {len(corridors)} corridors "
+          f"in {time.perf_counter() - started:.1f}s -> {args.output}")
+    if item_volumes is None:
+        print("No per-item VOL(AP) in the input (a Visum export is needed), capacity check skipped")
+    else:
+        statuses = list(check['status'])
+        print(f"{statuses.count('under-served')} segments under-served, {statuses.count('over-served')} over-served")
+
+
+if __name__ == "__main__":
+    main()
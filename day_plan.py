@@ -0,0 +1,221 @@
+import argparse
+import os
+import sys
+import time
+
+from plan_engine import PLAN_VARIANTS, parse_capacities, parse_headways, analyze_plan_grid, passenger_metrics, load_processed_lines, get_line_summary
+
+
+# Plans a whole service day instead of one representative hour. Every line gets
+# an hourly demand (its own profile, or VOL(AP) scaled by a curve), and for each
+# hour the capacity/headway option that best meets the objective is chosen.
+# All lines x hours x options are evaluated in one array computation.
+DAY_OBJECTIVES = ('fleet', 'hub_area', 'empty_seats', 'generalized_cost')
+
+
+def read_demand_profile(path):
+    """Read a day profile: either Hour/Factor (a curve for every line) or LineName/Hour/Demand.
+
+    Returns (hours, curve) for a curve or (hours, {line name: {hour: demand}}).
+    """
+    import pandas as pd
+
+    df = pd.read_csv(path) if path.lower().endswith('.csv') else pd.read_excel(path)
+    if 'Hour' not in df.columns:
+        raise ValueError("Missing column in demand profile: Hour")
+
+    if {'LineName', 'Demand'} <= set(df.columns):
+        profile = {}
+        for row in df.to_dict('records'):
+            profile.setdefault(str(row['LineName']), {})[int(row['Hour'])] = float(row['Demand'])
+        hours = sorted({hour for line_profile in profile.values() for hour in line_profile})
+        return hours, profile
+    if 'Factor' in df.columns:
+        curve = {int(row['Hour']): float(row['Factor']) for row in df.to_dict('records')}
+        return sorted(curve), curve
+    raise ValueError("Demand profile needs Hour/Factor or LineName/Hour/Demand columns")
+
+
+def build_demand_matrix(line_names, desired_demands, hours, profile):
+    """lines x hours desired demand from a per-line profile or a scaling curve of VOL(AP)"""
+    import numpy as np
+
+    if all(isinstance(value, dict) for value in profile.values()):
+        return np.array([[profile.get(str(line_name), {}).get(hour, 0.0) for hour in hours]
+                         for line_name in line_names], dtype=float)
+    curve = np.array([profile[hour] for hour in hours], dtype=float)
+    return np.outer(np.asarray(desired_demands, dtype=float), curve)
+
+
+def choose_options(grid, headways, objective='fleet'):
+    """Index of the chosen option per line and hour.
+
+    The objective (fleet, hub area, empty seats or the passengers' generalized
+    cost) is minimised first, ties go to fewer empty seats, then to the
+    longer headway.
+    """
+    import numpy as np
+
+    primary = {
+        'fleet': grid['fleet_size_performing_Headway_for_1_Hour'],
+        'hub_area': grid['hub_area_for_1_hour'],
+        'empty_seats': grid['empty_seats'],
+        'generalized_cost': grid['generalized_cost'],
+    }[objective]
+
+    candidates = primary == primary.min(axis=-1, keepdims=True)
+    empty_seats = np.where(candidates, grid['empty_seats'], np.inf)
+    candidates &= empty_seats == empty_seats.min(axis=-1, keepdims=True)
+    headway_rank = np.where(candidates, headways, -np.inf)
+    return headway_rank.argmax(axis=-1)
+
+
+def plan_day(processed_lines, hours, profile, bus_capacities, headways, dwell_time=3,
+             demand_factor=0.7, hub_area_per_bus=100, objective='fleet'):
+    """Hourly plan of every line plus its day totals, as (hourly rows, line rows, hub rows)"""
+    import numpy as np
+
+    line_summaries = {}
+    if all(isinstance(value, dict) for value in profile.values()):
+        known_lines = {str(line_name) for line_name in processed_lines}
+        unknown = sorted(set(profile) - known_lines)
+        if unknown:
+            raise ValueError(f"Unknown lines in demand profile: {', '.join(unknown)}")
+        line_names = [line_name for line_name in processed_lines if str(line_name) in profile]
+    else:
+        line_names = list(processed_lines)
+
+    summaries = [get_line_summary(line_summaries, processed_lines, line_name, dwell_time,
+                                  demand_factor, hub_area_per_bus) for line_name in line_names]
+    cycle_times = np.array([summary['cycle_time'] for summary in summaries], dtype=float)
+    in_vehicle_times = np.array([summary['in_vehicle_time'] for summary in summaries], dtype=float)
+
+    desired = build_demand_matrix(line_names, [summary['desired_demand'] for summary in summaries], hours, profile)
+    # Same rounding as the single-hour plan: ceil of the factored demand
+    plan_demand = np.ceil(desired * demand_factor) if demand_factor is not None else np.ceil(desired)
+
+    option_capacities = np.repeat(np.asarray(bus_capacities, dtype=float), len(headways))
+    option_headways = np.tile(np.asarray(headways, dtype=float), len(bus_capacities))
+
+    # lines x hours x options
+    grid = analyze_plan_grid(plan_demand[:, :, None], cycle_times[:, None, None],
+                             option_headways, option_capacities, hub_area_per_bus)
+    grid.update(passenger_metrics(plan_demand[:, :, None], in_vehicle_times[:, None, None],
+                                  option_headways, grid['total_capacity_per_hour']))
+    chosen = choose_options(grid, option_headways, objective)
+    picked = {key: np.take_along_axis(value, chosen[:, :, None], axis=-1)[:, :, 0] for key, value in grid.items()}
+    served = plan_demand > 0
+
+    hourly_rows = []
+    for i, (line_name, summary) in enumerate(zip(line_names, summaries)):
+        for j, hour in enumerate(hours):
+            hourly_rows.append({
+                'LineName': line_name,
+                'HubName': summary['hub_name'],
+                'Hour': hour,
+                'Desired_Demand': round(desired[i, j], 1),
+                'Plan_Demand': int(plan_demand[i, j]),
+                'Bus_Capacity': int(option_capacities[chosen[i, j]]) if served[i, j] else 0,
+                'Headway (min)': option_headways[chosen[i, j]] if served[i, j] else 0,
+                'Buses_per_Group': int(picked['buses_per_group'][i, j]),
+                'Total_Trips': int(picked['total_trips'][i, j]),
+                'Fleet_Size': int(picked['fleet_size_performing_Headway_for_1_Hour'][i, j]),
+                'Hub_Area': picked['hub_area_for_1_hour'][i, j],
+                'Capacity_per_Hour': picked['total_capacity_per_hour'][i, j],
+                'Empty_Seats_per_Hour': picked['empty_seats'][i, j],
+                'Wait_Time (min)': round(picked['wait_time'][i, j], 2),
+                'Load_Factor': round(picked['load_factor'][i, j], 3),
+                'In_Vehicle_Time (min)': round(picked['in_vehicle_time'][i, j], 1),
+                'Generalized_Cost (min)': round(picked['generalized_cost'][i, j], 1),
+            })
+
+    fleet = picked['fleet_size_performing_Headway_for_1_Hour']
+    hub_area = picked['hub_area_for_1_hour']
+    # Generalized cost per passenger over the day, weighted by the hourly demand
+    day_cost = (picked['generalized_cost'] * plan_demand).sum(axis=1)
+    day_demand = plan_demand.sum(axis=1)
+    mean_cost = np.divide(day_cost, day_demand, out=np.zeros_like(day_cost), where=day_demand > 0)
+    line_rows = []
+    for i, (line_name, summary) in enumerate(zip(line_names, summaries)):
+        line_rows.append({
+            'LineName': line_name,
+            'HubName': summary['hub_name'],
+            'Cycle_Time (min)': round(summary['cycle_time'], 1),
+            'Day_Demand': int(plan_demand[i].sum()),
+            'Peak_Hour': hours[int(fleet[i].argmax())],
+            # Buses are reused from hour to hour, the day needs the peak fleet
+            'Peak_Fleet': int(fleet[i].max()),
+            'Peak_Hub_Area': hub_area[i].max(),
+            'Total_Trips': int(picked['total_trips'][i].sum()),
+            'Capacity_per_Day': picked['total_capacity_per_hour'][i].sum(),
+            'Empty_Seats_per_Day': picked['empty_seats'][i].sum(),
+            'Mean_Generalized_Cost (min)': round(mean_cost[i], 1),
+        })
+
+    hub_rows = []
+    hub_names = [summary['hub_name'] for summary in summaries]
+    for hub_name in dict.fromkeys(hub_names):
+        in_hub = np.array([name == hub_name for name in hub_names])
+        hub_fleet = fleet[in_hub].sum(axis=0)
+        hub_hub_area = hub_area[in_hub].sum(axis=0)
+        peak = int(hub_fleet.argmax())
+        row = {
+            'HubName': hub_name,
+            'Lines': int(in_hub.sum()),
+            'Peak_Hour': hours[peak],
+            'Peak_Fleet': int(hub_fleet[peak]),
+            'Peak_Hub_Area': hub_hub_area.max(),
+            'Total_Trips': int(picked['total_trips'][in_hub].sum()),
+        }
+        row.update({f'Fleet_{hour:02d}h': int(value) for hour, value in zip(hours, hub_fleet)})
+        hub_rows.append(row)
+
+    return hourly_rows, line_rows, hub_rows
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Plan a full service day from hourly demand profiles.")
+    parser.add_argument('input_file', help="Stage 1 output workbook (stops of lines)")
+    parser.add_argument('profile', help="CSV/xlsx with Hour/Factor (scales VOL(AP)) or LineName/Hour/Demand")
+    parser.add_argument('--output', default='Day_Plan.xlsx', help="Output workbook (default: Day_Plan.xlsx)")
+    parser.add_argument('--bus-capacities', type=parse_capacities, default=[25, 50])
+    parser.add_argument('--headways', type=parse_headways, default=[10, 15, 20, 25, 30],
+                        help="Headways in minutes: '10, 15, 20', a range '3:60[:step]' or 'clockface'")
+    parser.add_argument('--dwell-time', type=float, default=3)
+    parser.add_argument('--variant', choices=sorted(PLAN_VARIANTS), default='designed')
+    parser.add_argument('--objective', choices=DAY_OBJECTIVES, default='fleet',
+                        help="What the hourly choice minimises (default: fleet)")
+    return parser.parse_args(argv)
+
+
+def main():
+    args = parse_args()
+    started = time.perf_counter()
+
+    try:
+        _, processed_lines = load_processed_lines(args.input_file)
+        hours, profile = read_demand_profile(args.profile)
+        hourly_rows, line_rows, hub_rows = plan_day(
+            processed_lines, hours, profile, args.bus_capacities, args.headways, args.dwell_time,
+            objective=args.objective, **PLAN_VARIANTS[args.variant]
+        )
+    except (OSError, ValueError) as e:
+        print(f"Error: {str(e)}")
+        sys.exit(1)
+
+    import pandas as pd
+    from plan_engine import style_plan_sheet
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with pd.ExcelWriter(args.output, engine='openpyxl') as writer:
+        for sheet_name, rows in (('Hub_Day', hub_rows), ('Line_Day', line_rows), ('Hourly_Plan', hourly_rows)):
+            pd.DataFrame(rows).to_excel(writer, sheet_name=sheet_name, index=False)
+            style_plan_sheet(writer.sheets[sheet_name])
+
+    print(f"Planned {len(line_rows)} lines x {len(hours)} hours x "
+          f"{len(args.bus_capacities) * len(args.headways)} options in "
+          f"{time.perf_counter() - started:.1f}s -> {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,254 @@
+import argparse
+import os
+import sys
+import time
+
+from plan_engine import PLAN_VARIANTS, load_processed_lines, get_line_summary
+from interlining import optimize_offsets
+from timetable_generator import (build_line_trips, chain_blocks, format_clock, parse_clock, read_selections,
+                                 route_trip_times)
+
+
+# Discrete-event simulation of the buses standing at each hub. Bus groups leave
+# the hub every headway, run the line's routes and come back after the cycle;
+# a bus occupies the hub from its return (or, for its first trip, the boarding
+# time before departure) until it departs again. The peak and percentiles of
+# the occupancy are compared with the static Hub_Area estimate of the plan.
+# Lines that all board their first group at the start of service open the day
+# with an artificial peak; the statistics start once the first group of every
+# line at the hub is back (the warm-up) and the start-up peak is reported apart.
+# The first departures can also be staggered per line, as for interlining.
+OCCUPANCY_PERCENTILES = (50, 90, 95)
+
+
+def hub_intervals(group_trips, hub_terminal, buses_per_group, boarding_time, pull_in_time):
+    """(start, end, buses) intervals during which the line's vehicles stand at the hub"""
+    by_block = {}
+    for trip in group_trips:
+        by_block.setdefault(trip['block'], []).append(trip)
+
+    intervals = []
+    for trips in by_block.values():
+        trips.sort(key=lambda trip: trip['departure'])
+        at_hub_since = None
+        for trip in trips:
+            if trip['from'] == hub_terminal:
+                # First trip: the bus pulls in from the depot to board
+                start = trip['departure'] - boarding_time if at_hub_since is None else at_hub_since
+                intervals.append((start, trip['departure'], buses_per_group))
+                at_hub_since = None
+            if trip['to'] == hub_terminal:
+                at_hub_since = trip['arrival']
+        if at_hub_since is not None:
+            intervals.append((at_hub_since, at_hub_since + pull_in_time, buses_per_group))
+    return intervals
+
+
+def occupancy_profile(intervals):
+    """Step function of the occupancy as (event times, occupancy from each time on)"""
+    import numpy as np
+
+    intervals = np.asarray(intervals, dtype=float).reshape(-1, 3)
+    times = np.concatenate([intervals[:, 0], intervals[:, 1]])
+    deltas = np.concatenate([intervals[:, 2], -intervals[:, 2]])
+    # At the same instant departures are processed before arrivals
+    order = np.lexsort((deltas, times))
+    return times[order], np.cumsum(deltas[order])
+
+
+def clip_profile(times, levels, start=None, end=None):
+    """The part of a step function from start to end, beginning with the level at start"""
+    import numpy as np
+
+    if start is not None:
+        position = int(np.searchsorted(times, start, side='right')) - 1
+        after = times > start
+        times = np.concatenate([[start], times[after]])
+        levels = np.concatenate([[levels[position] if position >= 0 else 0], levels[after]])
+    if end is not None:
+        before = times < end
+        times = np.concatenate([times[before], [end]])
+        levels = np.concatenate([levels[before], levels[before][-1:] if before.any() else [0]])
+    return times, levels
+
+
+def occupancy_statistics(times, levels, percentiles=OCCUPANCY_PERCENTILES):
+    """Peak, time of peak and time-weighted percentiles of a step function"""
+    import numpy as np
+
+    if len(times) < 2:
+        return {'peak': 0, 'peak_time': None, **{p: 0 for p in percentiles}}
+
+    durations = np.diff(times)
+    segment_levels = levels[:-1]
+    order = np.argsort(segment_levels, kind='stable')
+    cumulative = np.cumsum(durations[order])
+    total = cumulative[-1]
+
+    stats = {'peak': int(levels.max()), 'peak_time': float(times[int(levels.argmax())])}
+    for p in percentiles:
+        index = min(int(np.searchsorted(cumulative, total * p / 100)), len(order) - 1)
+        stats[p] = int(segment_levels[order[index]])
+    return stats
+
+
+def simulate_hubs(processed_lines, selections, service_start=6 * 60, service_end=22 * 60, dwell_time=3,
+                  layover=0, boarding_time=5, pull_in_time=0, demand_factor=0.7, hub_area_per_bus=100,
+                  profile_step=5, optimize=False, offset_step=1.0):
+    """Simulate every selected line and return (hub rows, profile rows, offset rows)"""
+    import numpy as np
+
+    line_summaries = {}
+    line_plans_by_hub = {}  # hub -> [(line, headway, minutes away from the hub, buses per group)]
+    hub_intervals_by_name = {}
+    warm_up_by_hub = {}  # hub -> time the first group of every line is back at the hub
+    static_by_hub = {}
+
+    for line_name, (bus_capacity, headway) in selections.items():
+        summary = get_line_summary(line_summaries, processed_lines, line_name, dwell_time,
+                                   demand_factor, hub_area_per_bus)
+        system_analysis = summary['analyzer'].analyze_system_with_headway(
+            summary['plan_demand'], summary['cycle_time'], headway, bus_capacity
+        )
+        hub_name = summary['hub_name']
+        static = static_by_hub.setdefault(hub_name, {'lines': 0, 'fleet': 0, 'hub_area': 0})
+        static['lines'] += 1
+        static['fleet'] += system_analysis['fleet_size_performing_Headway_for_1_Hour']
+        static['hub_area'] += system_analysis['hub_area_for_1_hour']
+
+        buses_per_group = system_analysis['buses_per_group']
+        if buses_per_group:
+            routes = processed_lines[line_name]
+            away = sum(route_trip_times(routes, dwell_time)) + len(routes) * layover
+            line_plans_by_hub.setdefault(hub_name, []).append((line_name, headway, away, buses_per_group))
+
+    offset_rows = []
+    for hub_name, line_plans in line_plans_by_hub.items():
+        if optimize:
+            offsets = optimize_offsets([plan[1:] for plan in line_plans], service_start, service_end, offset_step)
+        else:
+            offsets = [0.0] * len(line_plans)
+
+        for (line_name, headway, _, buses_per_group), offset in zip(line_plans, offsets):
+            group_trips, _ = build_line_trips(line_name, processed_lines[line_name], headway, service_start + offset,
+                                              service_end + offset, dwell_time, layover)
+            chain_blocks(group_trips, layover)
+            hub_terminal = f"{line_name}:T0"
+            hub_intervals_by_name.setdefault(hub_name, []).extend(
+                hub_intervals(group_trips, hub_terminal, buses_per_group, boarding_time, pull_in_time)
+            )
+            first_return = min((trip['arrival'] for trip in group_trips if trip['to'] == hub_terminal), default=None)
+            if first_return is not None:
+                warm_up_by_hub[hub_name] = max(warm_up_by_hub.get(hub_name, first_return), first_return)
+            offset_rows.append({
+                'HubName': hub_name,
+                'LineName': line_name,
+                'Headway (min)': headway,
+                'Offset (min)': float(offset),
+                'First_Departure': format_clock(service_start + offset),
+            })
+
+    hub_rows = []
+    profile_rows = []
+    for hub_name, static in static_by_hub.items():
+        times, levels = occupancy_profile(hub_intervals_by_name.get(hub_name, []))
+        warm_up_end = warm_up_by_hub.get(hub_name)
+        if warm_up_end is not None:
+            stats = occupancy_statistics(*clip_profile(times, levels, start=warm_up_end))
+            startup = occupancy_statistics(*clip_profile(times, levels, end=warm_up_end))
+        else:
+            # No group is back before the end of the day: it is all warm-up
+            stats = occupancy_statistics(times[:0], levels[:0])
+            startup = occupancy_statistics(times, levels)
+        hub_rows.append({
+            'HubName': hub_name,
+            'Lines': static['lines'],
+            'Static_Fleet': static['fleet'],
+            'Static_Hub_Area': static['hub_area'],
+            'Warm_Up_End': format_clock(warm_up_end) if warm_up_end is not None else '',
+            'Peak_Occupancy': stats['peak'],
+            'Peak_Time': format_clock(stats['peak_time']) if stats['peak_time'] is not None else '',
+            **{f'P{p}_Occupancy': stats[p] for p in OCCUPANCY_PERCENTILES},
+            'Peak_Hub_Area': stats['peak'] * hub_area_per_bus,
+            'Peak_vs_Static': round(stats['peak'] * hub_area_per_bus / static['hub_area'], 2) if static['hub_area'] else None,
+            'Startup_Peak': startup['peak'],
+            'Startup_Peak_Time': format_clock(startup['peak_time']) if startup['peak_time'] is not None else '',
+        })
+
+        if len(times):
+            sample_times = np.arange(service_start, times[-1] + profile_step, profile_step)
+            # Occupancy just after each sample time
+            positions = np.searchsorted(times, sample_times, side='right') - 1
+            sampled = np.where(positions >= 0, levels[np.clip(positions, 0, None)], 0)
+            profile_rows.extend(
+                {'HubName': hub_name, 'Time': format_clock(t), 'Buses_at_Hub': int(level)}
+                for t, level in zip(sample_times, sampled)
+            )
+
+    return hub_rows, profile_rows, offset_rows
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Simulate how many buses stand at each hub over a service day.")
+    parser.add_argument('input_file', help="Stage 1 output workbook (stops of lines)")
+    parser.add_argument('--output', default='Hub_Occupancy.xlsx', help="Output workbook (default: Hub_Occupancy.xlsx)")
+    parser.add_argument('--bus-capacity', type=int, default=50, help="Bus capacity for all lines (default: 50)")
+    parser.add_argument('--headway', type=float, default=15, help="Headway in minutes for all lines (default: 15)")
+    parser.add_argument('--selection', help="CSV/xlsx with per-line LineName, Bus_Capacity and Headway (min)")
+    parser.add_argument('--start', default='06:00', help="First departure from the hub (default: 06:00)")
+    parser.add_argument('--end', default='22:00', help="No departures from the hub after this time (default: 22:00)")
+    parser.add_argument('--dwell-time', type=float, default=3)
+    parser.add_argument('--layover', type=float, default=0, help="Minimum layover at a terminal in minutes (default: 0)")
+    parser.add_argument('--boarding-time', type=float, default=5,
+                        help="Minutes a bus from the depot stands at the hub before its first departure (default: 5)")
+    parser.add_argument('--pull-in-time', type=float, default=0,
+                        help="Minutes a bus stays at the hub after its last trip (default: 0)")
+    parser.add_argument('--profile-step', type=float, default=5, help="Minutes between profile samples (default: 5)")
+    parser.add_argument('--optimize-offsets', action='store_true',
+                        help="Shift each line's first departure within one headway instead of starting all lines together")
+    parser.add_argument('--offset-step', type=float, default=1.0, help="Offsets tried, in minutes (default: 1)")
+    parser.add_argument('--variant', choices=sorted(PLAN_VARIANTS), default='designed')
+    args = parser.parse_args(argv)
+    if args.bus_capacity <= 0 or not args.headway > 0:
+        parser.error("--bus-capacity and --headway must be positive")
+    if not args.offset_step > 0:
+        parser.error("--offset-step must be positive")
+    return args
+
+
+def main():
+    args = parse_args()
+    started = time.perf_counter()
+
+    try:
+        _, processed_lines = load_processed_lines(args.input_file)
+        if args.selection:
+            selections = read_selections(args.selection, processed_lines)
+        else:
+            selections = {line_name: (args.bus_capacity, args.headway) for line_name in processed_lines}
+    except (OSError, ValueError) as e:
+        print(f"Error loading input: {str(e)}")
+        sys.exit(1)
+
+    hub_rows, profile_rows, offset_rows = simulate_hubs(
+        processed_lines, selections, parse_clock(args.start), parse_clock(args.end), args.dwell_time,
+        args.layover, args.boarding_time, args.pull_in_time, profile_step=args.profile_step,
+        optimize=args.optimize_offsets, offset_step=args.offset_step, **PLAN_VARIANTS[args.variant]
+    )
+
+    import pandas as pd
+    from plan_engine import style_plan_sheet
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with pd.ExcelWriter(args.output, engine='openpyxl') as writer:
+        for sheet_name, rows in (('Hub_Occupancy', hub_rows), ('Line_Offsets', offset_rows),
+                                 ('Occupancy_Profile', profile_rows)):
+            pd.DataFrame(rows).to_excel(writer, sheet_name=sheet_name, index=False)
+            style_plan_sheet(writer.sheets[sheet_name])
+
+    print(f"Simulated {len(selections)} lines at {len(hub_rows)} hubs in "
+          f"{time.perf_counter() - started:.1f}s -> {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,231 @@
+import argparse
+import os
+import sys
+import time
+
+from Make_Stops_Of_Lines_South_Med_1 import UNKNOWN_HUB
+from plan_engine import PLAN_VARIANTS, load_processed_lines, get_line_summary
+from timetable_generator import (build_line_trips, chain_blocks, format_clock, parse_clock, read_selections,
+                                 route_trip_times)
+
+
+# Interlining: a bus returning to the hub from one line may leave on another
+# line of the same hub. Trips of all lines at a hub are chained together with
+# the hub as a shared terminal, per bus capacity since only identical buses can
+# be exchanged, and the combined fleet is compared with the per-line fleets.
+# Lines that all leave at the start of service peak together, so the departure
+# offset of each line can optionally be chosen to spread the peaks.
+# Lines without a recognised hub share no terminal and are never pooled.
+
+def has_hub(hub_name):
+    """False for lines without a recognised hub (Unknown Hub, N/A, empty or NaN)"""
+    return isinstance(hub_name, str) and hub_name.strip() not in ('', UNKNOWN_HUB, 'N/A')
+
+
+def vehicle_trips(group_trips, buses_per_group, hub_name=None):
+    """One trip per bus of each group, with the line's hub terminal renamed to the shared hub if given"""
+    trips = []
+    for group_trip in group_trips:
+        for _ in range(buses_per_group):
+            trip = dict(group_trip)
+            for key in ('from', 'to') if hub_name is not None else ():
+                if trip[key] == f"{trip['line']}:T0":
+                    trip[key] = f"hub:{hub_name}"
+            trips.append(trip)
+    return trips
+
+
+def optimize_offsets(lines, service_start, service_end, step=1.0):
+    """Departure offset per line that keeps the peak number of buses away from the hub low.
+
+    lines is a list of (headway, minutes until the bus is ready at the hub again,
+    buses per group). With the hub as the only shared terminal the combined fleet
+    is the peak of the buses away from it; lines are placed greedily, largest
+    first, each at the offset giving the lowest (then smoothest) combined profile.
+    """
+    import numpy as np
+
+    horizon = service_end + max((headway + away for headway, away, _ in lines), default=0)
+    resolution = 0.5
+    size = int(np.ceil((horizon - service_start) / resolution)) + 2
+
+    def away_profile(headway, away, buses, offset):
+        departures = np.arange(service_start + offset, service_end + offset, headway)
+        profile = np.zeros(size)
+        # Rounded outwards so that a bus is never counted back before it returns
+        np.add.at(profile, np.floor((departures - service_start) / resolution).astype(int), buses)
+        np.add.at(profile, np.ceil((departures + away - service_start) / resolution).astype(int), -buses)
+        return np.cumsum(profile)
+
+    offsets = [0.0] * len(lines)
+    combined = np.zeros(size)
+    for i in sorted(range(len(lines)), key=lambda i: -lines[i][1] * lines[i][2]):
+        headway, away, buses = lines[i]
+        best = None
+        for offset in np.arange(0, headway, step):
+            candidate = combined + away_profile(headway, away, buses, offset)
+            score = (candidate.max(), float(np.square(candidate).sum()))
+            if best is None or score < best[0]:
+                best = (score, offset, candidate)
+        _, offsets[i], combined = best
+    return offsets
+
+
+def interline_hubs(processed_lines, selections, service_start=6 * 60, service_end=22 * 60, dwell_time=3,
+                   layover=0, demand_factor=0.7, hub_area_per_bus=100, optimize=False, offset_step=1.0):
+    """Combined and per-line fleets per (hub, bus capacity), as (hub rows, block rows, offset rows)"""
+    line_summaries = {}
+    # (hub, bus capacity) -> {'lines': [...], 'trips': [...], 'line_fleet': n, 'plan_fleet': n, 'shared': bool};
+    # a line without a hub gets a pool of its own keyed (hub, bus capacity, line)
+    pools = {}
+    line_plans = {}  # line -> (headway, minutes away from the hub, buses per group)
+
+    for line_name, (bus_capacity, headway) in selections.items():
+        summary = get_line_summary(line_summaries, processed_lines, line_name, dwell_time,
+                                   demand_factor, hub_area_per_bus)
+        system_analysis = summary['analyzer'].analyze_system_with_headway(
+            summary['plan_demand'], summary['cycle_time'], headway, bus_capacity
+        )
+        buses_per_group = system_analysis['buses_per_group']
+        shared = has_hub(summary['hub_name'])
+        pool_key = (summary['hub_name'], bus_capacity) if shared else (summary['hub_name'], bus_capacity, line_name)
+        pool = pools.setdefault(pool_key, {'lines': [], 'trips': [], 'line_fleet': 0, 'plan_fleet': 0, 'shared': shared})
+        pool['lines'].append(line_name)
+        pool['plan_fleet'] += system_analysis['fleet_size_performing_Headway_for_1_Hour']
+        if buses_per_group:
+            routes = processed_lines[line_name]
+            away = sum(route_trip_times(routes, dwell_time)) + len(routes) * layover
+            line_plans[line_name] = (headway, away, buses_per_group)
+
+    hub_rows = []
+    block_rows = []
+    offset_rows = []
+    for pool_key, pool in pools.items():
+        hub_name, bus_capacity = pool_key[:2]
+        block_prefix = f"{hub_name}-{bus_capacity}" if pool['shared'] else f"{pool['lines'][0]}-{bus_capacity}"
+        planned = [line_name for line_name in pool['lines'] if line_name in line_plans]
+        if optimize:
+            offsets = optimize_offsets([line_plans[line_name] for line_name in planned],
+                                       service_start, service_end, offset_step)
+        else:
+            offsets = [0.0] * len(planned)
+
+        for line_name, offset in zip(planned, offsets):
+            headway, _, buses_per_group = line_plans[line_name]
+            group_trips, _ = build_line_trips(line_name, processed_lines[line_name], headway, service_start + offset,
+                                              service_end + offset, dwell_time, layover)
+            # Fleet of the line on its own, as in the timetable generator
+            pool['line_fleet'] += chain_blocks(group_trips, layover) * buses_per_group
+            pool['trips'].extend(vehicle_trips(group_trips, buses_per_group, hub_name if pool['shared'] else None))
+            offset_rows.append({
+                'HubName': hub_name,
+                'Bus_Capacity': bus_capacity,
+                'LineName': line_name,
+                'Headway (min)': headway,
+                'Offset (min)': float(offset),
+                'First_Departure': format_clock(service_start + offset),
+            })
+
+        combined_fleet = chain_blocks(pool['trips'], layover)
+
+        blocks = {}
+        for trip in pool['trips']:
+            block = blocks.setdefault(trip['block'], {'lines': {}, 'trips': 0, 'start': trip['departure'], 'end': trip['arrival']})
+            block['lines'][trip['line']] = None
+            block['trips'] += 1
+            block['start'] = min(block['start'], trip['departure'])
+            block['end'] = max(block['end'], trip['arrival'])
+
+        for block_id, block in sorted(blocks.items()):
+            block_rows.append({
+                'HubName': hub_name,
+                'Bus_Capacity': bus_capacity,
+                'Block': f"{block_prefix}-{block_id}",
+                'Lines': ', '.join(str(line) for line in block['lines']),
+                'Line_Count': len(block['lines']),
+                'Trips': block['trips'],
+                'Pull_Out': format_clock(block['start']),
+                'Pull_In': format_clock(block['end']),
+            })
+
+        saved = pool['line_fleet'] - combined_fleet
+        hub_rows.append({
+            'HubName': hub_name,
+            'Bus_Capacity': bus_capacity,
+            'Lines': len(pool['lines']),
+            'Plan_Fleet_Sum (1 hour)': pool['plan_fleet'],
+            'Per_Line_Fleet': pool['line_fleet'],
+            'Interlined_Fleet': combined_fleet,
+            'Fleet_Saved': saved,
+            'Per_Line_Hub_Area': pool['line_fleet'] * hub_area_per_bus,
+            'Interlined_Hub_Area': combined_fleet * hub_area_per_bus,
+            'Hub_Area_Saved': saved * hub_area_per_bus,
+            'Saving (%)': round(100 * saved / pool['line_fleet'], 1) if pool['line_fleet'] else 0,
+            'Interlined_Blocks': sum(1 for block in blocks.values() if len(block['lines']) > 1),
+            'Interlining': 'pooled' if pool['shared'] else f"not interlined: line {pool['lines'][0]} has no hub",
+        })
+
+    return hub_rows, block_rows, offset_rows
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Size a shared fleet for the lines starting at each hub.")
+    parser.add_argument('input_file', help="Stage 1 output workbook (stops of lines)")
+    parser.add_argument('--output', default='Interlining.xlsx', help="Output workbook (default: Interlining.xlsx)")
+    parser.add_argument('--bus-capacity', type=int, default=50, help="Bus capacity for all lines (default: 50)")
+    parser.add_argument('--headway', type=float, default=15, help="Headway in minutes for all lines (default: 15)")
+    parser.add_argument('--selection', help="CSV/xlsx with per-line LineName, Bus_Capacity and Headway (min)")
+    parser.add_argument('--start', default='06:00', help="First departure from the hub (default: 06:00)")
+    parser.add_argument('--end', default='22:00', help="No departures from the hub after this time (default: 22:00)")
+    parser.add_argument('--dwell-time', type=float, default=3)
+    parser.add_argument('--layover', type=float, default=0, help="Minimum layover at a terminal in minutes (default: 0)")
+    parser.add_argument('--optimize-offsets', action='store_true',
+                        help="Shift each line's first departure within one headway to lower the shared fleet")
+    parser.add_argument('--offset-step', type=float, default=1.0, help="Offsets tried, in minutes (default: 1)")
+    parser.add_argument('--variant', choices=sorted(PLAN_VARIANTS), default='designed')
+    args = parser.parse_args(argv)
+    if args.bus_capacity <= 0 or not args.headway > 0:
+        parser.error("--bus-capacity and --headway must be positive")
+    if not args.offset_step > 0:
+        parser.error("--offset-step must be positive")
+    return args
+
+
+def main():
+    args = parse_args()
+    started = time.perf_counter()
+
+    try:
+        _, processed_lines = load_processed_lines(args.input_file)
+        if args.selection:
+            selections = read_selections(args.selection, processed_lines)
+        else:
+            selections = {line_name: (args.bus_capacity, args.headway) for line_name in processed_lines}
+    except (OSError, ValueError) as e:
+        print(f"Error loading input: {str(e)}")
+        sys.exit(1)
+
+    hub_rows, block_rows, offset_rows = interline_hubs(
+        processed_lines, selections, parse_clock(args.start), parse_clock(args.end), args.dwell_time,
+        args.layover, optimize=args.optimize_offsets, offset_step=args.offset_step, **PLAN_VARIANTS[args.variant]
+    )
+
+    import pandas as pd
+    from plan_engine import style_plan_sheet
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with pd.ExcelWriter(args.output, engine='openpyxl') as writer:
+        for sheet_name, rows in (('Hub_Interlining', hub_rows), ('Line_Offsets', offset_rows), ('Blocks', block_rows)):
+            pd.DataFrame(rows).to_excel(writer, sheet_name=sheet_name, index=False)
+            style_plan_sheet(writer.sheets[sheet_name])
+
+    saved = sum(row['Fleet_Saved'] for row in hub_rows)
+    pooled = sum(1 for row in hub_rows if row['Interlining'] == 'pooled')
+    print(f"Interlining saves {saved} buses at {pooled} hubs in "
+          f"{time.perf_counter() - started:.1f}s -> {args.output}")
+    if len(hub_rows) > pooled:
+        print(f"{len(hub_rows) - pooled} lines without a recognised hub were not interlined")
+
+
+if __name__ == "__main__":
+    main()
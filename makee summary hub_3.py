@@ -1,11 +1,28 @@
-import tkinter as tk
-from tkinter import ttk, filedialog, messagebox
-import pandas as pd
 import os
 from pathlib import Path
 import threading
 from collections import defaultdict
 
+from plan_engine import PARETO_FILE, safe_file_name
+from result_store import ResultStore
+
+
+# Per-line workbooks, the workbook with a sheet per hub and the long plan table
+PLAN_FILE_PATTERNS = ['*.xlsx', '*.xls', '*.csv', '*.parquet']
+
+# Plan columns added up per hub and over the network, for each capacity/headway option
+PLAN_KEY_COLUMNS = ['Bus_Capacity', 'Headway (min)']
+HUB_METRIC_COLUMNS = ['Fleet_Size', 'Hub_Area', 'Total_Trips', 'Capacity_per_Hour', 'Empty_Seats_per_Hour']
+NETWORK_SUMMARY_FILE = 'Network_Summary.xlsx'
+
+
+def import_gui_modules():
+    """Import tkinter only when the GUI is started"""
+    global tk, ttk, filedialog, messagebox
+    import tkinter as tk
+    from tkinter import ttk, filedialog, messagebox
+
+
 class ExcelHubProcessor:
     def __init__(self, root):
         self.root = root
@@ -53,7 +70,7 @@ class ExcelHubProcessor:
         
         # Description
         desc_label = ttk.Label(main_frame, 
-                              text="This tool combines Excel files with the same HubName and sums Hub Area columns",
+                              text="This tool combines Excel files with the same HubName, sums Hub Area columns and totals every hub",
                               font=('Arial', 10))
         desc_label.pack(pady=(0, 20))
         
@@ -79,6 +96,22 @@ class ExcelHubProcessor:
         output_btn = ttk.Button(output_frame, text="Browse", command=self.select_output_folder)
         output_btn.pack(side=tk.RIGHT)
         
+        # Optional SQLite result store for the hub totals
+        store_frame = ttk.LabelFrame(main_frame, text="Results Database (optional)", padding="10")
+        store_frame.pack(fill=tk.X, pady=(0, 20))
+        
+        self.results_db_var = tk.StringVar()
+        results_db_entry = ttk.Entry(store_frame, textvariable=self.results_db_var, width=45)
+        results_db_entry.pack(side=tk.LEFT, fill=tk.X, expand=True, padx=(0, 10))
+        
+        ttk.Label(store_frame, text="Run Tag:").pack(side=tk.LEFT, padx=(0, 5))
+        self.run_tag_var = tk.StringVar()
+        run_tag_entry = ttk.Entry(store_frame, textvariable=self.run_tag_var, width=15)
+        run_tag_entry.pack(side=tk.LEFT, padx=(0, 10))
+        
+        results_db_btn = ttk.Button(store_frame, text="Browse", command=self.select_results_db)
+        results_db_btn.pack(side=tk.RIGHT)
+        
         # Process button
         self.process_btn = ttk.Button(main_frame, text="Combine Excel Files by HubName", 
                                      command=self.start_processing)
@@ -130,6 +163,14 @@ class ExcelHubProcessor:
             self.output_var.set(folder)
             self.log_message(f"Output folder set: {folder}")
             
+    def select_results_db(self):
+        path = filedialog.asksaveasfilename(title="Select Results Database", defaultextension=".sqlite",
+                                            confirmoverwrite=False,
+                                            filetypes=[("SQLite database", "*.sqlite *.db"), ("All files", "*.*")])
+        if path:
+            self.results_db_var.set(path)
+            self.log_message(f"Results database set: {path}")
+            
     def start_processing(self):
         if not self.input_folder or not os.path.exists(self.input_folder):
             messagebox.showerror("Error", "Please select a valid input folder")
@@ -152,66 +193,14 @@ class ExcelHubProcessor:
     def process_files(self):
         try:
             self.log_message("Starting file processing...")
-            
-            # Get all Excel files in input folder
-            excel_files = []
-            for ext in ['*.xlsx', '*.xls']:
-                excel_files.extend(Path(self.input_folder).glob(ext))
-                
-            if not excel_files:
-                self.log_message("No Excel files found in the input folder")
-                return
-                
-            self.log_message(f"Found {len(excel_files)} Excel files")
-            
-            # Dictionary to store files by HubName
-            hub_files = defaultdict(list)
-            
-            # First pass: Identify HubNames in each file
-            for file_path in excel_files:
-                try:
-                    self.log_message(f"Scanning: {file_path.name}")
-                    
-                    # Read Excel file
-                    df = pd.read_excel(file_path)
-                    
-                    # Check if HubName column exists
-                    if 'HubName' not in df.columns:
-                        self.log_message(f"Warning: No HubName column in {file_path.name}")
-                        continue
-                    
-                    # Get unique HubNames in this file
-                    hub_names = df['HubName'].dropna().unique()
-                    
-                    for hub_name in hub_names:
-                        hub_name = str(hub_name).strip()
-                        hub_files[hub_name].append(file_path)
-                        
-                except Exception as e:
-                    self.log_message(f"Error scanning {file_path.name}: {str(e)}")
-                    continue
-            
-            # Process hubs that have multiple files
-            processed_hubs = 0
-            
-            for hub_name, files in hub_files.items():
-                if len(files) < 2:
-                    continue  # Skip hubs with only one file
-                    
-                try:
-                    self.log_message(f"Processing Hub '{hub_name}' with {len(files)} files")
-                    self.process_hub_files(hub_name, files)
-                    processed_hubs += 1
-                    
-                except Exception as e:
-                    self.log_message(f"Error processing hub {hub_name}: {str(e)}")
-                    continue
-            
-            if processed_hubs == 0:
-                self.log_message("No hubs with multiple files found for processing")
+            results_db = self.results_db_var.get().strip()
+            if results_db:
+                # Tagged with the input folder name unless a tag is given
+                run_tag = self.run_tag_var.get().strip() or os.path.basename(os.path.normpath(self.input_folder))
+                with ResultStore(results_db) as store:
+                    summarize_hubs(self.input_folder, self.output_folder, self.log_message, store.start_run(run_tag))
             else:
-                self.log_message(f"Successfully processed {processed_hubs} hubs with multiple files")
-            
+                summarize_hubs(self.input_folder, self.output_folder, self.log_message)
             self.log_message("Processing completed successfully!")
             self.status_var.set("Processing completed")
             
@@ -221,95 +210,6 @@ class ExcelHubProcessor:
         finally:
             # Re-enable process button and stop progress bar
             self.root.after(0, self.processing_finished)
-
-    def get_short_name(self, filename):
-        """Extract short name from filename - take last 2 words"""
-        words = filename.split('_')
-        if len(words) >= 1:
-            return ' '.join(words[-1:]).title()
-        else:
-            return filename
-    
-    def process_hub_files(self, hub_name, files):
-        """Process multiple files for the same HubName and combine them"""
-        
-        # Read all files for this hub
-        file_data = []
-        for file_path in files:
-            try:
-                df = pd.read_excel(file_path)
-                # Filter rows for this specific hub
-                hub_df = df[df['HubName'] == hub_name].copy()
-                hub_df['Source_File'] = file_path.stem  # Store filename without extension
-                file_data.append((file_path.stem, hub_df))
-                self.log_message(f"  - Loaded {len(hub_df)} rows from {file_path.name}")
-            except Exception as e:
-                self.log_message(f"  - Error reading {file_path.name}: {str(e)}")
-                continue
-        
-        if len(file_data) < 2:
-            self.log_message(f"  - Not enough valid files for hub {hub_name}")
-            return
-        
-        # Create base structure with Bus_Capacity and Headway
-        base_columns = ['Bus_Capacity', 'Headway (min)']
-        combined_df = None
-        
-        # Process each file and add its specific columns
-        for filename, df in file_data:
-            # Only process Hub_Area columns (remove Fleet_Size)
-            file_specific_cols = ['Hub_Area']  # Only keep Hub_Area, remove Fleet_Size
-            
-            # Check which columns exist in this file
-            available_cols = [col for col in file_specific_cols if col in df.columns]
-            
-            if not available_cols:
-                self.log_message(f"  - No Hub_Area column found in {filename}")
-                continue
-            
-            # Create a temporary dataframe for this file's data
-            temp_df = df[base_columns + available_cols].copy()
-            
-            # Rename columns to include shortened filename
-            col_rename = {}
-            for col in available_cols:
-                short_name = self.get_short_name(filename)
-                new_name = f"Hub_Area_{short_name.replace(' ', '_')}"
-                col_rename[col] = new_name
-            temp_df = temp_df.rename(columns=col_rename)
-            
-            # Merge with combined dataframe
-            if combined_df is None:
-                combined_df = temp_df
-            else:
-                combined_df = pd.merge(combined_df, temp_df, on=base_columns, how='outer')
-        
-        if combined_df is None or combined_df.empty:
-            self.log_message(f"  - No data to combine for hub {hub_name}")
-            return
-        
-        # Calculate sums for Hub Area columns
-        hub_area_cols = [col for col in combined_df.columns if 'Hub_Area' in col and 'Sum_' not in col]
-        
-        if hub_area_cols:
-            combined_df['Sum_Hub_Area'] = combined_df[hub_area_cols].sum(axis=1)
-        
-        # Fill NaN values with 0
-        combined_df = combined_df.fillna(0)
-        
-        # Save the combined file
-        output_filename = f"Summary_{hub_name.replace(' ', '_').replace('/', '_')}.xlsx"
-        output_path = os.path.join(self.output_folder, output_filename)
-        
-        combined_df.to_excel(output_path, index=False)
-        
-        self.log_message(f"  - Created combined file: {output_filename}")
-        self.log_message(f"  - Total rows: {len(combined_df)}")
-        self.log_message(f"  - Columns: {list(combined_df.columns)}")
-        
-        # Log column sums
-        if 'Sum_Hub_Area_1_Hour' in combined_df.columns:
-            self.log_message(f"  - Total Sum_Hub_Area_1_Hour: {combined_df['Sum_Hub_Area_1_Hour'].sum():.2f}")
             
     def processing_finished(self):
         """Called when processing is finished to update UI"""
@@ -317,7 +217,225 @@ class ExcelHubProcessor:
         self.process_btn.config(state='normal')
         messagebox.showinfo("Processing Complete", "Excel files have been processed successfully!")
 
+
+def get_short_name(filename):
+    """Extract short name from filename - take last 2 words"""
+    words = filename.split('_')
+    if len(words) >= 1:
+        return ' '.join(words[-1:]).title()
+    else:
+        return filename
+
+
+def read_plan_sources(file_path):
+    """Return [(source name, plan rows)] for one stage 2 output file.
+
+    Consolidated outputs (sheet per hub, CSV or Parquet table) carry a LineName
+    column and are split per line, named like the per-line workbooks.
+    """
+    import pandas as pd
+    
+    suffix = file_path.suffix.lower()
+    if suffix == '.csv':
+        df = pd.read_csv(file_path)
+    elif suffix == '.parquet':
+        df = pd.read_parquet(file_path)
+    else:
+        sheets = list(pd.read_excel(file_path, sheet_name=None).values())
+        df = pd.concat(sheets, ignore_index=True) if len(sheets) > 1 else sheets[0]
+    
+    if 'LineName' not in df.columns:
+        return [(file_path.stem, df)]
+    return [(f"Operational_Plan_{safe_file_name(line_name)}", line_df.drop(columns='LineName'))
+            for line_name, line_df in df.groupby('LineName', sort=False)]
+
+
+def find_hub_files(input_folder, log=print):
+    """Read the plans of a folder and group them by HubName: {hub: [(source name, rows of that hub)]}"""
+    # Get all plan files in input folder
+    plan_files = []
+    for ext in PLAN_FILE_PATTERNS:
+        plan_files.extend(Path(input_folder).glob(ext))
+        
+    if not plan_files:
+        log("No Excel files found in the input folder")
+        return {}
+        
+    log(f"Found {len(plan_files)} plan files")
+    
+    # Dictionary to store plans by HubName
+    hub_files = defaultdict(list)
+    
+    # Each file is read once, its rows are split per hub right away
+    for file_path in plan_files:
+        # Our own outputs, when the output folder is the input folder, and the stage 2 Pareto workbook
+        if file_path.name in (NETWORK_SUMMARY_FILE, PARETO_FILE) or file_path.name.startswith('Summary_'):
+            continue
+        try:
+            log(f"Scanning: {file_path.name}")
+            
+            for source_name, df in read_plan_sources(file_path):
+                # Check if HubName column exists
+                if 'HubName' not in df.columns:
+                    log(f"Warning: No HubName column in {source_name}")
+                    continue
+                
+                hub_names = df['HubName'].dropna().astype(str).str.strip()
+                for hub_name, hub_df in df.groupby(hub_names, sort=False):
+                    hub_files[hub_name].append((source_name, hub_df.copy()))
+                
+        except Exception as e:
+            log(f"Error scanning {file_path.name}: {str(e)}")
+            continue
+    
+    return hub_files
+
+
+def aggregate_hub_metrics(hub_files):
+    """Sum the plan metrics of all lines per (hub, capacity, headway) and over the network.
+
+    Returns (hub totals, network totals) as DataFrames; one grouped reduction
+    over the rows of every hub, however many lines it has.
+    """
+    import pandas as pd
+
+    frames = [hub_df.assign(HubName=hub_name, Source_File=source_name)
+              for hub_name, files in hub_files.items() for source_name, hub_df in files]
+    if not frames:
+        return pd.DataFrame(), pd.DataFrame()
+
+    plans = pd.concat(frames, ignore_index=True)
+    metrics = [col for col in HUB_METRIC_COLUMNS if col in plans.columns]
+    plans[metrics] = plans[metrics].apply(pd.to_numeric, errors='coerce').fillna(0)
+
+    hub_totals = plans.groupby(['HubName'] + PLAN_KEY_COLUMNS).agg(
+        Lines=('Source_File', 'nunique'), **{col: (col, 'sum') for col in metrics}
+    ).reset_index()
+    network_totals = hub_totals.groupby(PLAN_KEY_COLUMNS).agg(
+        Hubs=('HubName', 'nunique'), Lines=('Lines', 'sum'), **{col: (col, 'sum') for col in metrics}
+    ).reset_index()
+    return hub_totals, network_totals
+
+
+def process_hub_files(hub_name, files, output_folder, log=print, hub_totals=None):
+    """Combine the plans of all lines for the same HubName, with the hub totals on a second sheet"""
+    import pandas as pd
+    
+    file_data = []
+    for source_name, hub_df in files:
+        hub_df['Source_File'] = source_name  # Store filename without extension
+        file_data.append((source_name, hub_df))
+        log(f"  - Loaded {len(hub_df)} rows from {source_name}")
+    
+    # Create base structure with Bus_Capacity and Headway
+    base_columns = PLAN_KEY_COLUMNS
+    combined_df = None
+    
+    # Process each file and add its specific columns
+    for filename, df in file_data:
+        # Only process Hub_Area columns (remove Fleet_Size)
+        file_specific_cols = ['Hub_Area']  # Only keep Hub_Area, remove Fleet_Size
+        
+        # Check which columns exist in this file
+        available_cols = [col for col in file_specific_cols if col in df.columns]
+        
+        if not available_cols:
+            log(f"  - No Hub_Area column found in {filename}")
+            continue
+        
+        # Create a temporary dataframe for this file's data
+        temp_df = df[base_columns + available_cols].copy()
+        
+        # Rename columns to include shortened filename
+        col_rename = {}
+        for col in available_cols:
+            short_name = get_short_name(filename)
+            new_name = f"Hub_Area_{short_name.replace(' ', '_')}"
+            col_rename[col] = new_name
+        temp_df = temp_df.rename(columns=col_rename)
+        
+        # Merge with combined dataframe
+        if combined_df is None:
+            combined_df = temp_df
+        else:
+            combined_df = pd.merge(combined_df, temp_df, on=base_columns, how='outer')
+    
+    if combined_df is None or combined_df.empty:
+        log(f"  - No data to combine for hub {hub_name}")
+        return None
+    
+    # Calculate sums for Hub Area columns
+    hub_area_cols = [col for col in combined_df.columns if 'Hub_Area' in col and 'Sum_' not in col]
+    
+    if hub_area_cols:
+        combined_df['Sum_Hub_Area'] = combined_df[hub_area_cols].sum(axis=1)
+    
+    # Fill NaN values with 0
+    combined_df = combined_df.fillna(0)
+    
+    # Save the combined file
+    output_filename = f"Summary_{hub_name.replace(' ', '_').replace('/', '_')}.xlsx"
+    output_path = os.path.join(output_folder, output_filename)
+    
+    with pd.ExcelWriter(output_path, engine='openpyxl') as writer:
+        combined_df.to_excel(writer, sheet_name='Hub_Area', index=False)
+        if hub_totals is not None:
+            hub_totals.to_excel(writer, sheet_name='Hub_Totals', index=False)
+    
+    log(f"  - Created combined file: {output_filename}")
+    log(f"  - Total rows: {len(combined_df)}")
+    log(f"  - Columns: {list(combined_df.columns)}")
+    
+    # Log column sums
+    if 'Sum_Hub_Area_1_Hour' in combined_df.columns:
+        log(f"  - Total Sum_Hub_Area_1_Hour: {combined_df['Sum_Hub_Area_1_Hour'].sum():.2f}")
+    
+    return output_path
+
+
+def summarize_hubs(input_folder, output_folder, log=print, store_run=None):
+    """Write one Summary_<hub>.xlsx per hub and the network totals; returns the written paths.
+    
+    store_run (from result_store.ResultStore.start_run) also records the hub totals.
+    """
+    import pandas as pd
+    
+    hub_files = find_hub_files(input_folder, log)
+    hub_totals, network_totals = aggregate_hub_metrics(hub_files)
+    if store_run is not None and not hub_totals.empty:
+        store_run.write_hub_summaries(hub_totals)
+        log(f"Stored hub totals in run '{store_run.tag}'")
+    
+    output_paths = []
+    
+    for hub_name, files in hub_files.items():
+        try:
+            log(f"Processing Hub '{hub_name}' with {len(files)} files")
+            totals = hub_totals[hub_totals['HubName'] == hub_name] if not hub_totals.empty else None
+            output_path = process_hub_files(hub_name, files, output_folder, log, totals)
+            if output_path:
+                output_paths.append(output_path)
+            
+        except Exception as e:
+            log(f"Error processing hub {hub_name}: {str(e)}")
+            continue
+    
+    if not output_paths:
+        log("No hubs found for processing")
+        return output_paths
+    
+    network_path = os.path.join(output_folder, NETWORK_SUMMARY_FILE)
+    with pd.ExcelWriter(network_path, engine='openpyxl') as writer:
+        network_totals.to_excel(writer, sheet_name='Network_Totals', index=False)
+        hub_totals.to_excel(writer, sheet_name='Hub_Totals', index=False)
+    output_paths.append(network_path)
+    
+    log(f"Successfully processed {len(output_paths) - 1} hubs, network totals in {NETWORK_SUMMARY_FILE}")
+    return output_paths
+
+
 def main():
+    import_gui_modules()
     root = tk.Tk()
     app = ExcelHubProcessor(root)
     root.mainloop()
@@ -1,109 +1,19 @@
-import math
-import pandas as pd
 import os
-import tkinter as tk
-from tkinter import ttk, filedialog, messagebox
-from openpyxl.styles import Font, PatternFill, Alignment
-from openpyxl import Workbook
-import warnings
 
+from plan_engine import (PLAN_VARIANTS, PLAN_OUTPUT_MODES, PLAN_PARETO_MODES, load_processed_lines, get_line_summary,
+                         generate_operational_plans, parse_capacities, parse_headways)
+from result_store import ResultStore
+
+
+def import_gui_modules():
+    """Import tkinter only when the GUI is started"""
+    global tk, ttk, filedialog, messagebox
+    import tkinter as tk
+    from tkinter import ttk, filedialog, messagebox
 
-warnings.filterwarnings('ignore')
 
 # run it second in south med
-class RouteAnalyzer:
-    def __init__(self, line_name, route_data, dwell_time=3):
-        self.line_name = line_name
-        self.route_data = route_data
-        self.dwell_time = dwell_time
-    
-    def extract_stops_from_route(self, route_string):
-        """Extract stop numbers from route string like '747 → 3972 → 3970 → 3968 → 748'"""
-        if pd.isna(route_string):
-            return []
-        stops = [stop.strip() for stop in route_string.split('→')]
-        return [stop for stop in stops if stop]
-    
-    def convert_runtime_to_minutes(self, runtime_str):
-        """Convert LINKRUNTIME from seconds to minutes"""
-        try:
-            # Remove 's' if present and convert to float
-            if isinstance(runtime_str, str):
-                runtime_str = runtime_str.replace('s', '').strip()
-            runtime_seconds = float(runtime_str)
-            # Convert to minutes
-            return runtime_seconds / 60
-        except (ValueError, TypeError):
-            return 0
-    
-    def calculate_cycle_time(self, route_data):
-        """Calculate cycle time based on LINKRUNTIME (converted to minutes) and number of stops"""
-        total_runtime = 0
-        total_stops = 0
-        
-        for route in route_data:
-            runtime_minutes = self.convert_runtime_to_minutes(route['LINKRUNTIME'])
-            total_runtime += runtime_minutes
-            
-            stops = self.extract_stops_from_route(route['StopsArray'])
-            total_stops += len(stops)
-        
-        cycle_time = total_runtime + (total_stops * self.dwell_time)
-        return cycle_time
-    
-    def get_route_demands(self, route_data):
-        """Get individual route demands and max demand"""
-        route_demands = {}
-        desired_demand = 0
-        
-        for i, route in enumerate(route_data, 1):
-            route_name = route['LINEROUTENAME']
-            demand = route['VOL_AP_MAX']
-            route_demands[f'Route_{i}_Demand'] = demand
-            route_demands[f'Route_{i}_Name'] = route_name
-            desired_demand = max(desired_demand, demand)
-        
-        route_demands['Desired_Demand'] = desired_demand
-        return route_demands
-    
-    def analyze_system_with_headway(self, desired_demand, cycle_time, headway, bus_capacity):
-        """Analyze the complete system based on desired demand"""
-        if desired_demand > 0 and cycle_time > 0:
-            groups_per_hour = math.ceil(60 / headway)
-            required_capacity_per_group = desired_demand / groups_per_hour
-            buses_per_group = math.ceil(required_capacity_per_group / bus_capacity)
-            total_trips = math.ceil(desired_demand / bus_capacity)
-            actual_capacity_per_group = buses_per_group * bus_capacity
-            total_capacity_per_hour = actual_capacity_per_group * groups_per_hour
-            groups_in_service = cycle_time / headway
-            unique_groups = math.ceil(groups_in_service)
-            fleet_size_performing_Headway_for_1_Hour = min(groups_per_hour, unique_groups) * buses_per_group  
-            hub_area_for_1_hour = fleet_size_performing_Headway_for_1_Hour * 70
-            empty_seats = total_capacity_per_hour - desired_demand
-        else: 
-            buses_per_group = 0
-            fleet_size_performing_Headway_for_1_Hour = 0
-            total_capacity_per_hour = 0
-            empty_seats = 0
-            groups_per_hour = 0
-            unique_groups = 0
-            total_trips = 0
-            hub_area_for_1_hour = 0
-        
-        return {
-            'buses_per_group': buses_per_group,
-            'total_trips' : total_trips,
-            'fleet_size_performing_Headway_for_1_Hour': fleet_size_performing_Headway_for_1_Hour,
-            'hub_area_for_1_hour': hub_area_for_1_hour,
-            'total_capacity_per_hour': total_capacity_per_hour,
-            'empty_seats': empty_seats,
-            'groups_per_hour': groups_per_hour,
-            'unique_groups': unique_groups
-        }
-    
-    def format_route_display(self, route_string):
-        """Format route for display"""
-        return route_string.replace('→', ' → ')
+PLAN_VARIANT = PLAN_VARIANTS['desired']
 
 class DarkExcelStopProcessor:
     def __init__(self, root):
@@ -115,6 +25,7 @@ class DarkExcelStopProcessor:
         self.file_path = None
         self.data = None
         self.processed_lines = {}
+        self.line_summaries = {}  # (line_name, dwell_time) -> cached per-line values
         self.output_dir = None
         
         self.configure_dark_theme()
@@ -203,6 +114,30 @@ class DarkExcelStopProcessor:
         dwell_time_entry = ttk.Entry(config_frame, textvariable=self.dwell_time_var, width=10)
         dwell_time_entry.grid(row=0, column=5, sticky=tk.W)
         
+        ttk.Label(config_frame, text="Output:").grid(row=1, column=0, sticky=tk.W, padx=(0, 10), pady=(10, 0))
+        self.output_mode_var = tk.StringVar(value="per_line")
+        output_mode_combo = ttk.Combobox(config_frame, textvariable=self.output_mode_var, values=PLAN_OUTPUT_MODES,
+                                         state="readonly", width=17)
+        output_mode_combo.grid(row=1, column=1, sticky=tk.W, padx=(0, 20), pady=(10, 0))
+        
+        # Optional SQLite result store, left empty to skip it
+        ttk.Label(config_frame, text="Results DB:").grid(row=1, column=2, sticky=tk.W, padx=(0, 10), pady=(10, 0))
+        self.results_db_var = tk.StringVar()
+        results_db_entry = ttk.Entry(config_frame, textvariable=self.results_db_var, width=20)
+        results_db_entry.grid(row=1, column=3, sticky=tk.W, padx=(0, 20), pady=(10, 0))
+        
+        ttk.Label(config_frame, text="Run Tag:").grid(row=1, column=4, sticky=tk.W, padx=(0, 10), pady=(10, 0))
+        self.run_tag_var = tk.StringVar()
+        run_tag_entry = ttk.Entry(config_frame, textvariable=self.run_tag_var, width=10)
+        run_tag_entry.grid(row=1, column=5, sticky=tk.W, pady=(10, 0))
+        
+        # Pareto-optimal options per line and hub: written to Pareto_Frontier.xlsx, optionally marked in the plans
+        ttk.Label(config_frame, text="Pareto:").grid(row=2, column=0, sticky=tk.W, padx=(0, 10), pady=(10, 0))
+        self.pareto_var = tk.StringVar(value="off")
+        pareto_combo = ttk.Combobox(config_frame, textvariable=self.pareto_var, values=PLAN_PARETO_MODES,
+                                    state="readonly", width=17)
+        pareto_combo.grid(row=2, column=1, sticky=tk.W, padx=(0, 20), pady=(10, 0))
+        
         process_btn = ttk.Button(main_frame, text="🚀 GENERATE OPERATIONAL PLANS", 
                                 command=self.generate_operational_plans)
         process_btn.grid(row=4, column=0, columnspan=3, pady=15, ipadx=20, ipady=5)
@@ -211,21 +146,19 @@ class DarkExcelStopProcessor:
         results_frame.grid(row=5, column=0, columnspan=3, sticky=(tk.W, tk.E, tk.N, tk.S), pady=(0, 15))
         
         self.tree = ttk.Treeview(results_frame, 
-                                columns=("$LINEROUTEITEM:LINENAME", "Routes", "HubName", "Route1_Demand", "Route2_Demand", "MaxDemand", "CycleTime"), 
+                                columns=("$LINEROUTEITEM:LINENAME", "Routes", "HubName", "Route_Demands", "MaxDemand", "CycleTime"), 
                                 show="headings", height=12)
         self.tree.heading("$LINEROUTEITEM:LINENAME", text="LINE NAME")
         self.tree.heading("Routes", text="ROUTES")
         self.tree.heading("HubName", text="HUB NAME")
-        self.tree.heading("Route1_Demand", text="ROUTE 1 DEMAND")
-        self.tree.heading("Route2_Demand", text="ROUTE 2 DEMAND")
+        self.tree.heading("Route_Demands", text="ROUTE DEMANDS")
         self.tree.heading("MaxDemand", text="MAX DEMAND")
         self.tree.heading("CycleTime", text="CYCLE TIME (min)")
         
         self.tree.column("$LINEROUTEITEM:LINENAME", width=150)
         self.tree.column("Routes", width=200)
         self.tree.column("HubName", width=100)
-        self.tree.column("Route1_Demand", width=120)
-        self.tree.column("Route2_Demand", width=120)
+        self.tree.column("Route_Demands", width=160)
         self.tree.column("MaxDemand", width=100)
         self.tree.column("CycleTime", width=120)
         
@@ -295,33 +228,13 @@ class DarkExcelStopProcessor:
             return
         
         try:
-            self.data = pd.read_excel(self.file_path)
-            
-            required_columns = ['$LINEROUTEITEM:LINENAME', 'LINEROUTENAME', 'StopsArray', 'HubName', 'LINKRUNTIME', 'MAX:LINEROUTEITEMS\VOL(AP)']
-            missing_columns = [col for col in required_columns if col not in self.data.columns]
-            
-            if missing_columns:
-                messagebox.showerror("Error", f"Missing required columns: {', '.join(missing_columns)}")
+            try:
+                self.data, self.processed_lines = load_processed_lines(self.file_path)
+            except ValueError as e:
+                messagebox.showerror("Error", str(e))
                 return
             
-            self.processed_lines = {}
-            
-            for line_name in self.data['$LINEROUTEITEM:LINENAME'].unique():
-                line_data = self.data[self.data['$LINEROUTEITEM:LINENAME'] == line_name]
-                routes = []
-                
-                for _, row in line_data.iterrows():
-                    route_info = {
-                        'LINEROUTENAME': row['LINEROUTENAME'],
-                        'StopsArray': row['StopsArray'],
-                        'HubName': row['HubName'],
-                        'LINKRUNTIME': row['LINKRUNTIME'],
-                        'VOL_AP_MAX': row['MAX:LINEROUTEITEMS\VOL(AP)']
-                    }
-                    routes.append(route_info)
-                
-                self.processed_lines[line_name] = routes
-            
+            self.line_summaries = {}
             self.display_processed_lines()
             self.status_var.set(f"Successfully loaded {len(self.processed_lines)} lines")
             
@@ -329,32 +242,37 @@ class DarkExcelStopProcessor:
             messagebox.showerror("Error", f"Error loading file: {str(e)}")
             self.status_var.set("Error loading file")
     
+    def get_dwell_time(self):
+        try:
+            return int(self.dwell_time_var.get())
+        except ValueError:
+            return 3
+    
+    def get_line_summary(self, line_name, dwell_time):
+        return get_line_summary(self.line_summaries, self.processed_lines, line_name, dwell_time, **PLAN_VARIANT)
+    
     def display_processed_lines(self):
         for item in self.tree.get_children():
             self.tree.delete(item)
         
-        for line_name, routes in self.processed_lines.items():
-            analyzer = RouteAnalyzer(line_name, routes)
-            route_demands = analyzer.get_route_demands(routes)
-            cycle_time = analyzer.calculate_cycle_time(routes)
-            
-            route_display = " | ".join([route['LINEROUTENAME'] for route in routes])
-            
-            # Get HubName (assuming all routes in a line have the same hub)
-            hub_name = routes[0]['HubName'] if routes else 'N/A'
+        dwell_time = self.get_dwell_time()
+        
+        for line_name in self.processed_lines:
+            summary = self.get_line_summary(line_name, dwell_time)
+            route_demands = summary['route_demands']
             
-            route1_demand = route_demands.get('Route_1_Demand', 'N/A')
-            route2_demand = route_demands.get('Route_2_Demand', 'N/A')
-            desired_demand = route_demands['Desired_Demand']
+            # One entry per route, however many routes the line has
+            route_demand_display = " | ".join(
+                f"{route_demands[f'Route_{i}_Demand']:,.0f}" for i in range(1, summary['route_count'] + 1)
+            ) or 'N/A'
             
             self.tree.insert("", "end", values=(
                 line_name,
-                route_display,
-                hub_name,
-                f"{route1_demand:,.0f}" if route1_demand != 'N/A' else 'N/A',
-                f"{route2_demand:,.0f}" if route2_demand != 'N/A' else 'N/A',
-                f"{desired_demand:,.0f}",
-                f"{cycle_time:.1f}"
+                summary['route_display'],
+                summary['hub_name'],
+                route_demand_display,
+                f"{summary['desired_demand']:,.0f}",
+                f"{summary['cycle_time']:.1f}"
             ))
     
     def generate_operational_plans(self):
@@ -367,118 +285,29 @@ class DarkExcelStopProcessor:
             return
         
         try:
-            bus_capacities = [int(x.strip()) for x in self.bus_capacities_var.get().split(',')]
-            headways = [int(x.strip()) for x in self.headways_var.get().split(',')]
+            bus_capacities = parse_capacities(self.bus_capacities_var.get())
+            headways = parse_headways(self.headways_var.get())
             dwell_time = int(self.dwell_time_var.get())
             
-            operational_plans_dir = os.path.join(self.output_dir, "Operational_Plans")
-            os.makedirs(operational_plans_dir, exist_ok=True)
-            
-            generated_files = []
+            store = None
+            store_run = None
+            if self.results_db_var.get().strip():
+                store = ResultStore(self.results_db_var.get().strip())
+                # Tagged with the input file name unless a tag is given
+                run_tag = self.run_tag_var.get().strip() or os.path.splitext(os.path.basename(self.file_path))[0]
+                store_run = store.start_run(run_tag, source=self.file_path, settings={
+                    'bus_capacities': bus_capacities, 'headways': headways, 'dwell_time': dwell_time, **PLAN_VARIANT
+                })
             
-            for line_name, routes in self.processed_lines.items():
-                analyzer = RouteAnalyzer(line_name, routes, dwell_time)
-                
-                route_demands = analyzer.get_route_demands(routes)
-                cycle_time = analyzer.calculate_cycle_time(routes)
-                desired_demand = route_demands['Desired_Demand']
-                
-                # Get HubName (assuming all routes in a line have the same hub)
-                hub_name = routes[0]['HubName'] if routes else 'N/A'
-                
-                results = []
-                
-                for bus_capacity in bus_capacities:
-                    for headway in headways:
-                        system_analysis = analyzer.analyze_system_with_headway(
-                            desired_demand, cycle_time, headway, bus_capacity
-                        )
-                        
-                        # Create row_data in the exact order you want
-                        row_data = {}
-                        
-                        # Hub information first
-                        row_data['HubName'] = hub_name
-                        
-                        # Route information
-                        for i, route in enumerate(routes, 1):
-                            route_name = route['LINEROUTENAME']
-                            demand = route['VOL_AP_MAX']
-                            row_data[f'Route_{i}_Name'] = route_name
-                            row_data[f'Route_{i}_Stops'] = route['StopsArray']
-                        
-                        # Route demands
-                        for i, route in enumerate(routes, 1):
-                            row_data[f'Route_{i}_Demand'] = route['VOL_AP_MAX']
-                        
-                        row_data['Desired_Demand'] = desired_demand
-                        row_data['Bus_Capacity'] = bus_capacity
-                        row_data['Headway (min)'] = headway
-                        row_data['Cycle_Time (min)'] = round(cycle_time, 1)
-                        row_data['Buses_per_Group'] = system_analysis['buses_per_group']
-                        row_data['Total_Trips'] = system_analysis['total_trips']
-                        row_data['Groups_per_Hour'] = system_analysis['groups_per_hour']
-                        row_data['Unique_Groups'] = system_analysis['unique_groups']
-                        row_data['Fleet_Size'] = system_analysis['fleet_size_performing_Headway_for_1_Hour']
-                        
-                        row_data['Hub_Area'] = system_analysis['hub_area_for_1_hour']
-                       
-                        row_data['Capacity_per_Hour'] = round(system_analysis['total_capacity_per_hour'], 1)
-                        row_data['Empty_Seats_per_Hour'] = round(system_analysis['empty_seats'], 1)
-                        
-                        results.append(row_data)
-                
-                df = pd.DataFrame(results)
-                
-                # Define the exact column order with HubName first
-                final_columns = [
-                    'HubName',
-                    'Route_1_Name',
-                    'Route_1_Stops', 
-                    'Route_2_Name',
-                    'Route_2_Stops',
-                    'Route_1_Demand',
-                    'Route_2_Demand',
-                    'Desired_Demand',
-                    'Bus_Capacity',
-                    'Headway (min)',
-                    'Cycle_Time (min)',
-                    'Buses_per_Group',
-                    'Total_Trips',
-                    'Groups_per_Hour',
-                    'Unique_Groups',
-                    'Fleet_Size',
-                    'Hub_Area',
-                    'Capacity_per_Hour',
-                    'Empty_Seats_per_Hour'
-                ]
-                
-                df = df[final_columns]
-                
-                safe_line_name = "".join(c for c in line_name if c.isalnum() or c in (' ', '-', '_')).rstrip()
-                filename = os.path.join(operational_plans_dir, f"Operational_Plan_{safe_line_name}.xlsx")
-                
-                with pd.ExcelWriter(filename, engine='openpyxl') as writer:
-                    df.to_excel(writer, sheet_name='Operational_Analysis', index=False)
-                    
-                    ws = writer.sheets['Operational_Analysis']
-                    header_fill = PatternFill(start_color="366092", end_color="366092", fill_type="solid")
-                    header_font = Font(color="FFFFFF", bold=True)
-                    
-                    for col in range(1, len(ws[1]) + 1):
-                        ws.cell(1, col).fill = header_fill
-                        ws.cell(1, col).font = header_font
-                        ws.cell(1, col).alignment = Alignment(horizontal='center')
-                    
-                    for column in ws.columns:
-                        max_length = 0
-                        col_letter = column[0].column_letter
-                        for cell in column:
-                            if cell.value:
-                                max_length = max(max_length, len(str(cell.value)))
-                        ws.column_dimensions[col_letter].width = min(max_length + 2, 50)
-                
-                generated_files.append(filename)
+            try:
+                operational_plans_dir, generated_files = generate_operational_plans(
+                    self.processed_lines, self.output_dir, bus_capacities, headways, dwell_time,
+                    line_summaries=self.line_summaries, output_mode=self.output_mode_var.get(),
+                    store_run=store_run, pareto=self.pareto_var.get(), **PLAN_VARIANT
+                )
+            finally:
+                if store is not None:
+                    store.close()
             
             self.status_var.set(f"Generated {len(generated_files)} operational plans in '{operational_plans_dir}'")
             messagebox.showinfo("Success", 
@@ -494,11 +323,13 @@ class DarkExcelStopProcessor:
     
     def clear_results(self):
         self.processed_lines = {}
+        self.line_summaries = {}
         for item in self.tree.get_children():
             self.tree.delete(item)
         self.status_var.set("Results cleared")
 
 def main():
+    import_gui_modules()
     root = tk.Tk()
     app = DarkExcelStopProcessor(root)
     root.mainloop()
@@ -0,0 +1,863 @@
+import math
+import os
+import warnings
+from collections.abc import Mapping, Sequence
+
+
+# Shared stage 2 engine used by both operational plan GUIs and the headless tools.
+# The two plan variants only differ in the demand they size the fleet for and
+# in the hub area reserved per bus.
+# pandas and openpyxl are imported inside the functions that use them so that
+# importing the engine (and --help of the tools built on it) stays fast.
+PLAN_VARIANTS = {
+    # 70% of the maximum route demand, 100 hub area units per bus
+    'designed': {'demand_factor': 0.7, 'hub_area_per_bus': 100},
+    # Maximum route demand only, 70 hub area units per bus
+    'desired': {'demand_factor': None, 'hub_area_per_bus': 70},
+}
+
+# Layouts of the stage 2 output and the file written by the consolidated ones
+PLAN_OUTPUT_MODES = ('per_line', 'per_hub', 'csv', 'parquet')
+PLAN_OUTPUT_FILES = {
+    'per_hub': 'Operational_Plans_by_Hub.xlsx',
+    'csv': 'Operational_Plans.csv',
+    'parquet': 'Operational_Plans.parquet',
+}
+
+# Pareto analysis of the plan grid: rows no other row beats on all of these (lower is better)
+PLAN_PARETO_MODES = ('off', 'export', 'highlight')
+PARETO_OBJECTIVES = ['Fleet_Size', 'Hub_Area', 'Empty_Seats_per_Hour', 'Headway (min)']
+PARETO_FILE = 'Pareto_Frontier.xlsx'
+
+# Generalized cost of a trip in in-vehicle minutes: waiting counts double, and the
+# in-vehicle time is weighted up linearly from the crowding load factor, reaching
+# 1 + CROWDING_WEIGHT on a full bus
+WAIT_TIME_WEIGHT = 2.0
+CROWDING_LOAD_FACTOR = 0.8
+CROWDING_WEIGHT = 1.0
+PASSENGER_COLUMNS = ['Wait_Time (min)', 'Load_Factor', 'In_Vehicle_Time (min)', 'Generalized_Cost (min)']
+
+# Clock-face headways give a whole number of departures per hour at whole or
+# half minutes, so the timetable repeats every hour
+CLOCKFACE_HEADWAYS = (2, 2.5, 3, 4, 5, 6, 7.5, 10, 12, 15, 20, 30, 60)
+HEADWAY_POLICIES = {'clockface': CLOCKFACE_HEADWAYS}
+# Float noise from fractional headways (60 / 2.4 = 25.000000000000004) must not add a group
+GROUPS_TOLERANCE = 1e-9
+
+REQUIRED_COLUMNS = ['$LINEROUTEITEM:LINENAME', 'LINEROUTENAME', 'StopsArray', 'HubName', 'LINKRUNTIME', 'MAX:LINEROUTEITEMS\\VOL(AP)']
+
+
+class LineRoutes(Sequence):
+    """The routes of one line as slices of the LineStore columns (numpy views, no copies).
+
+    Indexing returns a route dict with the keys used throughout stage 2, built on
+    access for code that walks the routes one by one.
+    """
+
+    def __init__(self, store, start, stop):
+        self.route_names = store.route_names[start:stop]
+        self.stops = store.stops[start:stop]
+        self.hub_codes = store.hub_codes[start:stop]
+        self.runtime_seconds = store.runtime_seconds[start:stop]
+        self.demands = store.demands[start:stop]
+        self.stop_counts = store.stop_counts[start:stop]
+        self._hub_names = store.hub_names
+
+    def __len__(self):
+        return len(self.route_names)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        return self._route(self.route_names[i], self.stops[i], self.hub_codes[i],
+                           self.runtime_seconds[i].item(), self.demands[i].item())
+
+    def __iter__(self):
+        return map(self._route, self.route_names, self.stops, self.hub_codes,
+                   self.runtime_seconds.tolist(), self.demands.tolist())
+
+    def _route(self, route_name, stops, hub_code, runtime_seconds, demand):
+        return {
+            'LINEROUTENAME': route_name,
+            'StopsArray': stops,
+            'HubName': self._hub_names[hub_code] if hub_code >= 0 else math.nan,
+            'LINKRUNTIME': runtime_seconds,
+            'VOL_AP_MAX': demand,
+        }
+
+    def hub_name(self, i=0):
+        return self[i]['HubName']
+
+    def runtime_minutes(self):
+        return self.runtime_seconds / 60
+
+
+class LineStore(Mapping):
+    """Columnar store of the routes of every line: {line name: LineRoutes}.
+
+    Routes are kept in line order, so each line is a contiguous slice of the
+    column arrays. Hub names are stored once and referenced by code; runtimes
+    are parsed to seconds and stops counted once when the store is built.
+    """
+
+    def __init__(self, line_names, route_names, stops, hubs, runtimes, demands, line_sizes):
+        import numpy as np
+        import pandas as pd
+
+        # Route columns must already be in line order, with line_sizes routes per line
+        self.line_names = list(line_names)
+        self.offsets = np.concatenate(([0], np.cumsum(line_sizes, dtype=np.int64)))
+        self.route_names = np.asarray(route_names, dtype=object)
+        self.stops = np.asarray(stops, dtype=object)
+        self.hub_codes, hub_names = pd.factorize(pd.Series(hubs, dtype=object))
+        self.hub_names = list(hub_names)
+        self.runtime_seconds = parse_runtime_seconds(runtimes)
+        self.demands = pd.to_numeric(pd.Series(demands), errors='coerce').to_numpy()
+        self.stop_counts = count_route_stops(self.stops)
+        self._index = {line_name: i for i, line_name in enumerate(self.line_names)}
+
+    @classmethod
+    def from_frame(cls, data):
+        """Build the store from a stage 1 output in one groupby pass; lines keep their first-appearance order"""
+        import numpy as np
+
+        # Row positions of each line, in file order within the line
+        line_rows = data.groupby('$LINEROUTEITEM:LINENAME', sort=False).indices
+        order = np.concatenate(list(line_rows.values())) if line_rows else np.array([], dtype=int)
+
+        def column(name):
+            return data[name].to_numpy()[order]
+
+        return cls(
+            line_rows.keys(),
+            column('LINEROUTENAME'),
+            column('StopsArray'),
+            column('HubName'),
+            column('LINKRUNTIME'),
+            column('MAX:LINEROUTEITEMS\\VOL(AP)'),
+            [len(rows) for rows in line_rows.values()],
+        )
+
+    def __getitem__(self, line_name):
+        i = self._index[line_name]
+        return LineRoutes(self, self.offsets[i], self.offsets[i + 1])
+
+    def __iter__(self):
+        return iter(self.line_names)
+
+    def __len__(self):
+        return len(self.line_names)
+
+    def __contains__(self, line_name):
+        return line_name in self._index
+
+    def line_sizes(self):
+        import numpy as np
+        return np.diff(self.offsets)
+
+    def runtime_minutes(self):
+        return self.runtime_seconds / 60
+
+    def route_positions(self):
+        """Line index and 0-based route index within the line of every stored route"""
+        import numpy as np
+
+        sizes = self.line_sizes()
+        line_index = np.repeat(np.arange(len(self.line_names)), sizes)
+        return line_index, np.arange(len(line_index)) - self.offsets[line_index]
+
+    def line_hubs(self):
+        """Hub of each line (that of its first route), 'N/A' for lines without routes"""
+        return [self[line_name].hub_name() if size else 'N/A'
+                for line_name, size in zip(self.line_names, self.line_sizes())]
+
+
+def parse_runtime_seconds(runtimes):
+    """LINKRUNTIME values ('120s' or numbers) as float seconds.
+
+    Missing values stay NaN and anything unparseable becomes 0, as in
+    RouteAnalyzer.convert_runtime_to_minutes.
+    """
+    import numpy as np
+    import pandas as pd
+
+    runtimes = pd.Series(runtimes)
+    if pd.api.types.is_numeric_dtype(runtimes):
+        seconds = runtimes.astype(float)
+    else:
+        seconds = pd.to_numeric(runtimes.astype(str).str.replace('s', '').str.strip(), errors='coerce')
+    return np.where(seconds.isna() & runtimes.notna(), 0.0, seconds.to_numpy(dtype=float))
+
+
+def count_route_stops(stops):
+    """Number of stops in each 'a → b → c' StopsArray, 0 where it is missing"""
+    import pandas as pd
+
+    stops = pd.Series(stops, dtype=object).fillna('').astype(str)
+    # A stop is any text between arrows that is not blank
+    return stops.str.count(r'[^→]*[^→\s][^→]*').to_numpy(dtype=int)
+
+
+class RouteAnalyzer:
+    def __init__(self, line_name, route_data, dwell_time=3, demand_factor=0.7, hub_area_per_bus=100):
+        self.line_name = line_name
+        self.route_data = route_data
+        self.dwell_time = dwell_time
+        self.demand_factor = demand_factor
+        self.hub_area_per_bus = hub_area_per_bus
+
+    def extract_stops_from_route(self, route_string):
+        """Extract stop numbers from route string like '747 → 3972 → 3970 → 3968 → 748'"""
+        import pandas as pd
+        if pd.isna(route_string):
+            return []
+        stops = [stop.strip() for stop in route_string.split('→')]
+        return [stop for stop in stops if stop]
+
+    def convert_runtime_to_minutes(self, runtime_str):
+        """Convert LINKRUNTIME from seconds to minutes"""
+        try:
+            # Remove 's' if present and convert to float
+            if isinstance(runtime_str, str):
+                runtime_str = runtime_str.replace('s', '').strip()
+            runtime_seconds = float(runtime_str)
+            # Convert to minutes
+            return runtime_seconds / 60
+        except (ValueError, TypeError):
+            return 0
+
+    def count_stops(self, route_data):
+        """Total number of stops over all routes"""
+        if isinstance(route_data, LineRoutes):
+            return int(route_data.stop_counts.sum())
+        return sum(len(self.extract_stops_from_route(route['StopsArray'])) for route in route_data)
+
+    def calculate_cycle_time(self, route_data):
+        """Calculate cycle time based on LINKRUNTIME (converted to minutes) and number of stops"""
+        if isinstance(route_data, LineRoutes):
+            # Runtimes are parsed once in the line store; summed in route order as below
+            total_runtime = sum(route_data.runtime_minutes().tolist())
+        else:
+            total_runtime = 0
+            for route in route_data:
+                runtime_minutes = self.convert_runtime_to_minutes(route['LINKRUNTIME'])
+                total_runtime += runtime_minutes
+
+        cycle_time = total_runtime + (self.count_stops(route_data) * self.dwell_time)
+        return cycle_time
+
+    def get_route_demands(self, route_data):
+        """Get individual route demands and max demand"""
+        if isinstance(route_data, LineRoutes):
+            names_and_demands = zip(route_data.route_names, route_data.demands.tolist())
+        else:
+            names_and_demands = ((route['LINEROUTENAME'], route['VOL_AP_MAX']) for route in route_data)
+
+        route_demands = {}
+        desired_demand = 0
+
+        for i, (route_name, demand) in enumerate(names_and_demands, 1):
+            route_demands[f'Route_{i}_Demand'] = demand
+            route_demands[f'Route_{i}_Name'] = route_name
+            desired_demand = max(desired_demand, demand)
+
+        route_demands['Desired_Demand'] = desired_demand
+        if self.demand_factor is not None:
+            route_demands['Designed_Demand'] = math.ceil(desired_demand * self.demand_factor)
+        return route_demands
+
+    def get_plan_demand(self, route_demands):
+        """Demand the fleet is sized for: designed demand if a demand factor is set, else desired demand"""
+        if self.demand_factor is not None:
+            return route_demands['Designed_Demand']
+        return route_demands['Desired_Demand']
+
+    def analyze_system_with_headway(self, designed_demand, cycle_time, headway, bus_capacity):
+        """Analyze the complete system based on designed demand"""
+        if designed_demand > 0 and cycle_time > 0:
+            groups_per_hour = math.ceil(60 / headway - GROUPS_TOLERANCE)
+            required_capacity_per_group = designed_demand / groups_per_hour
+            buses_per_group = math.ceil(required_capacity_per_group / bus_capacity)
+            total_trips = math.ceil(designed_demand / bus_capacity)
+            actual_capacity_per_group = buses_per_group * bus_capacity
+            total_capacity_per_hour = actual_capacity_per_group * groups_per_hour
+            groups_in_service = cycle_time / headway
+            unique_groups = math.ceil(groups_in_service)
+            fleet_size_performing_Headway_for_1_Hour = min(groups_per_hour, unique_groups) * buses_per_group
+            hub_area_for_1_hour = fleet_size_performing_Headway_for_1_Hour * self.hub_area_per_bus
+            empty_seats = total_capacity_per_hour - designed_demand
+        else:
+            buses_per_group = 0
+            fleet_size_performing_Headway_for_1_Hour = 0
+            total_capacity_per_hour = 0
+            empty_seats = 0
+            groups_per_hour = 0
+            unique_groups = 0
+            total_trips = 0
+            hub_area_for_1_hour = 0
+
+        return {
+            'buses_per_group': buses_per_group,
+            'total_trips' : total_trips,
+            'fleet_size_performing_Headway_for_1_Hour': fleet_size_performing_Headway_for_1_Hour,
+            'hub_area_for_1_hour': hub_area_for_1_hour,
+            'total_capacity_per_hour': total_capacity_per_hour,
+            'empty_seats': empty_seats,
+            'groups_per_hour': groups_per_hour,
+            'unique_groups': unique_groups
+        }
+
+    def format_route_display(self, route_string):
+        """Format route for display"""
+        return route_string.replace('→', ' → ')
+
+
+def analyze_plan_grid(plan_demand, cycle_time, headway, bus_capacity, hub_area_per_bus=100):
+    """Array form of RouteAnalyzer.analyze_system_with_headway.
+
+    The inputs are broadcast against each other, so one call evaluates every
+    line x hour x capacity/headway combination. Returns the same keys as
+    analyze_system_with_headway, as arrays.
+    """
+    import numpy as np
+
+    plan_demand, cycle_time, headway, bus_capacity = np.broadcast_arrays(
+        *(np.asarray(value, dtype=float) for value in (plan_demand, cycle_time, headway, bus_capacity))
+    )
+    active = (plan_demand > 0) & (cycle_time > 0)
+
+    groups_per_hour = np.ceil(60 / headway - GROUPS_TOLERANCE)
+    buses_per_group = np.ceil(plan_demand / groups_per_hour / bus_capacity)
+    total_trips = np.ceil(plan_demand / bus_capacity)
+    total_capacity_per_hour = buses_per_group * bus_capacity * groups_per_hour
+    unique_groups = np.ceil(cycle_time / headway)
+    fleet_size = np.minimum(groups_per_hour, unique_groups) * buses_per_group
+
+    result = {
+        'buses_per_group': buses_per_group,
+        'total_trips': total_trips,
+        'fleet_size_performing_Headway_for_1_Hour': fleet_size,
+        'hub_area_for_1_hour': fleet_size * hub_area_per_bus,
+        'total_capacity_per_hour': total_capacity_per_hour,
+        'empty_seats': total_capacity_per_hour - plan_demand,
+        'groups_per_hour': groups_per_hour,
+        'unique_groups': unique_groups,
+    }
+    return {key: np.where(active, value, 0) for key, value in result.items()}
+
+
+def passenger_metrics(plan_demand, in_vehicle_time, headway, capacity_per_hour):
+    """Passenger side of the plan grid, broadcast like analyze_plan_grid.
+
+    Expected wait is half the headway, the load factor is the plan demand over
+    the hourly capacity. All metrics are 0 where no capacity is planned.
+    """
+    import numpy as np
+
+    plan_demand, in_vehicle_time, headway, capacity_per_hour = np.broadcast_arrays(
+        *(np.asarray(value, dtype=float) for value in (plan_demand, in_vehicle_time, headway, capacity_per_hour))
+    )
+    active = capacity_per_hour > 0
+
+    wait_time = headway / 2
+    load_factor = np.divide(plan_demand, capacity_per_hour, out=np.zeros_like(plan_demand), where=active)
+    crowding = np.clip((load_factor - CROWDING_LOAD_FACTOR) / (1 - CROWDING_LOAD_FACTOR), 0, None)
+    generalized_cost = WAIT_TIME_WEIGHT * wait_time + in_vehicle_time * (1 + CROWDING_WEIGHT * crowding)
+
+    result = {
+        'wait_time': wait_time,
+        'load_factor': load_factor,
+        'in_vehicle_time': in_vehicle_time,
+        'generalized_cost': generalized_cost,
+    }
+    return {key: np.where(active, value, 0) for key, value in result.items()}
+
+
+def plain_number(value):
+    """A parsed value as int when it is whole, so '10' and '10.0' both give 10"""
+    value = round(float(value), 9)
+    return int(value) if value.is_integer() else value
+
+
+def parse_range(text):
+    """'start:stop[:step]' -> the values from start up to and including stop (step 1 by default)"""
+    parts = text.split(':')
+    if len(parts) not in (2, 3):
+        raise ValueError(f"Invalid range '{text}', expected start:stop or start:stop:step")
+    start, stop = float(parts[0]), float(parts[1])
+    step = float(parts[2]) if len(parts) == 3 else 1.0
+    if step <= 0 or stop < start:
+        raise ValueError(f"Invalid range '{text}', expected start <= stop and a positive step")
+    count = math.floor((stop - start) / step + GROUPS_TOLERANCE) + 1
+    return [plain_number(start + i * step) for i in range(count)]
+
+
+def parse_number_list(text):
+    """Comma list of numbers and start:stop[:step] ranges, in order and without duplicates"""
+    values = []
+    for token in text.split(','):
+        token = token.strip()
+        if not token:
+            raise ValueError(f"Empty value in '{text}'")
+        values.extend(parse_range(token) if ':' in token else [plain_number(token)])
+    return list(dict.fromkeys(values))
+
+
+def parse_capacities(text):
+    """Bus capacities: '25, 50' or '25:100:25', whole and positive"""
+    capacities = parse_number_list(text)
+    if any(not isinstance(capacity, int) or capacity <= 0 for capacity in capacities):
+        raise ValueError("Bus capacities must be positive whole numbers")
+    return capacities
+
+
+def parse_headways(text):
+    """Headways in minutes from numbers, ranges and policy sets, which can be mixed.
+
+    '10, 15, 20', '3:60' (every minute), '5:30:2.5' and 'clockface' (the
+    CLOCKFACE_HEADWAYS; 'clockface:5:30' keeps those from 5 to 30 minutes).
+    """
+    values = []
+    for token in text.split(','):
+        if not token.strip():
+            raise ValueError(f"Empty value in '{text}'")
+        name, _, bounds = token.strip().lower().partition(':')
+        if name in HEADWAY_POLICIES:
+            low, high = 0, math.inf
+            if bounds:
+                low, _, high = bounds.partition(':')
+                low, high = float(low), float(high)
+            values.extend(headway for headway in HEADWAY_POLICIES[name] if low <= headway <= high)
+        else:
+            values.extend(parse_number_list(token))
+    headways = list(dict.fromkeys(values))
+    if not headways or any(headway <= 0 for headway in headways):
+        raise ValueError("Headways must be positive")
+    return headways
+
+
+def load_processed_lines(file_path):
+    """Read a stage 1 output and return (data, LineStore of its lines), raising ValueError on missing columns"""
+    import pandas as pd
+
+    # openpyxl warns about workbook styles it does not understand
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        data = pd.read_excel(file_path)
+
+    missing_columns = [col for col in REQUIRED_COLUMNS if col not in data.columns]
+    if missing_columns:
+        raise ValueError(f"Missing required columns: {', '.join(missing_columns)}")
+
+    return data, LineStore.from_frame(data)
+
+
+def get_line_summary(line_summaries, processed_lines, line_name, dwell_time, demand_factor=0.7, hub_area_per_bus=100):
+    """Return the per-line demands, stop count and cycle time, computed once per dwell time and plan variant"""
+    # The analyzer and plan demand depend on the variant, so one cache can serve several variants
+    key = (line_name, dwell_time, demand_factor, hub_area_per_bus)
+    summary = line_summaries.get(key)
+    if summary is None:
+        routes = processed_lines[line_name]
+        analyzer = RouteAnalyzer(line_name, routes, dwell_time, demand_factor, hub_area_per_bus)
+        route_demands = analyzer.get_route_demands(routes)
+
+        summary = {
+            'analyzer': analyzer,
+            # Get HubName (assuming all routes in a line have the same hub)
+            'hub_name': routes[0]['HubName'] if routes else 'N/A',
+            'route_display': " | ".join([route['LINEROUTENAME'] for route in routes]),
+            'route_demands': route_demands,
+            'route_count': len(routes),
+            # Route columns repeated on every row of the plan
+            'route_columns': wide_route_columns(routes),
+            'desired_demand': route_demands['Desired_Demand'],
+            'designed_demand': route_demands.get('Designed_Demand'),
+            'plan_demand': analyzer.get_plan_demand(route_demands),
+            'stop_count': analyzer.count_stops(routes),
+            'cycle_time': analyzer.calculate_cycle_time(routes)
+        }
+        # A passenger rides one route: the average route running time, with dwell
+        summary['in_vehicle_time'] = summary['cycle_time'] / len(routes) if routes else 0
+        line_summaries[key] = summary
+    return summary
+
+
+def route_column_names(route_count):
+    """Route_<i>_Name and Route_<i>_Stops of every route, then the Route_<i>_Demand columns"""
+    columns = []
+    for i in range(1, route_count + 1):
+        columns += [f'Route_{i}_Name', f'Route_{i}_Stops']
+    return columns + [f'Route_{i}_Demand' for i in range(1, route_count + 1)]
+
+
+def wide_route_columns(routes):
+    """Route columns of one line's plan rows"""
+    route_columns = {}
+    for i, route in enumerate(routes, 1):
+        route_columns[f'Route_{i}_Name'] = route['LINEROUTENAME']
+        route_columns[f'Route_{i}_Stops'] = route['StopsArray']
+        route_columns[f'Route_{i}_Demand'] = route['VOL_AP_MAX']
+    return route_columns
+
+
+def route_table(processed_lines):
+    """Long (line, route) table of all lines: LineName, Route_Index, Name, Stops, Demand"""
+    import numpy as np
+    import pandas as pd
+
+    columns = ['LineName', 'Route_Index', 'Name', 'Stops', 'Demand']
+    if isinstance(processed_lines, LineStore):
+        line_index, route_index = processed_lines.route_positions()
+        return pd.DataFrame(dict(zip(columns, (
+            np.asarray(processed_lines.line_names, dtype=object)[line_index], route_index + 1,
+            processed_lines.route_names, processed_lines.stops, processed_lines.demands,
+        ))))
+
+    return pd.DataFrame(
+        [(line_name, i, route['LINEROUTENAME'], route['StopsArray'], route['VOL_AP_MAX'])
+         for line_name, routes in processed_lines.items() for i, route in enumerate(routes, 1)],
+        columns=columns
+    )
+
+
+def pivot_route_columns(routes_long):
+    """Wide route columns per line from the long route table, one row per LineName"""
+    wide = routes_long.pivot(index='LineName', columns='Route_Index', values=['Name', 'Stops', 'Demand'])
+    wide.columns = [f'Route_{i}_{field}' for field, i in wide.columns]
+    route_count = int(routes_long['Route_Index'].max()) if len(routes_long) else 0
+    return wide.reindex(columns=route_column_names(route_count)).reset_index()
+
+
+def get_plan_columns(demand_factor=0.7, route_count=2):
+    """Exact column order of an operational plan, with HubName first"""
+    final_columns = [
+        'HubName',
+        *route_column_names(route_count),
+        'Desired_Demand',
+        'Designed_Demand',
+        'Bus_Capacity',
+        'Headway (min)',
+        'Cycle_Time (min)',
+        'Buses_per_Group',
+        'Total_Trips',
+        'Groups_per_Hour',
+        'Unique_Groups',
+        'Fleet_Size',
+        'Hub_Area',
+        'Capacity_per_Hour',
+        'Empty_Seats_per_Hour',
+        *PASSENGER_COLUMNS
+    ]
+    if demand_factor is None:
+        final_columns.remove('Designed_Demand')
+    return final_columns
+
+
+def add_passenger_columns(df, plan_demand, in_vehicle_time):
+    """Fill the PASSENGER_COLUMNS of a plan table from its headway and capacity columns"""
+    passenger = passenger_metrics(plan_demand, in_vehicle_time, df['Headway (min)'], df['Capacity_per_Hour'])
+    df['Wait_Time (min)'] = passenger['wait_time'].round(2)
+    df['Load_Factor'] = passenger['load_factor'].round(3)
+    df['In_Vehicle_Time (min)'] = passenger['in_vehicle_time'].round(1)
+    df['Generalized_Cost (min)'] = passenger['generalized_cost'].round(1)
+
+
+def plan_grid_table(summaries, bus_capacities, headways, hub_area_per_bus=100):
+    """Plan columns of every line summary x capacity x headway, evaluated as one array grid.
+
+    Rows come line by line, then by capacity, then by headway. Column types
+    follow RouteAnalyzer.analyze_system_with_headway: counts are integers, and
+    capacity and empty seats stay integers as long as capacities and demands are.
+    """
+    import numpy as np
+    import pandas as pd
+
+    capacities = pd.Series(list(bus_capacities), dtype=None if len(bus_capacities) else float).to_numpy()
+    headway_values = pd.Series(list(headways), dtype=None if len(headways) else float).to_numpy()
+    option_count = len(capacities) * len(headway_values)
+
+    def per_line(key, dtype=None):
+        return np.repeat(pd.Series([summary[key] for summary in summaries], dtype=dtype).to_numpy(), option_count)
+
+    plan_demand = pd.Series([summary['plan_demand'] for summary in summaries], dtype=float).to_numpy()
+    cycle_time = np.array([summary['cycle_time'] for summary in summaries], dtype=float)
+    grid = analyze_plan_grid(plan_demand[:, None], cycle_time[:, None], np.tile(headway_values, len(capacities)),
+                             np.repeat(capacities, len(headway_values)), hub_area_per_bus)
+    grid = {key: value.ravel() for key, value in grid.items()}
+
+    def rounded(values, integer):
+        # Same rounding as round(value, 1) on every row
+        return values.astype(np.int64) if integer else np.array([round(value, 1) for value in values.tolist()])
+
+    integer_capacity = np.issubdtype(capacities.dtype, np.integer)
+    integer_demand = integer_capacity and pd.Series([summary['plan_demand'] for summary in summaries]).dtype.kind == 'i'
+    df = pd.DataFrame({
+        'HubName': per_line('hub_name', object),
+        'Desired_Demand': per_line('desired_demand'),
+        'Designed_Demand': per_line('designed_demand'),
+        'Bus_Capacity': np.tile(np.repeat(capacities, len(headway_values)), len(summaries)),
+        'Headway (min)': np.tile(headway_values, len(capacities) * len(summaries)),
+        'Cycle_Time (min)': np.repeat([round(summary['cycle_time'], 1) for summary in summaries], option_count),
+        'Buses_per_Group': grid['buses_per_group'].astype(np.int64),
+        'Total_Trips': grid['total_trips'].astype(np.int64),
+        'Groups_per_Hour': grid['groups_per_hour'].astype(np.int64),
+        'Unique_Groups': grid['unique_groups'].astype(np.int64),
+        'Fleet_Size': grid['fleet_size_performing_Headway_for_1_Hour'].astype(np.int64),
+        'Hub_Area': grid['hub_area_for_1_hour'].astype(np.int64 if isinstance(hub_area_per_bus, int) else float),
+        'Capacity_per_Hour': rounded(grid['total_capacity_per_hour'], integer_capacity),
+        'Empty_Seats_per_Hour': rounded(grid['empty_seats'], integer_demand),
+    })
+    if len(df):
+        add_passenger_columns(df, np.repeat(plan_demand, option_count),
+                              per_line('in_vehicle_time', float))
+    return df
+
+
+def build_plan_table(summary, bus_capacities, headways, with_routes=True):
+    """Evaluate the capacity/headway grid for one line summary.
+
+    Without with_routes the route columns are left out, so that consolidated
+    outputs can add them once for all lines from the long route table.
+    """
+    df = plan_grid_table([summary], bus_capacities, headways, summary['analyzer'].hub_area_per_bus)
+    if with_routes:
+        for column, value in summary['route_columns'].items():
+            df[column] = value
+
+    columns = get_plan_columns(summary['analyzer'].demand_factor, summary['route_count'] if with_routes else 0)
+    return df.reindex(columns=columns)
+
+
+def style_plan_sheet(ws):
+    """Apply the header colours and column widths used by all plan workbooks"""
+    from openpyxl.styles import Font, PatternFill, Alignment
+
+    header_fill = PatternFill(start_color="366092", end_color="366092", fill_type="solid")
+    header_font = Font(color="FFFFFF", bold=True)
+
+    for col in range(1, len(ws[1]) + 1):
+        ws.cell(1, col).fill = header_fill
+        ws.cell(1, col).font = header_font
+        ws.cell(1, col).alignment = Alignment(horizontal='center')
+
+    for column in ws.columns:
+        max_length = 0
+        col_letter = column[0].column_letter
+        for cell in column:
+            if cell.value:
+                max_length = max(max_length, len(str(cell.value)))
+        ws.column_dimensions[col_letter].width = min(max_length + 2, 50)
+
+
+def pareto_mask(values):
+    """Non-dominated rows of an (n rows x k objectives) array, all objectives minimised.
+
+    A row is dominated when another row is no worse in every objective and
+    better in at least one. Rows are compared pairwise with broadcasting, in
+    blocks that bound the size of the n x n comparison.
+    """
+    import numpy as np
+
+    values = np.asarray(values, dtype=float)
+    mask = np.ones(len(values), dtype=bool)
+    block = max(1, 2_000_000 // max(1, values.size))
+    for start in range(0, len(values), block):
+        rows = values[start:start + block, None, :]
+        dominated = ((values[None, :, :] <= rows).all(axis=2) & (values[None, :, :] < rows).any(axis=2)).any(axis=1)
+        mask[start:start + block] = ~dominated
+    return mask
+
+
+def pareto_group_mask(plan_table, group_columns):
+    """Whether each row of plan_table is on the Pareto frontier of its group (e.g. per line or per hub)"""
+    import numpy as np
+
+    values = plan_table[PARETO_OBJECTIVES].to_numpy(dtype=float)
+    mask = np.zeros(len(plan_table), dtype=bool)
+    for rows in plan_table.groupby(group_columns, sort=False).indices.values():
+        mask[rows] = pareto_mask(values[rows])
+    return mask
+
+
+def pareto_frontier(plan_table, group_columns):
+    """Rows of plan_table on the Pareto frontier of their group"""
+    return plan_table[pareto_group_mask(plan_table, group_columns)]
+
+
+def hub_plan_grid(plan_table):
+    """Plan metrics summed over the lines of each hub, per bus capacity and headway"""
+    return plan_table.groupby(['HubName', 'Bus_Capacity', 'Headway (min)'], sort=False).agg(
+        Lines=('LineName', 'nunique'), Fleet_Size=('Fleet_Size', 'sum'), Hub_Area=('Hub_Area', 'sum'),
+        Total_Trips=('Total_Trips', 'sum'), Capacity_per_Hour=('Capacity_per_Hour', 'sum'),
+        Empty_Seats_per_Hour=('Empty_Seats_per_Hour', 'sum'),
+    ).reset_index()
+
+
+def write_pareto_frontier(plan_table, filename):
+    """Workbook with the Pareto-optimal options of every line and of every hub (all lines on one option).
+
+    plan_table is the line x capacity x headway table with a LineName column.
+    """
+    import pandas as pd
+
+    line_frontier = pareto_frontier(plan_table, ['LineName'])
+    hub_frontier = pareto_frontier(hub_plan_grid(plan_table), ['HubName'])
+    with pd.ExcelWriter(filename, engine='openpyxl') as writer:
+        for sheet_name, df in (('Line_Frontier', line_frontier), ('Hub_Frontier', hub_frontier)):
+            df.to_excel(writer, sheet_name=sheet_name, index=False)
+            style_plan_sheet(writer.sheets[sheet_name])
+    return len(line_frontier), len(hub_frontier)
+
+
+def highlight_pareto_rows(ws):
+    """Fill the rows whose Pareto column is True"""
+    from openpyxl.styles import PatternFill
+
+    headers = [cell.value for cell in ws[1]]
+    if 'Pareto' not in headers:
+        return
+    pareto_col = headers.index('Pareto') + 1
+    fill = PatternFill(start_color="C6EFCE", end_color="C6EFCE", fill_type="solid")
+    for row in ws.iter_rows(min_row=2):
+        if row[pareto_col - 1].value is True:
+            for cell in row:
+                cell.fill = fill
+
+
+def safe_file_name(name):
+    return "".join(c for c in str(name) if c.isalnum() or c in (' ', '-', '_')).rstrip()
+
+
+def write_plan_workbook(df, filename, sheet_name='Operational_Analysis'):
+    import pandas as pd
+
+    with pd.ExcelWriter(filename, engine='openpyxl') as writer:
+        df.to_excel(writer, sheet_name=sheet_name, index=False)
+        style_plan_sheet(writer.sheets[sheet_name])
+        highlight_pareto_rows(writer.sheets[sheet_name])
+
+
+def safe_sheet_name(name, used_names):
+    """Excel sheet names are limited to 31 characters without []:*?/\\ and must be unique"""
+    base = "".join(c for c in str(name) if c not in '[]:*?/\\')[:31] or 'Sheet'
+    sheet_name = base
+    counter = 2
+    while sheet_name.lower() in used_names:
+        suffix = f"_{counter}"
+        sheet_name = base[:31 - len(suffix)] + suffix
+        counter += 1
+    used_names.add(sheet_name.lower())
+    return sheet_name
+
+
+def write_plans_by_hub(plan_table, filename):
+    """One workbook with a sheet per hub"""
+    import pandas as pd
+
+    used_names = set()
+    with pd.ExcelWriter(filename, engine='openpyxl') as writer:
+        for hub_name, hub_df in plan_table.groupby('HubName', sort=True):
+            sheet_name = safe_sheet_name(hub_name, used_names)
+            hub_df.to_excel(writer, sheet_name=sheet_name, index=False)
+            style_plan_sheet(writer.sheets[sheet_name])
+            highlight_pareto_rows(writer.sheets[sheet_name])
+
+
+def generate_operational_plans(processed_lines, output_dir, bus_capacities, headways, dwell_time,
+                               demand_factor=0.7, hub_area_per_bus=100, line_summaries=None,
+                               output_mode='per_line', store_run=None, pareto='off'):
+    """Write the plans of all lines into <output_dir>/Operational_Plans.
+
+    output_mode is one of PLAN_OUTPUT_MODES: 'per_line' writes one
+    Operational_Plan_<line>.xlsx per line, 'per_hub' one workbook with a sheet
+    per hub, 'csv' and 'parquet' one long table (line x capacity x headway).
+    pareto is one of PLAN_PARETO_MODES: 'export' also writes the Pareto-optimal
+    rows per line and per hub to Pareto_Frontier.xlsx, 'highlight' in addition
+    marks them in the plans with a Pareto column.
+    store_run (from result_store.ResultStore.start_run) also records the plans
+    in the SQLite result store.
+    """
+    import numpy as np
+    import pandas as pd
+
+    if output_mode not in PLAN_OUTPUT_MODES:
+        raise ValueError(f"Unknown output mode '{output_mode}', expected one of: {', '.join(PLAN_OUTPUT_MODES)}")
+    if pareto not in PLAN_PARETO_MODES:
+        raise ValueError(f"Unknown Pareto mode '{pareto}', expected one of: {', '.join(PLAN_PARETO_MODES)}")
+    if line_summaries is None:
+        line_summaries = {}
+
+    operational_plans_dir = os.path.join(output_dir, "Operational_Plans")
+    os.makedirs(operational_plans_dir, exist_ok=True)
+
+    generated_files = []
+    line_plans = []
+    line_grids = []
+
+    summaries = [get_line_summary(line_summaries, processed_lines, line_name, dwell_time, demand_factor,
+                                  hub_area_per_bus) for line_name in processed_lines]
+
+    if output_mode == 'per_line':
+        for line_name, summary in zip(processed_lines, summaries):
+            df = build_plan_table(summary, bus_capacities, headways)
+            if pareto == 'highlight':
+                df['Pareto'] = pareto_mask(df[PARETO_OBJECTIVES].to_numpy(dtype=float))
+            if pareto != 'off':
+                line_grid = df.drop(columns=[*route_column_names(summary['route_count']), 'Pareto'], errors='ignore')
+                line_grid.insert(1, 'LineName', line_name)
+                line_grids.append(line_grid)
+            if store_run is not None:
+                line_plans.append((line_name, processed_lines[line_name], summary, df))
+
+            filename = os.path.join(operational_plans_dir, f"Operational_Plan_{safe_file_name(line_name)}.xlsx")
+            write_plan_workbook(df, filename)
+            generated_files.append(filename)
+    else:
+        # All lines x capacities x headways in one array evaluation
+        option_count = len(bus_capacities) * len(headways)
+        plan_table = plan_grid_table(summaries, bus_capacities, headways, hub_area_per_bus)
+        plan_table.insert(1, 'LineName', np.repeat(np.asarray(list(processed_lines), dtype=object), option_count))
+        if demand_factor is None:
+            plan_table = plan_table.drop(columns='Designed_Demand')
+        if pareto == 'highlight':
+            plan_table['Pareto'] = pareto_group_mask(plan_table, ['LineName'])
+        if pareto != 'off':
+            line_grids.append(plan_table.drop(columns='Pareto', errors='ignore'))
+        if store_run is not None:
+            for i, (line_name, summary) in enumerate(zip(processed_lines, summaries)):
+                line_plans.append((line_name, processed_lines[line_name], summary,
+                                   plan_table.iloc[i * option_count:(i + 1) * option_count]))
+
+        # Lines can have any number of routes: the route columns are pivoted from
+        # the long (line, route) table, up to the largest route count
+        routes_long = route_table(processed_lines)
+        route_count = int(routes_long['Route_Index'].max()) if len(routes_long) else 0
+        plan_columns = get_plan_columns(demand_factor, route_count)
+        plan_columns.insert(1, 'LineName')
+        if pareto == 'highlight':
+            plan_columns.append('Pareto')
+        if len(plan_table):
+            plan_table = plan_table.merge(pivot_route_columns(routes_long), on='LineName', how='left')[plan_columns]
+        else:
+            plan_table = pd.DataFrame(columns=plan_columns)
+        filename = os.path.join(operational_plans_dir, PLAN_OUTPUT_FILES[output_mode])
+
+        if output_mode == 'per_hub':
+            write_plans_by_hub(plan_table, filename)
+        elif output_mode == 'csv':
+            plan_table.to_csv(filename, index=False, encoding='utf-8-sig')
+        else:
+            # Needs pyarrow or fastparquet
+            plan_table.to_parquet(filename, index=False)
+        generated_files.append(filename)
+
+    if line_grids:
+        filename = os.path.join(operational_plans_dir, PARETO_FILE)
+        write_pareto_frontier(pd.concat(line_grids, ignore_index=True), filename)
+        generated_files.append(filename)
+
+    if store_run is not None:
+        store_run.write_lines(line_plans)
+
+    return operational_plans_dir, generated_files
@@ -0,0 +1,384 @@
+import argparse
+import json
+import os
+import sqlite3
+import sys
+from datetime import datetime
+
+
+# SQLite store for the results of stage 2 (lines, routes, stops, plan rows) and
+# stage 3 (hub summaries). Every run is tagged, so scenarios can be compared
+# with one query instead of crawling the output folders. Writing a run again
+# under the same tag replaces what that stage wrote before.
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id INTEGER PRIMARY KEY,
+    tag TEXT NOT NULL UNIQUE,
+    created_at TEXT NOT NULL,
+    updated_at TEXT NOT NULL,
+    source TEXT,
+    settings TEXT
+);
+CREATE TABLE IF NOT EXISTS lines (
+    run_id INTEGER NOT NULL,
+    line TEXT NOT NULL,
+    hub TEXT,
+    route_count INTEGER,
+    stop_count INTEGER,
+    desired_demand REAL,
+    plan_demand REAL,
+    cycle_time REAL,
+    PRIMARY KEY (run_id, line)
+);
+CREATE TABLE IF NOT EXISTS routes (
+    run_id INTEGER NOT NULL,
+    line TEXT NOT NULL,
+    route_index INTEGER NOT NULL,
+    route TEXT,
+    demand REAL,
+    runtime_min REAL,
+    stop_count INTEGER,
+    PRIMARY KEY (run_id, line, route_index)
+);
+CREATE TABLE IF NOT EXISTS stops (
+    run_id INTEGER NOT NULL,
+    line TEXT NOT NULL,
+    route_index INTEGER NOT NULL,
+    seq INTEGER NOT NULL,
+    stop TEXT NOT NULL,
+    PRIMARY KEY (run_id, line, route_index, seq)
+);
+CREATE TABLE IF NOT EXISTS plan_rows (
+    run_id INTEGER NOT NULL,
+    line TEXT NOT NULL,
+    hub TEXT,
+    bus_capacity INTEGER NOT NULL,
+    headway REAL NOT NULL,
+    cycle_time REAL,
+    buses_per_group INTEGER,
+    total_trips INTEGER,
+    groups_per_hour INTEGER,
+    unique_groups INTEGER,
+    fleet_size INTEGER,
+    hub_area REAL,
+    capacity_per_hour REAL,
+    empty_seats_per_hour REAL,
+    PRIMARY KEY (run_id, line, bus_capacity, headway)
+);
+CREATE TABLE IF NOT EXISTS hub_summaries (
+    run_id INTEGER NOT NULL,
+    hub TEXT NOT NULL,
+    bus_capacity INTEGER NOT NULL,
+    headway REAL NOT NULL,
+    lines INTEGER,
+    fleet_size INTEGER,
+    hub_area REAL,
+    total_trips INTEGER,
+    capacity_per_hour REAL,
+    empty_seats_per_hour REAL,
+    PRIMARY KEY (run_id, hub, bus_capacity, headway)
+);
+CREATE INDEX IF NOT EXISTS idx_lines_hub ON lines (hub, run_id);
+CREATE INDEX IF NOT EXISTS idx_routes_route ON routes (route);
+CREATE INDEX IF NOT EXISTS idx_stops_stop ON stops (stop);
+CREATE INDEX IF NOT EXISTS idx_plan_rows_hub ON plan_rows (hub, bus_capacity, headway);
+CREATE INDEX IF NOT EXISTS idx_plan_rows_line ON plan_rows (line, bus_capacity, headway);
+CREATE INDEX IF NOT EXISTS idx_plan_rows_option ON plan_rows (bus_capacity, headway);
+CREATE INDEX IF NOT EXISTS idx_hub_summaries_hub ON hub_summaries (hub, bus_capacity, headway);
+"""
+
+# Plan table column -> store column, shared by plan rows and hub summaries
+PLAN_COLUMN_MAP = {
+    'Bus_Capacity': 'bus_capacity',
+    'Headway (min)': 'headway',
+    'Cycle_Time (min)': 'cycle_time',
+    'Buses_per_Group': 'buses_per_group',
+    'Total_Trips': 'total_trips',
+    'Groups_per_Hour': 'groups_per_hour',
+    'Unique_Groups': 'unique_groups',
+    'Fleet_Size': 'fleet_size',
+    'Hub_Area': 'hub_area',
+    'Capacity_per_Hour': 'capacity_per_hour',
+    'Empty_Seats_per_Hour': 'empty_seats_per_hour',
+    'Lines': 'lines',
+}
+
+RUN_TABLES = ('lines', 'routes', 'stops', 'plan_rows', 'hub_summaries')
+
+
+def plain(value):
+    """numpy scalars and NaN to plain Python values sqlite3 accepts"""
+    if hasattr(value, 'item'):
+        value = value.item()
+    if isinstance(value, float) and value != value:
+        return None
+    return value
+
+
+class StoreRun:
+    """Writer for one tagged run, handed to the stage 2 engine and to stage 3"""
+
+    def __init__(self, store, run_id, tag):
+        self.store = store
+        self.run_id = run_id
+        self.tag = tag
+
+    def write_lines(self, line_plans):
+        """Replace the lines, routes, stops and plan rows of the run.
+
+        line_plans is a list of (line name, routes, line summary, plan table).
+        """
+        lines, routes, stops, plan_rows = [], [], [], []
+        for line_name, line_routes, summary, plan_df in line_plans:
+            line = str(line_name)
+            analyzer = summary['analyzer']
+            lines.append((self.run_id, line, summary['hub_name'], len(line_routes), summary['stop_count'],
+                          plain(summary['desired_demand']), plain(summary['plan_demand']), summary['cycle_time']))
+
+            for route_index, route in enumerate(line_routes, 1):
+                route_stops = analyzer.extract_stops_from_route(route['StopsArray'])
+                routes.append((self.run_id, line, route_index, route['LINEROUTENAME'], plain(route['VOL_AP_MAX']),
+                               analyzer.convert_runtime_to_minutes(route['LINKRUNTIME']), len(route_stops)))
+                stops.extend((self.run_id, line, route_index, seq, stop) for seq, stop in enumerate(route_stops, 1))
+
+            columns = [col for col in PLAN_COLUMN_MAP if col in plan_df.columns]
+            for values in plan_df[columns].itertuples(index=False):
+                plan_rows.append((self.run_id, line, summary['hub_name'])
+                                 + tuple(plain(value) for value in values))
+            plan_columns = ['run_id', 'line', 'hub'] + [PLAN_COLUMN_MAP[col] for col in columns]
+
+        with self.store.connection as connection:
+            for table in ('lines', 'routes', 'stops', 'plan_rows'):
+                connection.execute(f"DELETE FROM {table} WHERE run_id = ?", (self.run_id,))
+            connection.executemany("INSERT INTO lines VALUES (?, ?, ?, ?, ?, ?, ?, ?)", lines)
+            connection.executemany("INSERT INTO routes VALUES (?, ?, ?, ?, ?, ?, ?)", routes)
+            connection.executemany("INSERT INTO stops VALUES (?, ?, ?, ?, ?)", stops)
+            if plan_rows:
+                connection.executemany(
+                    f"INSERT OR REPLACE INTO plan_rows ({', '.join(plan_columns)}) "
+                    f"VALUES ({', '.join('?' * len(plan_columns))})", plan_rows
+                )
+            self.store.touch_run(connection, self.run_id)
+
+    def write_hub_summaries(self, hub_totals):
+        """Replace the hub summaries of the run with the stage 3 hub totals table"""
+        columns = [col for col in PLAN_COLUMN_MAP if col in hub_totals.columns]
+        rows = [(self.run_id, str(values[0])) + tuple(plain(value) for value in values[1:])
+                for values in hub_totals[['HubName'] + columns].itertuples(index=False)]
+        store_columns = ['run_id', 'hub'] + [PLAN_COLUMN_MAP[col] for col in columns]
+
+        with self.store.connection as connection:
+            connection.execute("DELETE FROM hub_summaries WHERE run_id = ?", (self.run_id,))
+            if rows:
+                connection.executemany(
+                    f"INSERT OR REPLACE INTO hub_summaries ({', '.join(store_columns)}) "
+                    f"VALUES ({', '.join('?' * len(store_columns))})", rows
+                )
+            self.store.touch_run(connection, self.run_id)
+
+
+class ResultStore:
+    def __init__(self, path):
+        self.path = path
+        # Stage 3 writes from its worker thread
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.executescript(SCHEMA)
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def touch_run(self, connection, run_id):
+        connection.execute("UPDATE runs SET updated_at = ? WHERE run_id = ?",
+                           (datetime.now().isoformat(timespec='seconds'), run_id))
+
+    def start_run(self, tag, source=None, settings=None):
+        """Return the writer of the run with this tag, creating the run if needed"""
+        now = datetime.now().isoformat(timespec='seconds')
+        with self.connection as connection:
+            connection.execute(
+                "INSERT INTO runs (tag, created_at, updated_at, source, settings) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT(tag) DO UPDATE SET updated_at = excluded.updated_at, "
+                "source = COALESCE(excluded.source, runs.source), settings = COALESCE(excluded.settings, runs.settings)",
+                (tag, now, now, source, json.dumps(settings) if settings is not None else None)
+            )
+        run_id = self.connection.execute("SELECT run_id FROM runs WHERE tag = ?", (tag,)).fetchone()[0]
+        return StoreRun(self, run_id, tag)
+
+    def clear_run(self, connection, run_id):
+        for table in RUN_TABLES:
+            connection.execute(f"DELETE FROM {table} WHERE run_id = ?", (run_id,))
+        connection.execute("DELETE FROM runs WHERE run_id = ?", (run_id,))
+
+    def delete_run(self, tag):
+        with self.connection as connection:
+            row = connection.execute("SELECT run_id FROM runs WHERE tag = ?", (tag,)).fetchone()
+            if row is None:
+                raise KeyError(f"Unknown run: {tag}")
+            self.clear_run(connection, row[0])
+
+    def publish_run(self, store_run, tag):
+        """Give a run written under a staging tag its final tag, replacing the run that had it, in one transaction"""
+        with self.connection as connection:
+            row = connection.execute("SELECT run_id, created_at FROM runs WHERE tag = ?", (tag,)).fetchone()
+            if row is not None and row[0] != store_run.run_id:
+                self.clear_run(connection, row[0])
+            connection.execute("UPDATE runs SET tag = ?, created_at = COALESCE(?, created_at) WHERE run_id = ?",
+                               (tag, row[1] if row is not None else None, store_run.run_id))
+            self.touch_run(connection, store_run.run_id)
+        store_run.tag = tag
+
+    def query(self, sql, params=()):
+        return [dict(row) for row in self.connection.execute(sql, params)]
+
+    def runs(self):
+        return self.query(
+            "SELECT r.tag, r.created_at, r.updated_at, r.source, "
+            "(SELECT COUNT(*) FROM lines l WHERE l.run_id = r.run_id) AS lines, "
+            "(SELECT COUNT(*) FROM plan_rows p WHERE p.run_id = r.run_id) AS plan_rows, "
+            "(SELECT COUNT(*) FROM hub_summaries h WHERE h.run_id = r.run_id) AS hub_summaries "
+            "FROM runs r ORDER BY r.run_id"
+        )
+
+    def plan_rows(self, tag=None, hub=None, line=None, bus_capacity=None, headway=None, min_fleet=None):
+        """Plan rows matching every filter given, e.g. the lines at a hub needing more than min_fleet buses"""
+        conditions, params = self.filters(tag, hub=('p.hub', hub), line=('p.line', line),
+                                          bus_capacity=('p.bus_capacity', bus_capacity), headway=('p.headway', headway))
+        if min_fleet is not None:
+            conditions.append("p.fleet_size > ?")
+            params.append(min_fleet)
+        return self.query(
+            "SELECT r.tag, p.* FROM plan_rows p JOIN runs r ON r.run_id = p.run_id"
+            + (" WHERE " + " AND ".join(conditions) if conditions else "")
+            + " ORDER BY r.run_id, p.hub, p.line, p.bus_capacity, p.headway", params
+        )
+
+    def hub_summaries(self, tag=None, hub=None, bus_capacity=None, headway=None):
+        conditions, params = self.filters(tag, hub=('h.hub', hub), bus_capacity=('h.bus_capacity', bus_capacity),
+                                          headway=('h.headway', headway))
+        return self.query(
+            "SELECT r.tag, h.* FROM hub_summaries h JOIN runs r ON r.run_id = h.run_id"
+            + (" WHERE " + " AND ".join(conditions) if conditions else "")
+            + " ORDER BY r.run_id, h.hub, h.bus_capacity, h.headway", params
+        )
+
+    def compare(self, tag_a, tag_b, hub=None, bus_capacity=None, headway=None):
+        """Fleet and hub area per (hub, capacity, headway) of two runs and their difference"""
+        conditions, params = self.filters(None, hub=('hub', hub), bus_capacity=('bus_capacity', bus_capacity),
+                                          headway=('headway', headway))
+        where = (" AND " + " AND ".join(conditions)) if conditions else ""
+        # Built from the plan rows, so runs without a stage 3 summary can be compared too
+        totals = ("SELECT hub, bus_capacity, headway, COUNT(*) AS lines, SUM(fleet_size) AS fleet_size, "
+                  "SUM(hub_area) AS hub_area FROM plan_rows WHERE run_id = (SELECT run_id FROM runs WHERE tag = ?)"
+                  + where + " GROUP BY hub, bus_capacity, headway")
+        return self.query(
+            f"WITH a AS ({totals}), b AS ({totals}), "
+            "keys AS (SELECT hub, bus_capacity, headway FROM a UNION SELECT hub, bus_capacity, headway FROM b) "
+            "SELECT k.hub, k.bus_capacity, k.headway, "
+            "a.lines AS lines_a, b.lines AS lines_b, "
+            "a.fleet_size AS fleet_a, b.fleet_size AS fleet_b, "
+            "COALESCE(b.fleet_size, 0) - COALESCE(a.fleet_size, 0) AS fleet_delta, "
+            "a.hub_area AS hub_area_a, b.hub_area AS hub_area_b, "
+            "COALESCE(b.hub_area, 0) - COALESCE(a.hub_area, 0) AS hub_area_delta "
+            "FROM keys k "
+            "LEFT JOIN a ON a.hub IS k.hub AND a.bus_capacity = k.bus_capacity AND a.headway = k.headway "
+            "LEFT JOIN b ON b.hub IS k.hub AND b.bus_capacity = k.bus_capacity AND b.headway = k.headway "
+            "ORDER BY k.hub, k.bus_capacity, k.headway",
+            [tag_a] + params + [tag_b] + params
+        )
+
+    def filters(self, tag, **columns):
+        conditions, params = [], []
+        if tag is not None:
+            conditions.append("r.tag = ?")
+            params.append(tag)
+        for column, value in columns.values():
+            if value is not None:
+                conditions.append(f"{column} = ?")
+                params.append(value)
+        return conditions, params
+
+
+def print_rows(rows):
+    if not rows:
+        print("(no rows)")
+        return
+    columns = list(rows[0])
+    cells = [[('' if row[col] is None else str(row[col])) for col in columns] for row in rows]
+    widths = [max(len(col), *(len(line[i]) for line in cells)) for i, col in enumerate(columns)]
+    print("  ".join(col.ljust(width) for col, width in zip(columns, widths)))
+    for line in cells:
+        print("  ".join(cell.ljust(width) for cell, width in zip(line, widths)))
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Query the SQLite store of operational plans and hub summaries.")
+    parser.add_argument('database', help="SQLite file written by stage 2 / stage 3")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    commands.add_parser('runs', help="List the tagged runs")
+
+    def add_filters(command):
+        command.add_argument('--hub')
+        command.add_argument('--bus-capacity', type=int)
+        command.add_argument('--headway', type=float)
+
+    plans = commands.add_parser('plans', help="Plan rows, e.g. --hub Gate3 --headway 15 --min-fleet 10")
+    plans.add_argument('--tag')
+    plans.add_argument('--line')
+    plans.add_argument('--min-fleet', type=int, help="Only lines needing more buses than this")
+    add_filters(plans)
+
+    hubs = commands.add_parser('hubs', help="Hub summaries written by stage 3")
+    hubs.add_argument('--tag')
+    add_filters(hubs)
+
+    compare = commands.add_parser('compare', help="Fleet and hub area of two runs per hub and option")
+    compare.add_argument('tag_a')
+    compare.add_argument('tag_b')
+    add_filters(compare)
+
+    sql = commands.add_parser('sql', help="Run a read-only SQL query")
+    sql.add_argument('query')
+
+    delete = commands.add_parser('delete', help="Delete a run")
+    delete.add_argument('tag')
+    return parser.parse_args(argv)
+
+
+def main():
+    args = parse_args()
+    if not os.path.exists(args.database):
+        print(f"Database not found: {args.database}")
+        sys.exit(1)
+
+    with ResultStore(args.database) as store:
+        try:
+            if args.command == 'runs':
+                print_rows(store.runs())
+            elif args.command == 'plans':
+                print_rows(store.plan_rows(args.tag, args.hub, args.line, args.bus_capacity, args.headway, args.min_fleet))
+            elif args.command == 'hubs':
+                print_rows(store.hub_summaries(args.tag, args.hub, args.bus_capacity, args.headway))
+            elif args.command == 'compare':
+                print_rows(store.compare(args.tag_a, args.tag_b, args.hub, args.bus_capacity, args.headway))
+            elif args.command == 'sql':
+                store.connection.execute("PRAGMA query_only = ON")
+                print_rows(store.query(args.query))
+            elif args.command == 'delete':
+                store.delete_run(args.tag)
+                print(f"Deleted run {args.tag}")
+        except (sqlite3.Error, KeyError) as e:
+            print(f"Error: {str(e).strip(chr(39))}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
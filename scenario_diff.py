@@ -0,0 +1,249 @@
+import argparse
+import os
+import sys
+import time
+import warnings
+
+from Make_Stops_Of_Lines_South_Med_1 import HUB_RULES, VisumWorkbook, build_stops_table, load_hub_matcher
+from plan_engine import PLAN_VARIANTS, analyze_plan_grid, load_processed_lines
+
+
+# Compares two scenarios of the network, e.g. a revised Visum export against the
+# previous one. Routes are aligned on line and route name; stop sequences are
+# compared by hash, runtimes and VOL(AP) by value. Every line is then planned
+# with one bus capacity and headway in both scenarios, so that the route changes
+# can be read as fleet and hub area deltas per line and per hub.
+ROUTE_CHANGE_FIELDS = ('hub', 'stops', 'runtime', 'demand')
+
+
+def load_scenario(path, hub_matcher=None):
+    """LineStore of a Visum export (run through stage 1) or of a stage 1 output"""
+    from plan_engine import LineStore
+
+    # openpyxl warns about workbook styles it does not understand
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        with VisumWorkbook(path) as workbook:
+            if not workbook.has_required_sheets():
+                _, store = load_processed_lines(workbook.excel_file)
+                return store
+            data, lineroutes_data = workbook.read_inputs()
+    output_df, _, _ = build_stops_table(data, lineroutes_data, hub_matcher)
+    return LineStore.from_frame(output_df)
+
+
+def route_frame(store):
+    """One row per route: line, route, hub, stops with their hash, stop count, runtime (min) and VOL(AP)"""
+    import numpy as np
+    import pandas as pd
+
+    line_index, _ = store.route_positions()
+    # Spacing around the arrows does not change the sequence
+    stops = pd.Series(store.stops, dtype=object).fillna('').astype(str).str.replace(r'\s*→\s*', ' → ', regex=True).str.strip()
+    return pd.DataFrame({
+        'LineName': np.asarray(store.line_names, dtype=object)[line_index],
+        'LineRouteName': store.route_names,
+        'HubName': pd.Categorical.from_codes(store.hub_codes, store.hub_names).astype(object),
+        'Stops': stops.to_numpy(),
+        'Stop_Hash': pd.util.hash_pandas_object(stops, index=False).to_numpy(),
+        'Stop_Count': store.stop_counts,
+        'Runtime (min)': store.runtime_minutes(),
+        'VOL(AP)': store.demands,
+    })
+
+
+def line_frame(store, bus_capacity, headway, dwell_time=3, demand_factor=0.7, hub_area_per_bus=100):
+    """One row per line with its plan for one bus capacity and headway"""
+    import numpy as np
+    import pandas as pd
+
+    columns = ['LineName', 'HubName', 'Routes', 'Desired_Demand', 'Cycle_Time (min)', 'Fleet_Size', 'Hub_Area']
+    if not len(store):
+        return pd.DataFrame(columns=columns)
+
+    # Lines are contiguous slices of the store, so per-line totals are reductions at the line offsets
+    starts = store.offsets[:-1]
+    desired = np.maximum.reduceat(np.nan_to_num(store.demands.astype(float), nan=0.0), starts).clip(min=0)
+    cycle_time = (np.add.reduceat(store.runtime_minutes(), starts)
+                  + np.add.reduceat(store.stop_counts, starts) * dwell_time)
+    plan_demand = np.ceil(desired * demand_factor) if demand_factor is not None else desired
+    plan = analyze_plan_grid(plan_demand, cycle_time, headway, bus_capacity, hub_area_per_bus)
+
+    return pd.DataFrame(dict(zip(columns, (
+        store.line_names, store.line_hubs(), store.line_sizes(), desired,
+        # Rounded like the Cycle_Time column of the operational plans
+        [round(value, 1) for value in cycle_time.tolist()],
+        plan['fleet_size_performing_Headway_for_1_Hour'], plan['hub_area_for_1_hour'],
+    ))))
+
+
+def changed(base, revised):
+    """Element-wise base != revised where missing on both sides counts as equal"""
+    return (base != revised) & ~(base.isna() & revised.isna())
+
+
+def diff_routes(base_routes, revised_routes):
+    """Route-level comparison: Status added/removed/changed/unchanged and the fields that changed"""
+    import numpy as np
+
+    routes = base_routes.merge(revised_routes, on=['LineName', 'LineRouteName'], how='outer',
+                               suffixes=('_Base', '_Revised'), indicator=True, sort=False)
+    both = routes['_merge'] == 'both'
+
+    flags = {
+        'hub': changed(routes['HubName_Base'], routes['HubName_Revised']),
+        'stops': routes['Stop_Hash_Base'] != routes['Stop_Hash_Revised'],
+        'runtime': changed(routes['Runtime (min)_Base'], routes['Runtime (min)_Revised']),
+        'demand': changed(routes['VOL(AP)_Base'], routes['VOL(AP)_Revised']),
+    }
+    changes = np.full(len(routes), '', dtype=object)
+    for field in ROUTE_CHANGE_FIELDS:
+        changes = np.where(both & flags[field], changes + field + ', ', changes)
+    routes['Changes'] = [text[:-2] for text in changes]
+
+    routes['Status'] = np.select(
+        [routes['_merge'] == 'left_only', routes['_merge'] == 'right_only', routes['Changes'] != ''],
+        ['removed', 'added', 'changed'], 'unchanged'
+    )
+    routes['Runtime_Delta (min)'] = routes['Runtime (min)_Revised'] - routes['Runtime (min)_Base']
+    routes['VOL(AP)_Delta'] = routes['VOL(AP)_Revised'] - routes['VOL(AP)_Base']
+
+    # Which stops were added or removed, only for the routes whose sequence changed
+    routes['Stops_Added'] = ''
+    routes['Stops_Removed'] = ''
+    edited = both & flags['stops']
+    for i in np.flatnonzero(edited):
+        base_stops = routes.at[i, 'Stops_Base'].split(' → ')
+        revised_stops = routes.at[i, 'Stops_Revised'].split(' → ')
+        base_set, revised_set = set(base_stops), set(revised_stops)
+        routes.at[i, 'Stops_Added'] = ' → '.join(stop for stop in revised_stops if stop not in base_set)
+        routes.at[i, 'Stops_Removed'] = ' → '.join(stop for stop in base_stops if stop not in revised_set)
+
+    return routes[[
+        'LineName', 'LineRouteName', 'Status', 'Changes', 'HubName_Base', 'HubName_Revised',
+        'Stop_Count_Base', 'Stop_Count_Revised', 'Stops_Added', 'Stops_Removed', 'Stops_Base', 'Stops_Revised',
+        'Runtime (min)_Base', 'Runtime (min)_Revised', 'Runtime_Delta (min)',
+        'VOL(AP)_Base', 'VOL(AP)_Revised', 'VOL(AP)_Delta',
+    ]]
+
+
+def diff_lines(base_lines, revised_lines, route_changes):
+    """Line-level comparison with fleet and hub area deltas"""
+    import numpy as np
+
+    lines = base_lines.merge(revised_lines, on='LineName', how='outer', suffixes=('_Base', '_Revised'),
+                             indicator=True, sort=False)
+    changed_routes = route_changes[route_changes['Status'] != 'unchanged'].groupby('LineName', sort=False).size()
+    lines['Changed_Routes'] = lines['LineName'].map(changed_routes).fillna(0).astype(int)
+
+    lines['Status'] = np.select(
+        [lines['_merge'] == 'left_only', lines['_merge'] == 'right_only', lines['Changed_Routes'] > 0],
+        ['removed', 'added', 'changed'], 'unchanged'
+    )
+    for column in ('Fleet_Size', 'Hub_Area'):
+        lines[f'{column}_Delta'] = lines[f'{column}_Revised'].fillna(0) - lines[f'{column}_Base'].fillna(0)
+
+    return lines[[
+        'LineName', 'Status', 'Changed_Routes', 'HubName_Base', 'HubName_Revised', 'Routes_Base', 'Routes_Revised',
+        'Desired_Demand_Base', 'Desired_Demand_Revised', 'Cycle_Time (min)_Base', 'Cycle_Time (min)_Revised',
+        'Fleet_Size_Base', 'Fleet_Size_Revised', 'Fleet_Size_Delta', 'Hub_Area_Base', 'Hub_Area_Revised', 'Hub_Area_Delta',
+    ]]
+
+
+def diff_hubs(line_changes):
+    """Hub-level totals of both scenarios and the number of lines added, removed and changed"""
+    import pandas as pd
+
+    totals = []
+    for side in ('Base', 'Revised'):
+        totals.append(line_changes.groupby(f'HubName_{side}').agg(**{
+            f'Lines_{side}': ('LineName', 'size'),
+            f'Fleet_Size_{side}': (f'Fleet_Size_{side}', 'sum'),
+            f'Hub_Area_{side}': (f'Hub_Area_{side}', 'sum'),
+        }))
+    hubs = pd.concat(totals, axis=1).fillna(0)
+    hubs.index.name = 'HubName'
+
+    # Lines are counted at their revised hub, removed lines at their old one
+    line_hubs = line_changes['HubName_Revised'].fillna(line_changes['HubName_Base'])
+    status_counts = pd.crosstab(line_hubs, line_changes['Status'])
+    for status in ('added', 'removed', 'changed'):
+        hubs[f'Lines_{status.capitalize()}'] = status_counts.get(status, pd.Series(dtype=int)).reindex(hubs.index).fillna(0)
+
+    for column in ('Fleet_Size', 'Hub_Area'):
+        hubs[f'{column}_Delta'] = hubs[f'{column}_Revised'] - hubs[f'{column}_Base']
+
+    hubs = hubs.astype({column: int for column in hubs.columns if column.startswith('Lines_')})
+    return hubs.reset_index()[[
+        'HubName', 'Lines_Base', 'Lines_Revised', 'Lines_Added', 'Lines_Removed', 'Lines_Changed',
+        'Fleet_Size_Base', 'Fleet_Size_Revised', 'Fleet_Size_Delta', 'Hub_Area_Base', 'Hub_Area_Revised', 'Hub_Area_Delta',
+    ]]
+
+
+def diff_scenarios(base_store, revised_store, bus_capacity=50, headway=15, dwell_time=3,
+                   demand_factor=0.7, hub_area_per_bus=100):
+    """Compare two LineStores; returns (hub changes, line changes, route changes) DataFrames"""
+    route_changes = diff_routes(route_frame(base_store), route_frame(revised_store))
+    line_changes = diff_lines(
+        line_frame(base_store, bus_capacity, headway, dwell_time, demand_factor, hub_area_per_bus),
+        line_frame(revised_store, bus_capacity, headway, dwell_time, demand_factor, hub_area_per_bus),
+        route_changes,
+    )
+    return diff_hubs(line_changes), line_changes, route_changes
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Report what changed between two network scenarios.")
+    parser.add_argument('base_file', help="Previous Visum export or stage 1 output")
+    parser.add_argument('revised_file', help="Revised Visum export or stage 1 output")
+    parser.add_argument('--output', default='Scenario_Diff.xlsx', help="Output workbook (default: Scenario_Diff.xlsx)")
+    parser.add_argument('--bus-capacity', type=int, default=50, help="Bus capacity for the fleet deltas (default: 50)")
+    parser.add_argument('--headway', type=float, default=15, help="Headway in minutes for the fleet deltas (default: 15)")
+    parser.add_argument('--dwell-time', type=float, default=3)
+    parser.add_argument('--variant', choices=sorted(PLAN_VARIANTS), default='designed')
+    parser.add_argument('--all', action='store_true', help="Also list unchanged lines and routes")
+    parser.add_argument('--hub-patterns', metavar='JSON',
+                        help="Hub pattern table for Visum exports (default: hub_patterns.json)")
+    parser.add_argument('--hub-rule', choices=HUB_RULES,
+                        help="Match hubs on the first named stop of a line or on any of its stops")
+    return parser.parse_args(argv)
+
+
+def main():
+    args = parse_args()
+    started = time.perf_counter()
+
+    try:
+        hub_matcher = load_hub_matcher(args.hub_patterns, args.hub_rule)
+        base_store = load_scenario(args.base_file, hub_matcher)
+        revised_store = load_scenario(args.revised_file, hub_matcher)
+    except (OSError, ValueError) as e:
+        print(f"Error loading input: {str(e)}")
+        sys.exit(1)
+    loaded = time.perf_counter()
+
+    hub_changes, line_changes, route_changes = diff_scenarios(
+        base_store, revised_store, args.bus_capacity, args.headway, args.dwell_time, **PLAN_VARIANTS[args.variant]
+    )
+    if not args.all:
+        line_changes = line_changes[line_changes['Status'] != 'unchanged']
+        route_changes = route_changes[route_changes['Status'] != 'unchanged']
+
+    import pandas as pd
+    from plan_engine import style_plan_sheet
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with pd.ExcelWriter(args.output, engine='openpyxl') as writer:
+        for sheet_name, df in (('Hub_Changes', hub_changes), ('Line_Changes', line_changes),
+                               ('Route_Changes', route_changes)):
+            df.to_excel(writer, sheet_name=sheet_name, index=False)
+            style_plan_sheet(writer.sheets[sheet_name])
+
+    counts = line_changes['Status'].value_counts()
+    print(f"Lines: {counts.get('added', 0)} added, {counts.get('removed', 0)} removed, "
+          f"{counts.get('changed', 0)} changed; fleet {hub_changes['Fleet_Size_Delta'].sum():+g} buses "
+          f"(loaded in {loaded - started:.1f}s, compared in {time.perf_counter() - loaded:.2f}s) -> {args.output}")
+
+
+if __name__ == "__main__":
+    main()
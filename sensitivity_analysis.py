@@ -0,0 +1,187 @@
+import argparse
+import os
+import sys
+import time
+
+from plan_engine import PLAN_VARIANTS, parse_capacities, parse_headways, analyze_plan_grid, load_processed_lines
+
+
+# Monte Carlo sensitivity of the operational plans to the VOL(AP) and LINKRUNTIME
+# forecasts. Every route's demand and runtime are multiplied by random factors
+# with mean 1; the plan is then evaluated for a chunk of lines x samples in one
+# array computation per capacity/headway option.
+SENSITIVITY_DISTRIBUTIONS = ('normal', 'lognormal', 'uniform', 'triangular')
+SENSITIVITY_PERCENTILES = (5, 50, 95)
+SENSITIVITY_CHUNK_LINES = 256
+
+
+def draw_factors(rng, distribution, spread, size):
+    """Multiplicative factors with mean 1; spread is the coefficient of variation or the half-width"""
+    import numpy as np
+
+    if spread <= 0:
+        return np.ones(size)
+    if distribution == 'normal':
+        return np.clip(rng.normal(1.0, spread, size), 0, None)
+    if distribution == 'lognormal':
+        sigma = np.sqrt(np.log1p(spread ** 2))
+        return rng.lognormal(-sigma ** 2 / 2, sigma, size)
+    if distribution == 'uniform':
+        return rng.uniform(max(0.0, 1 - spread), 1 + spread, size)
+    if distribution == 'triangular':
+        return rng.triangular(max(0.0, 1 - spread), 1.0, 1 + spread, size)
+    raise ValueError(f"Unknown distribution: {distribution}")
+
+
+def route_arrays(store):
+    """Line names, hubs and lines x routes arrays of demand, runtime (min) and stop count.
+
+    Lines with fewer routes are padded with zeros, which add nothing to the
+    maximum demand or the cycle time.
+    """
+    import numpy as np
+
+    max_routes = int(store.line_sizes().max(initial=0))
+    line_index, route_index = store.route_positions()
+    arrays = []
+    for values in (store.demands, store.runtime_minutes(), store.stop_counts):
+        padded = np.zeros((len(store), max_routes))
+        padded[line_index, route_index] = values
+        arrays.append(padded)
+    demand, runtime, stops = arrays
+    return list(store), store.line_hubs(), np.nan_to_num(demand), runtime, stops
+
+
+def run_sensitivity(processed_lines, bus_capacities, headways, samples=5000, dwell_time=3,
+                    demand_distribution='lognormal', demand_spread=0.15,
+                    runtime_distribution='normal', runtime_spread=0.10,
+                    demand_factor=0.7, hub_area_per_bus=100, seed=None, chunk_lines=SENSITIVITY_CHUNK_LINES):
+    """Percentiles of fleet, hub area and empty seats per line and per hub, as (line rows, hub rows)"""
+    import numpy as np
+
+    rng = np.random.default_rng(seed)
+    line_names, hubs, demand, runtime, stops = route_arrays(processed_lines)
+    n_lines, n_routes = demand.shape
+    options = [(bus_capacity, headway) for bus_capacity in bus_capacities for headway in headways]
+
+    def plan_demand_of(desired):
+        return np.ceil(desired * demand_factor) if demand_factor is not None else np.ceil(desired)
+
+    base_demand = plan_demand_of(demand.max(axis=1, initial=0))
+    base_cycle = (runtime + stops * dwell_time).sum(axis=1)
+    bases = [analyze_plan_grid(base_demand, base_cycle, headway, bus_capacity, hub_area_per_bus)
+             for bus_capacity, headway in options]
+
+    hub_names = list(dict.fromkeys(hubs))
+    hub_index = np.array([hub_names.index(hub) for hub in hubs], dtype=int)
+
+    metrics = {
+        'Fleet_Size': 'fleet_size_performing_Headway_for_1_Hour',
+        'Hub_Area': 'hub_area_for_1_hour',
+        'Empty_Seats_per_Hour': 'empty_seats',
+    }
+
+    # Lines are sampled in chunks so memory stays bounded on large networks;
+    # only the hub totals per sample are kept across chunks
+    line_rows = [[] for _ in options]
+    hub_totals = [{key: np.zeros((len(hub_names), samples)) for key in metrics.values()} for _ in options]
+    for chunk_start in range(0, n_lines, chunk_lines):
+        chunk = slice(chunk_start, min(chunk_start + chunk_lines, n_lines))
+        size = (chunk.stop - chunk.start, samples, n_routes)
+        sampled_demand = plan_demand_of(
+            (demand[chunk, None, :] * draw_factors(rng, demand_distribution, demand_spread, size)).max(axis=2, initial=0)
+        )
+        sampled_cycle = (runtime[chunk, None, :] * draw_factors(rng, runtime_distribution, runtime_spread, size)
+                         + stops[chunk, None, :] * dwell_time).sum(axis=2)
+
+        for o, (bus_capacity, headway) in enumerate(options):
+            base = bases[o]
+            grid = analyze_plan_grid(sampled_demand, sampled_cycle, headway, bus_capacity, hub_area_per_bus)
+
+            line_percentiles = {name: np.percentile(grid[key], SENSITIVITY_PERCENTILES, axis=1)
+                                for name, key in metrics.items()}
+            fleet_exceeded = (grid['fleet_size_performing_Headway_for_1_Hour']
+                              > base['fleet_size_performing_Headway_for_1_Hour'][chunk, None]).mean(axis=1)
+
+            for j, i in enumerate(range(chunk.start, chunk.stop)):
+                row = {'LineName': line_names[i], 'HubName': hubs[i], 'Bus_Capacity': bus_capacity, 'Headway (min)': headway}
+                for name, key in metrics.items():
+                    row[f'{name}_Base'] = base[key][i]
+                    row.update({f'{name}_P{p}': values[j] for p, values in zip(SENSITIVITY_PERCENTILES, line_percentiles[name])})
+                row['P(Fleet > Base)'] = round(fleet_exceeded[j], 3)
+                line_rows[o].append(row)
+
+            # Hub totals per sample: add up the lines of each hub
+            for key in metrics.values():
+                np.add.at(hub_totals[o][key], hub_index[chunk], grid[key])
+
+    hub_rows = []
+    for o, (bus_capacity, headway) in enumerate(options):
+        for h, hub_name in enumerate(hub_names):
+            in_hub = hub_index == h
+            row = {'HubName': hub_name, 'Lines': int(in_hub.sum()), 'Bus_Capacity': bus_capacity, 'Headway (min)': headway}
+            for name, key in metrics.items():
+                row[f'{name}_Base'] = bases[o][key][in_hub].sum()
+                row.update({f'{name}_P{p}': value
+                            for p, value in zip(SENSITIVITY_PERCENTILES, np.percentile(hub_totals[o][key][h], SENSITIVITY_PERCENTILES))})
+            hub_rows.append(row)
+
+    return [row for rows in line_rows for row in rows], hub_rows
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Monte Carlo sensitivity of the operational plans to demand and runtime.")
+    parser.add_argument('input_file', help="Stage 1 output workbook (stops of lines)")
+    parser.add_argument('--output', default='Sensitivity.xlsx', help="Output workbook (default: Sensitivity.xlsx)")
+    parser.add_argument('--samples', type=int, default=5000, help="Samples per line (default: 5000)")
+    parser.add_argument('--bus-capacities', type=parse_capacities, default=[25, 50])
+    parser.add_argument('--headways', type=parse_headways, default=[10, 15, 20, 25, 30],
+                        help="Headways in minutes: '10, 15, 20', a range '3:60[:step]' or 'clockface'")
+    parser.add_argument('--dwell-time', type=float, default=3)
+    parser.add_argument('--demand-dist', choices=SENSITIVITY_DISTRIBUTIONS, default='lognormal')
+    parser.add_argument('--demand-spread', type=float, default=0.15,
+                        help="Coefficient of variation (normal/lognormal) or half-width (uniform/triangular) of VOL(AP)")
+    parser.add_argument('--runtime-dist', choices=SENSITIVITY_DISTRIBUTIONS, default='normal')
+    parser.add_argument('--runtime-spread', type=float, default=0.10, help="Same as --demand-spread for LINKRUNTIME")
+    parser.add_argument('--variant', choices=sorted(PLAN_VARIANTS), default='designed')
+    parser.add_argument('--seed', type=int, help="Random seed for reproducible runs")
+    args = parser.parse_args(argv)
+    if args.samples < 1:
+        parser.error("--samples must be at least 1")
+    if args.demand_spread < 0 or args.runtime_spread < 0:
+        parser.error("--demand-spread and --runtime-spread must not be negative")
+    return args
+
+
+def main():
+    args = parse_args()
+    started = time.perf_counter()
+
+    try:
+        _, processed_lines = load_processed_lines(args.input_file)
+    except (OSError, ValueError) as e:
+        print(f"Error loading file: {str(e)}")
+        sys.exit(1)
+
+    line_rows, hub_rows = run_sensitivity(
+        processed_lines, args.bus_capacities, args.headways, args.samples, args.dwell_time,
+        args.demand_dist, args.demand_spread, args.runtime_dist, args.runtime_spread,
+        seed=args.seed, **PLAN_VARIANTS[args.variant]
+    )
+
+    import pandas as pd
+    from plan_engine import style_plan_sheet
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with pd.ExcelWriter(args.output, engine='openpyxl') as writer:
+        for sheet_name, rows in (('Hub_Sensitivity', hub_rows), ('Line_Sensitivity', line_rows)):
+            pd.DataFrame(rows).to_excel(writer, sheet_name=sheet_name, index=False)
+            style_plan_sheet(writer.sheets[sheet_name])
+
+    print(f"{args.samples} samples x {len(processed_lines)} lines x "
+          f"{len(args.bus_capacities) * len(args.headways)} options in "
+          f"{time.perf_counter() - started:.1f}s -> {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,254 @@
+import argparse
+import heapq
+import math
+import os
+import sys
+import time
+
+from plan_engine import PLAN_VARIANTS, LineRoutes, RouteAnalyzer, load_processed_lines, get_line_summary
+
+
+# Builds departure timetables for every route of a line from the chosen headway
+# and chains the trips into vehicle blocks with the minimum number of vehicles.
+# A line's routes are run in sequence: route 1 leaves the hub, the next route
+# leaves the terminal where the previous one arrived, the last returns to the hub.
+
+def parse_clock(value):
+    """'06:30' -> minutes after midnight"""
+    hours, _, minutes = str(value).partition(':')
+    return int(hours) * 60 + float(minutes or 0)
+
+
+def format_clock(minutes):
+    minutes = int(round(minutes))
+    return f"{minutes // 60:02d}:{minutes % 60:02d}"
+
+
+def route_trip_times(routes, dwell_time):
+    """Running time of each route in minutes: LINKRUNTIME plus dwell time at every stop"""
+    if isinstance(routes, LineRoutes):
+        return (routes.runtime_minutes() + routes.stop_counts * dwell_time).tolist()
+    analyzer = RouteAnalyzer(None, routes, dwell_time)
+    return [
+        analyzer.convert_runtime_to_minutes(route['LINKRUNTIME'])
+        + len(analyzer.extract_stops_from_route(route['StopsArray'])) * dwell_time
+        for route in routes
+    ]
+
+
+def build_line_trips(line_name, routes, headway, service_start, service_end, dwell_time, layover):
+    """Group trips of one line: each route-1 departure is followed by the other routes in turn"""
+    trip_times = route_trip_times(routes, dwell_time)
+    terminals = [f"{line_name}:T{i}" for i in range(len(routes))]
+
+    trips = []
+    departure_count = max(0, math.ceil((service_end - service_start) / headway))
+    for group in range(departure_count):
+        departure = service_start + group * headway
+        for i, route in enumerate(routes):
+            arrival = departure + trip_times[i]
+            trips.append({
+                'line': line_name,
+                'route': route['LINEROUTENAME'],
+                'route_index': i + 1,
+                'group': group + 1,
+                'departure': departure,
+                'arrival': arrival,
+                'from': terminals[i],
+                # The last route returns to the hub terminal
+                'to': terminals[(i + 1) % len(routes)],
+            })
+            departure = arrival + layover
+    return trips, departure_count
+
+
+def chain_blocks(trips, layover):
+    """Minimum-vehicle chaining of trips without deadheads.
+
+    Trips are taken in departure order; each one is given to a vehicle already
+    waiting at its origin terminal (ready after its last arrival plus the
+    layover) or to a new vehicle. For fixed trips between terminals this greedy
+    assignment uses the minimum number of vehicles. Returns the number of blocks.
+    """
+    waiting = {}  # terminal -> heap of (ready time, block)
+    block_count = 0
+
+    for trip in sorted(trips, key=lambda trip: (trip['departure'], trip['route_index'])):
+        heap = waiting.setdefault(trip['from'], [])
+        if heap and heap[0][0] <= trip['departure'] + 1e-9:
+            _, block = heapq.heappop(heap)
+        else:
+            block_count += 1
+            block = block_count
+        trip['block'] = block
+        heapq.heappush(waiting.setdefault(trip['to'], []), (trip['arrival'] + layover, block))
+
+    return block_count
+
+
+def generate_timetables(processed_lines, selections, service_start=6 * 60, service_end=22 * 60,
+                        dwell_time=3, layover=0, demand_factor=0.7, hub_area_per_bus=100):
+    """Timetable, vehicle blocks and fleet check for every selected line.
+
+    selections maps a line name to (bus_capacity, headway). Every group trip is
+    run by Buses_per_Group buses, so each group block becomes that many vehicle
+    blocks. Returns (trips, blocks, fleet_check) as lists of row dicts.
+    """
+    line_summaries = {}
+    trip_rows = []
+    block_rows = []
+    fleet_rows = []
+
+    for line_name, (bus_capacity, headway) in selections.items():
+        routes = processed_lines[line_name]
+        summary = get_line_summary(line_summaries, processed_lines, line_name, dwell_time,
+                                   demand_factor, hub_area_per_bus)
+        system_analysis = summary['analyzer'].analyze_system_with_headway(
+            summary['plan_demand'], summary['cycle_time'], headway, bus_capacity
+        )
+        buses_per_group = system_analysis['buses_per_group']
+
+        group_trips, departure_count = build_line_trips(line_name, routes, headway, service_start,
+                                                        service_end, dwell_time, layover)
+        group_blocks = chain_blocks(group_trips, layover) if buses_per_group else 0
+
+        # Expand the group blocks to one block per bus of the group
+        blocks = {}
+        for trip in group_trips if buses_per_group else []:
+            for bus in range(1, buses_per_group + 1):
+                block_id = f"{line_name}-{(trip['block'] - 1) * buses_per_group + bus}"
+                trip_rows.append({
+                    'LineName': line_name,
+                    'Block': block_id,
+                    'Route': trip['route'],
+                    'Group': trip['group'],
+                    'Bus_in_Group': bus,
+                    'Departure': format_clock(trip['departure']),
+                    'Arrival': format_clock(trip['arrival']),
+                    'Departure (min)': round(trip['departure'], 1),
+                    'Arrival (min)': round(trip['arrival'], 1),
+                })
+                block = blocks.setdefault(block_id, {'trips': 0, 'start': trip['departure'], 'end': trip['arrival']})
+                block['trips'] += 1
+                block['start'] = min(block['start'], trip['departure'])
+                block['end'] = max(block['end'], trip['arrival'])
+
+        for block_id, block in blocks.items():
+            block_rows.append({
+                'LineName': line_name,
+                'HubName': summary['hub_name'],
+                'Block': block_id,
+                'Trips': block['trips'],
+                'Pull_Out': format_clock(block['start']),
+                'Pull_In': format_clock(block['end']),
+                'Duration (min)': round(block['end'] - block['start'], 1),
+            })
+
+        vehicles_used = group_blocks * buses_per_group
+        # One group per headway over the cycle, capped by the departures of the service
+        # window; layovers, which the plan's cycle time leaves out, need more vehicles
+        cycle_fleet = min(departure_count, system_analysis['unique_groups']) * buses_per_group
+        # The 1 hour plan (and the hub area built for it) counts at most an hour of groups
+        plan_fleet = system_analysis['fleet_size_performing_Headway_for_1_Hour']
+        fleet_rows.append({
+            'LineName': line_name,
+            'HubName': summary['hub_name'],
+            'Bus_Capacity': bus_capacity,
+            'Headway (min)': headway,
+            'Cycle_Time (min)': round(summary['cycle_time'], 1),
+            'Buses_per_Group': buses_per_group,
+            'Departures': departure_count,
+            'Vehicle_Trips': departure_count * len(routes) * buses_per_group,
+            'Vehicles_Used': vehicles_used,
+            'Cycle_Fleet': cycle_fleet,
+            'Fleet_Check': 'ok' if vehicles_used == cycle_fleet else 'mismatch',
+            'Fleet_Size (1 hour plan)': plan_fleet,
+            'Shortfall_vs_1_Hour_Plan': vehicles_used - plan_fleet,
+        })
+
+    return trip_rows, block_rows, fleet_rows
+
+
+def read_selections(path, line_names):
+    """Per-line (bus capacity, headway) choices from a CSV/xlsx with LineName, Bus_Capacity and Headway (min)"""
+    import pandas as pd
+
+    df = pd.read_csv(path) if path.lower().endswith('.csv') else pd.read_excel(path)
+    missing_columns = [col for col in ('LineName', 'Bus_Capacity', 'Headway (min)') if col not in df.columns]
+    if missing_columns:
+        raise ValueError(f"Missing columns in selection file: {', '.join(missing_columns)}")
+
+    known_lines = {str(line_name): line_name for line_name in line_names}
+    selections = {}
+    for row in df.to_dict('records'):
+        line_name = known_lines.get(str(row['LineName']))
+        if line_name is None:
+            raise ValueError(f"Unknown line in selection file: {row['LineName']}")
+        bus_capacity, headway = int(row['Bus_Capacity']), float(row['Headway (min)'])
+        if bus_capacity <= 0 or not headway > 0:
+            raise ValueError(f"Bus capacity and headway must be positive for line {row['LineName']}")
+        selections[line_name] = (bus_capacity, headway)
+    return selections
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Generate departure timetables and vehicle blocks from the headway plans."
+    )
+    parser.add_argument('input_file', help="Stage 1 output workbook (stops of lines)")
+    parser.add_argument('--output', default='Timetables.xlsx', help="Output workbook (default: Timetables.xlsx)")
+    parser.add_argument('--bus-capacity', type=int, default=50, help="Bus capacity for all lines (default: 50)")
+    parser.add_argument('--headway', type=float, default=15, help="Headway in minutes for all lines (default: 15)")
+    parser.add_argument('--selection', help="CSV/xlsx with per-line LineName, Bus_Capacity and Headway (min)")
+    parser.add_argument('--start', default='06:00', help="First departure from the hub (default: 06:00)")
+    parser.add_argument('--end', default='22:00', help="No departures from the hub after this time (default: 22:00)")
+    parser.add_argument('--dwell-time', type=float, default=3)
+    parser.add_argument('--layover', type=float, default=0, help="Minimum layover at a terminal in minutes (default: 0)")
+    parser.add_argument('--variant', choices=sorted(PLAN_VARIANTS), default='designed')
+    args = parser.parse_args(argv)
+    if args.bus_capacity <= 0 or not args.headway > 0:
+        parser.error("--bus-capacity and --headway must be positive")
+    return args
+
+
+def main():
+    args = parse_args()
+    started = time.perf_counter()
+
+    try:
+        _, processed_lines = load_processed_lines(args.input_file)
+        if args.selection:
+            selections = read_selections(args.selection, processed_lines)
+        else:
+            selections = {line_name: (args.bus_capacity, args.headway) for line_name in processed_lines}
+    except (OSError, ValueError) as e:
+        print(f"Error loading input: {str(e)}")
+        sys.exit(1)
+
+    trips, blocks, fleet_check = generate_timetables(
+        processed_lines, selections, parse_clock(args.start), parse_clock(args.end),
+        args.dwell_time, args.layover, **PLAN_VARIANTS[args.variant]
+    )
+
+    import pandas as pd
+    from plan_engine import style_plan_sheet
+
+    output_dir = os.path.dirname(os.path.abspath(args.output))
+    os.makedirs(output_dir, exist_ok=True)
+    with pd.ExcelWriter(args.output, engine='openpyxl') as writer:
+        for sheet_name, rows in (('Fleet_Check', fleet_check), ('Blocks', blocks), ('Timetable', trips)):
+            pd.DataFrame(rows).to_excel(writer, sheet_name=sheet_name, index=False)
+            style_plan_sheet(writer.sheets[sheet_name])
+
+    mismatches = sum(1 for row in fleet_check if row['Fleet_Check'] != 'ok')
+    shortfall = sum(row['Shortfall_vs_1_Hour_Plan'] for row in fleet_check)
+    print(f"{len(trips)} trips, {len(blocks)} vehicle blocks for {len(fleet_check)} lines "
+          f"in {time.perf_counter() - started:.1f}s -> {args.output}")
+    if shortfall > 0:
+        print(f"The timetables use {shortfall} more buses than the 1 hour plans (Shortfall_vs_1_Hour_Plan)")
+    if mismatches:
+        print(f"Warning: {mismatches} lines use a different number of vehicles than their cycle time needs")
+
+
+if __name__ == "__main__":
+    main()
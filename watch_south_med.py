@@ -0,0 +1,251 @@
+import argparse
+import importlib.util
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import Make_Stops_Of_Lines_South_Med_1 as stops_of_lines
+from result_store import ResultStore
+from plan_engine import (PLAN_VARIANTS, PLAN_OUTPUT_MODES, PLAN_PARETO_MODES, load_processed_lines,
+                         generate_operational_plans, parse_capacities, parse_headways)
+
+
+# Runs stage 1, the operational plan engine and the hub summary whenever a
+# Visum workbook in the watched folder is added or changed.
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+# Result store tag of a run while its build is still staged
+STAGING_TAG_SUFFIX = '.staging'
+
+
+def load_script(file_name, module_name):
+    """Import a stage script whose file name is not a valid module name"""
+    spec = importlib.util.spec_from_file_location(module_name, os.path.join(SCRIPT_DIR, file_name))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+hub_summary = load_script('makee summary hub_3.py', 'makee_summary_hub_3')
+
+
+def file_signature(path):
+    stat = os.stat(path)
+    return stat.st_mtime_ns, stat.st_size
+
+
+def publish_folder(staged_dir, final_dir):
+    """Move every staged file into final_dir and drop files the new build no longer produces"""
+    os.makedirs(final_dir, exist_ok=True)
+    staged_names = set(os.listdir(staged_dir)) if os.path.isdir(staged_dir) else set()
+
+    for name in staged_names:
+        # os.replace is atomic on the same filesystem, readers see the old or the new file
+        os.replace(os.path.join(staged_dir, name), os.path.join(final_dir, name))
+
+    for name in os.listdir(final_dir):
+        if name not in staged_names:
+            os.remove(os.path.join(final_dir, name))
+
+
+class ExportWatcher:
+    def __init__(self, input_dir, output_dir, variant='designed', bus_capacities=(25, 50),
+                 headways=(10, 15, 20, 25, 30), dwell_time=3, settle_seconds=2.0, output_mode='per_line',
+                 results_db=None, log=print, pareto='off', retry_seconds=30.0):
+        self.input_dir = input_dir
+        self.output_dir = output_dir
+        self.plan_variant = PLAN_VARIANTS[variant]
+        self.bus_capacities = list(bus_capacities)
+        self.headways = list(headways)
+        self.dwell_time = dwell_time
+        self.settle_seconds = settle_seconds
+        self.retry_seconds = retry_seconds
+        self.output_mode = output_mode
+        self.pareto = pareto
+        self.log = log
+        # Optional SQLite result store, one run per workbook tagged with its name
+        self.store = ResultStore(results_db) if results_db else None
+
+        self.pending = {}    # path -> (signature, first time it was seen with that signature)
+        self.processed = {}  # path -> signature of the last build
+        self.failed = {}     # path -> signature whose build failed, retried after retry_seconds
+
+        os.makedirs(self.output_dir, exist_ok=True)
+        self.staging_root = os.path.join(self.output_dir, '.staging')
+
+    def scenario_dir(self, input_path):
+        stem = os.path.splitext(os.path.basename(input_path))[0]
+        return os.path.join(self.output_dir, stem)
+
+    def stops_output_path(self, input_path):
+        stem = os.path.splitext(os.path.basename(input_path))[0]
+        return os.path.join(self.scenario_dir(input_path), f"{stem}_Stops_Of_Lines.xlsx")
+
+    def prime(self):
+        """Mark workbooks whose outputs are already newer than the input as up to date"""
+        for path in stops_of_lines.expand_inputs(self.input_dir):
+            output_path = self.stops_output_path(path)
+            if os.path.exists(output_path) and os.path.getmtime(output_path) >= os.path.getmtime(path):
+                self.processed[path] = file_signature(path)
+
+    def poll(self):
+        """Check the input folder once and rebuild every workbook that has settled since its last change"""
+        now = time.monotonic()
+        current = {}
+        for path in stops_of_lines.expand_inputs(self.input_dir):
+            try:
+                current[path] = file_signature(path)
+            except OSError:
+                continue  # removed between listing and stat
+
+        # Forget removed files, their last outputs are kept
+        for state in (self.pending, self.processed, self.failed):
+            for path in [path for path in state if path not in current]:
+                del state[path]
+
+        rebuilt = []
+        for path, signature in current.items():
+            if self.processed.get(path) == signature:
+                continue
+
+            pending_signature, since = self.pending.get(path, (None, now))
+            if pending_signature != signature:
+                # Still being written (or just appeared): restart the settle timer
+                self.pending[path] = (signature, now)
+                continue
+
+            wait = self.retry_seconds if self.failed.get(path) == signature else self.settle_seconds
+            if now - since >= wait:
+                if self.rebuild(path):
+                    self.processed[path] = signature
+                    del self.pending[path]
+                    self.failed.pop(path, None)
+                    rebuilt.append(path)
+                else:
+                    # Left pending, e.g. a workbook Visum still held open
+                    self.failed[path] = signature
+                    self.pending[path] = (signature, now)
+                    self.log(f"  - {os.path.basename(path)} will be retried in {self.retry_seconds:g}s")
+
+        return rebuilt
+
+    def rebuild(self, input_path):
+        """Run all three stages for one workbook in a staging folder, then publish the outputs"""
+        name = os.path.basename(input_path)
+        self.log(f"Rebuilding {name}")
+        started = time.perf_counter()
+
+        os.makedirs(self.staging_root, exist_ok=True)
+        staging_dir = tempfile.mkdtemp(dir=self.staging_root)
+        store_run = None
+        try:
+            stops_name = os.path.basename(self.stops_output_path(input_path))
+            staged_stops_dir = os.path.join(staging_dir, 'stops')
+            os.makedirs(staged_stops_dir)
+
+            # Stage 1
+            entry = stops_of_lines.process_workbook(input_path, os.path.join(staged_stops_dir, stops_name))
+            if entry['status'] != 'ok':
+                self.log(f"  - Stage 1 failed for {name}: {entry['error']}")
+                return False
+
+            # Written under a staging tag and renamed with the outputs, so a failed build
+            # leaves the run of the last good build in the store
+            if self.store is not None:
+                store_run = self.store.start_run(
+                    f"{os.path.splitext(name)[0]}{STAGING_TAG_SUFFIX}", source=os.path.abspath(input_path),
+                    settings={'bus_capacities': self.bus_capacities, 'headways': self.headways,
+                              'dwell_time': self.dwell_time, **self.plan_variant}
+                )
+
+            # Stage 2
+            _, processed_lines = load_processed_lines(os.path.join(staged_stops_dir, stops_name))
+            staged_plans_dir, plan_files = generate_operational_plans(
+                processed_lines, staging_dir, self.bus_capacities, self.headways, self.dwell_time,
+                output_mode=self.output_mode, store_run=store_run, pareto=self.pareto, **self.plan_variant
+            )
+
+            # Stage 3
+            staged_summaries_dir = os.path.join(staging_dir, 'Summaries')
+            os.makedirs(staged_summaries_dir)
+            summary_files = hub_summary.summarize_hubs(staged_plans_dir, staged_summaries_dir, lambda message: None,
+                                                       store_run)
+
+            scenario_dir = self.scenario_dir(input_path)
+            os.makedirs(scenario_dir, exist_ok=True)
+            os.replace(os.path.join(staged_stops_dir, stops_name), self.stops_output_path(input_path))
+            publish_folder(staged_plans_dir, os.path.join(scenario_dir, 'Operational_Plans'))
+            publish_folder(staged_summaries_dir, os.path.join(scenario_dir, 'Summaries'))
+            if store_run is not None:
+                self.store.publish_run(store_run, os.path.splitext(name)[0])
+                store_run = None
+
+            self.log(f"  - {len(plan_files)} plan files, {len(summary_files)} hub summaries "
+                     f"in {time.perf_counter() - started:.1f}s")
+            return True
+        except Exception as e:
+            self.log(f"  - Error rebuilding {name}: {str(e)}")
+            return False
+        finally:
+            shutil.rmtree(staging_dir, ignore_errors=True)
+            if store_run is not None:
+                self.store.delete_run(store_run.tag)
+
+    def run(self, poll_interval=1.0, once=False):
+        self.prime()
+        self.log(f"Watching {os.path.abspath(self.input_dir)} -> {os.path.abspath(self.output_dir)}")
+        try:
+            while True:
+                self.poll()
+                # --once stops when only workbooks that failed unchanged are left
+                if once and all(self.failed.get(path) == signature for path, (signature, _) in self.pending.items()):
+                    break
+                time.sleep(poll_interval)
+        except KeyboardInterrupt:
+            self.log("Stopped watching")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Watch a folder of Visum workbooks and rebuild stops, operational plans and hub summaries on change."
+    )
+    parser.add_argument('input_dir', help="Folder containing the Visum workbooks")
+    parser.add_argument('--output-dir', help="Output folder (default: <input_dir>/South_Med_Output)")
+    parser.add_argument('--variant', choices=sorted(PLAN_VARIANTS), default='designed',
+                        help="Operational plan variant (default: designed)")
+    parser.add_argument('--bus-capacities', type=parse_capacities, default=[25, 50])
+    parser.add_argument('--headways', type=parse_headways, default=[10, 15, 20, 25, 30],
+                        help="Headways in minutes: '10, 15, 20', a range '3:60[:step]' or 'clockface'")
+    parser.add_argument('--dwell-time', type=int, default=3)
+    parser.add_argument('--output-mode', choices=PLAN_OUTPUT_MODES, default='per_line',
+                        help="Layout of the operational plans (default: per_line)")
+    parser.add_argument('--pareto', choices=PLAN_PARETO_MODES, default='off',
+                        help="Write the Pareto-optimal options per line and hub ('export'), and mark them in the plans ('highlight')")
+    parser.add_argument('--results-db', help="Also record every build in this SQLite result store")
+    parser.add_argument('--settle', type=float, default=2.0,
+                        help="Seconds a workbook must stay unchanged before it is processed (default: 2)")
+    parser.add_argument('--interval', type=float, default=1.0, help="Polling interval in seconds (default: 1)")
+    parser.add_argument('--retry', type=float, default=30.0,
+                        help="Seconds before a workbook whose build failed is tried again (default: 30)")
+    parser.add_argument('--once', action='store_true', help="Process pending workbooks and exit")
+    return parser.parse_args(argv)
+
+
+def main():
+    args = parse_args()
+    if not os.path.isdir(args.input_dir):
+        print(f"Input folder not found: {args.input_dir}")
+        sys.exit(1)
+
+    output_dir = args.output_dir or os.path.join(args.input_dir, 'South_Med_Output')
+    watcher = ExportWatcher(args.input_dir, output_dir, args.variant, args.bus_capacities,
+                            args.headways, args.dwell_time, args.settle, args.output_mode, args.results_db,
+                            pareto=args.pareto, retry_seconds=args.retry)
+    watcher.run(args.interval, args.once)
+    if args.once and watcher.failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
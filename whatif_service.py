@@ -0,0 +1,247 @@
+import argparse
+import json
+import math
+import sys
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+from plan_engine import PLAN_VARIANTS, RouteAnalyzer, load_processed_lines, passenger_metrics
+
+
+# Local HTTP/JSON service answering what-if questions on the operational plans.
+# The stage 1 output is loaded once; every query only redoes the plan arithmetic.
+VARIANT_DEFAULT = object()  # use the demand factor of the service's plan variant
+
+
+class WhatIfPlanner:
+    def __init__(self, processed_lines, variant='designed'):
+        self.variant = PLAN_VARIANTS[variant]
+        self.lines = {}
+        self.hubs = {}
+
+        for line_name, routes in processed_lines.items():
+            # With a dwell time of 0 the cycle time is the pure runtime, dwell is added per query
+            analyzer = RouteAnalyzer(line_name, routes, dwell_time=0)
+            hub_name = routes[0]['HubName'] if routes else 'N/A'
+            desired_demand = analyzer.get_route_demands(routes)['Desired_Demand']
+
+            self.lines[str(line_name)] = {
+                'line': str(line_name),
+                'hub': hub_name,
+                'routes': [route['LINEROUTENAME'] for route in routes],
+                'runtime_minutes': analyzer.calculate_cycle_time(routes),
+                'stop_count': analyzer.count_stops(routes),
+                # Plain Python numbers so results serialize to JSON
+                'desired_demand': desired_demand.item() if hasattr(desired_demand, 'item') else desired_demand,
+            }
+            self.hubs.setdefault(hub_name, []).append(str(line_name))
+
+    def evaluate_line(self, line, bus_capacity, headway, dwell_time=3, demand_factor=VARIANT_DEFAULT, hub_area_per_bus=None):
+        """Plan one line for a capacity, headway, dwell time and demand factor"""
+        if line not in self.lines:
+            raise KeyError(f"Unknown line: {line}")
+        if bus_capacity <= 0 or headway <= 0:
+            raise ValueError("bus_capacity and headway must be positive")
+
+        # Omitted settings fall back to the plan variant the service was started with
+        if demand_factor is VARIANT_DEFAULT:
+            demand_factor = self.variant['demand_factor']
+        if hub_area_per_bus is None:
+            hub_area_per_bus = self.variant['hub_area_per_bus']
+
+        line_inputs = self.lines[line]
+        analyzer = RouteAnalyzer(line, [], dwell_time, demand_factor, hub_area_per_bus)
+
+        desired_demand = line_inputs['desired_demand']
+        plan_demand = desired_demand if demand_factor is None else math.ceil(desired_demand * demand_factor)
+        cycle_time = line_inputs['runtime_minutes'] + line_inputs['stop_count'] * dwell_time
+
+        system_analysis = analyzer.analyze_system_with_headway(plan_demand, cycle_time, headway, bus_capacity)
+        in_vehicle_time = cycle_time / len(line_inputs['routes']) if line_inputs['routes'] else 0
+        passenger = passenger_metrics(plan_demand, in_vehicle_time, headway, system_analysis['total_capacity_per_hour'])
+        return {
+            'line': line,
+            'hub': line_inputs['hub'],
+            'bus_capacity': bus_capacity,
+            'headway': headway,
+            'dwell_time': dwell_time,
+            'demand_factor': demand_factor,
+            'desired_demand': desired_demand,
+            'plan_demand': plan_demand,
+            'cycle_time': round(cycle_time, 1),
+            'buses_per_group': system_analysis['buses_per_group'],
+            'total_trips': system_analysis['total_trips'],
+            'groups_per_hour': system_analysis['groups_per_hour'],
+            'unique_groups': system_analysis['unique_groups'],
+            'fleet_size': system_analysis['fleet_size_performing_Headway_for_1_Hour'],
+            'hub_area': system_analysis['hub_area_for_1_hour'],
+            'capacity_per_hour': round(system_analysis['total_capacity_per_hour'], 1),
+            'empty_seats_per_hour': round(system_analysis['empty_seats'], 1),
+            'wait_time': round(passenger['wait_time'].item(), 2),
+            'load_factor': round(passenger['load_factor'].item(), 3),
+            'in_vehicle_time': round(passenger['in_vehicle_time'].item(), 1),
+            'generalized_cost': round(passenger['generalized_cost'].item(), 1),
+        }
+
+    def evaluate_hub(self, hub, bus_capacity, headway, dwell_time=3, demand_factor=VARIANT_DEFAULT,
+                     hub_area_per_bus=None, line_overrides=None):
+        """Plan every line of a hub; line_overrides maps a line to its own settings"""
+        if hub not in self.hubs:
+            raise KeyError(f"Unknown hub: {hub}")
+
+        line_results = []
+        for line in self.hubs[hub]:
+            settings = {
+                'bus_capacity': bus_capacity,
+                'headway': headway,
+                'dwell_time': dwell_time,
+                'demand_factor': demand_factor,
+                'hub_area_per_bus': hub_area_per_bus,
+            }
+            settings.update((line_overrides or {}).get(line, {}))
+            line_results.append(self.evaluate_line(line, **settings))
+
+        totals = {}
+        for key in ('fleet_size', 'hub_area', 'total_trips', 'capacity_per_hour', 'empty_seats_per_hour'):
+            totals[key] = round(sum(result[key] for result in line_results), 1)
+
+        return {'hub': hub, 'lines': line_results, 'totals': totals}
+
+    def answer(self, query):
+        """Dispatch one JSON query: {"line": ...} or {"hub": ...} plus the plan settings"""
+        if not isinstance(query, dict):
+            raise ValueError("A query must be a JSON object")
+        query = dict(query)
+        if 'line' in query:
+            return self.evaluate_line(str(query.pop('line')), **self.read_settings(query))
+        if 'hub' in query:
+            hub = query.pop('hub')
+            overrides = query.pop('line_overrides', {})
+            if not isinstance(overrides, dict):
+                raise ValueError("'line_overrides' must map lines to their settings")
+            line_overrides = {
+                str(line): self.read_settings(settings, required=False)
+                for line, settings in overrides.items()
+            }
+            return self.evaluate_hub(hub, line_overrides=line_overrides, **self.read_settings(query))
+        raise ValueError("Query needs a 'line' or a 'hub'")
+
+    def read_settings(self, query, required=True):
+        if not isinstance(query, dict):
+            raise ValueError("Settings must be a JSON object")
+        settings = {}
+        for key, cast in (('bus_capacity', int), ('headway', float), ('dwell_time', float), ('hub_area_per_bus', float)):
+            if key in query:
+                settings[key] = cast(query[key])
+            elif required and key in ('bus_capacity', 'headway'):
+                raise ValueError(f"Missing '{key}'")
+        if 'demand_factor' in query:
+            settings['demand_factor'] = None if query['demand_factor'] is None else float(query['demand_factor'])
+        unknown = set(query) - {'bus_capacity', 'headway', 'dwell_time', 'hub_area_per_bus', 'demand_factor'}
+        if unknown:
+            raise ValueError(f"Unknown settings: {', '.join(sorted(unknown))}")
+        return settings
+
+
+class WhatIfRequestHandler(BaseHTTPRequestHandler):
+    # GET  /health, /lines, /hubs
+    # POST /line, /hub  with one query, /batch with {"queries": [...]}
+    planner = None
+
+    def do_GET(self):
+        path = urlparse(self.path).path
+        if path == '/health':
+            self.send_json(200, {'status': 'ok', 'lines': len(self.planner.lines), 'hubs': len(self.planner.hubs)})
+        elif path == '/lines':
+            self.send_json(200, list(self.planner.lines.values()))
+        elif path == '/hubs':
+            self.send_json(200, self.planner.hubs)
+        else:
+            self.send_json(404, {'error': f"Unknown path: {path}"})
+
+    def do_POST(self):
+        path = urlparse(self.path).path
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            payload = json.loads(self.rfile.read(length) or b'{}')
+            if not isinstance(payload, dict):
+                raise ValueError("The body must be a JSON object")
+
+            if path == '/line':
+                if 'line' not in payload:
+                    raise ValueError("Missing 'line'")
+                self.send_json(200, self.planner.answer(payload))
+            elif path == '/hub':
+                if 'hub' not in payload:
+                    raise ValueError("Missing 'hub'")
+                self.send_json(200, self.planner.answer(payload))
+            elif path == '/batch':
+                queries = payload.get('queries', [])
+                if not isinstance(queries, list):
+                    raise ValueError("'queries' must be a list")
+                results = []
+                for query in queries:
+                    # One bad query should not fail the whole batch
+                    try:
+                        results.append(self.planner.answer(query))
+                    except (KeyError, ValueError, TypeError) as e:
+                        results.append({'error': str(e).strip("'")})
+                self.send_json(200, {'results': results})
+            else:
+                self.send_json(404, {'error': f"Unknown path: {path}"})
+        except KeyError as e:
+            self.send_json(404, {'error': str(e).strip("'")})
+        except (ValueError, TypeError) as e:
+            self.send_json(400, {'error': str(e)})
+
+    def send_json(self, status, body):
+        data = json.dumps(body, default=str).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def make_server(planner, host='127.0.0.1', port=8765):
+    handler = type('BoundWhatIfRequestHandler', (WhatIfRequestHandler,), {'planner': planner})
+    return ThreadingHTTPServer((host, port), handler)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Serve what-if queries on the operational plans over HTTP/JSON.")
+    parser.add_argument('input_file', help="Stage 1 output workbook (stops of lines)")
+    parser.add_argument('--variant', choices=sorted(PLAN_VARIANTS), default='designed',
+                        help="Default demand factor and hub area per bus (default: designed)")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    return parser.parse_args(argv)
+
+
+def main():
+    args = parse_args()
+    started = time.perf_counter()
+    try:
+        _, processed_lines = load_processed_lines(args.input_file)
+    except (OSError, ValueError) as e:
+        print(f"Error loading file: {str(e)}")
+        sys.exit(1)
+
+    planner = WhatIfPlanner(processed_lines, args.variant)
+    server = make_server(planner, args.host, args.port)
+    print(f"Loaded {len(planner.lines)} lines in {time.perf_counter() - started:.1f}s, "
+          f"serving on http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()